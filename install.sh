@@ -117,7 +117,7 @@ case \$SERVER in
     ;;
   gunicorn)
     echo "Starting with Gunicorn production server..."
-    gunicorn -b 0.0.0.0:5000 -w 4 wsgi:app
+    gunicorn -c project/gunicorn.conf.py -b 0.0.0.0:5000 -w 4 wsgi:app
     ;;
   *)
     echo "Unknown server: \$SERVER"
@@ -192,7 +192,7 @@ After=network.target
 Type=simple
 User=$CURRENT_USER
 WorkingDirectory=$CURRENT_DIR
-ExecStart=$CURRENT_DIR/venv/bin/gunicorn --workers=2 --bind=0.0.0.0:5000 wsgi:app
+ExecStart=$CURRENT_DIR/venv/bin/gunicorn -c project/gunicorn.conf.py --workers=2 --bind=0.0.0.0:5000 wsgi:app
 Environment=\"FLASK_APP=project/app.py\"
 Environment=\"FLASK_ENV=production\"
 Restart=always
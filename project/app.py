@@ -5,43 +5,253 @@ import os
 import json
 import serial.tools.list_ports
 from project.inverter.monitor import P18InverterMonitor
+from project.inverter.acquisition import create_engine, ConfigurationWatcher
+from project.inverter.parallel import create_parallel_poller
+from project.inverter.broker import BrokerTransport
+from project.inverter.capabilities import CapabilityMap
+from project.inverter.fleet import create_fleet_hub
+from project.inverter.modbus import create_modbus_gateway
+from project.inverter.mqtt import create_mqtt_publisher
+from project.inverter.uplink import create_uplink
+from project.inverter.serial_process import SerialProcessTransport
+from project.inverter.warm_start import create_warm_start
+from project.inverter.shared_state import SharedAcquisitionView, default_shared_state_path
+from project.inverter.retention import create_compactor
+from project.inverter.store import create_telemetry_store
 from project.inverter.api.routes import api_bp
-from project.inverter.utils.port_detector import InverterPortDetector
+from project.inverter.utils.port_detector import InverterPortDetector, start_hotplug_watcher
+from project.inverter.utils import group_commit, serialization
 
-def create_app(config=None):
-    """Create and configure the Flask application"""
-    app = Flask(__name__)
-    
-    # Enable CORS
-    CORS(app)
-    
-    # Set secret key for sessions and flash messages
-    app.secret_key = os.environ.get('SECRET_KEY', 'p18-inverter-monitor-secret-key')
-    
-    # Default configuration
-    app.config.update(
-        DEBUG=True,
+def default_data_directory(config_file):
+    """Return where data files go by default: next to the config file, else in the app directory"""
+    if os.path.dirname(config_file):
+        return os.path.dirname(os.path.abspath(config_file))
+    return os.path.dirname(os.path.abspath(__file__))
+
+def load_config(config=None, logger=None):
+    """Build the configuration from defaults, environment, config file and overrides"""
+    data_directory = default_data_directory(os.environ.get('CONFIG_FILE', 'config.json'))
+    settings = dict(
+        DEBUG=os.environ.get('FLASK_DEBUG', '0') == '1',
+        JSONIFY_PRETTYPRINT_REGULAR=False,
+        JSON_SERIALIZER=os.environ.get('JSON_SERIALIZER', 'auto'),
         INVERTER_PORT=os.environ.get('INVERTER_PORT', '/dev/ttyUSB0'),
         INVERTER_BAUDRATE=int(os.environ.get('INVERTER_BAUDRATE', 2400)),
         INVERTER_TIMEOUT=int(os.environ.get('INVERTER_TIMEOUT', 1)),
         DASHBOARD_REFRESH_INTERVAL=int(os.environ.get('DASHBOARD_REFRESH_INTERVAL', 30)),
         LOG_LEVEL=os.environ.get('LOG_LEVEL', 'INFO'),
         CONFIG_FILE=os.environ.get('CONFIG_FILE', 'config.json'),
-        INVERTER_SERIAL=os.environ.get('INVERTER_SERIAL', None)
+        INVERTER_SERIAL=os.environ.get('INVERTER_SERIAL', None),
+        ACQUISITION_ENABLED=os.environ.get('ACQUISITION_ENABLED', '1') == '1',
+        ACQUISITION_MODE=os.environ.get('ACQUISITION_MODE', 'local'),
+        ACQUISITION_INTERVAL=float(os.environ.get('ACQUISITION_INTERVAL', 10)),
+        ACQUISITION_HISTORY_SIZE=int(os.environ.get('ACQUISITION_HISTORY_SIZE', 360)),
+        LONG_POLL_MAX_WAIT=float(os.environ.get('LONG_POLL_MAX_WAIT', 60)),
+        ACQUISITION_HEARTBEAT=float(os.environ.get('ACQUISITION_HEARTBEAT', 300)),
+        TELEMETRY_FILTERS=None,
+        SHARED_STATE_PATH=os.environ.get('SHARED_STATE_PATH', default_shared_state_path()),
+        SERIAL_LOCK_FILE=os.environ.get('SERIAL_LOCK_FILE', None),
+        SERIAL_BROKER_SOCKET=os.environ.get('SERIAL_BROKER_SOCKET', None),
+        SERIAL_IO_PROCESS=os.environ.get('SERIAL_IO_PROCESS', '0') == '1',
+        HOTPLUG_WATCH=os.environ.get('HOTPLUG_WATCH', '1') == '1',
+        WARM_START_FILE=os.environ.get('WARM_START_FILE', 'warm_start.json'),
+        WARM_START_SAVE_INTERVAL=float(os.environ.get('WARM_START_SAVE_INTERVAL', 300)),
+        CAPABILITIES_FILE=os.environ.get('CAPABILITIES_FILE', 'capabilities.json'),
+        COMMAND_BREAKER_THRESHOLD=int(os.environ.get('COMMAND_BREAKER_THRESHOLD', 3)),
+        COMMAND_BREAKER_COOLDOWN=float(os.environ.get('COMMAND_BREAKER_COOLDOWN', 30)),
+        PARALLEL_ENABLED=os.environ.get('PARALLEL_ENABLED', '0') == '1',
+        PARALLEL_UNITS=int(os.environ.get('PARALLEL_UNITS', 9)),
+        PARALLEL_INTERVAL=float(os.environ.get('PARALLEL_INTERVAL', 10)),
+        PARALLEL_DISCOVERY_INTERVAL=float(os.environ.get('PARALLEL_DISCOVERY_INTERVAL', 300)),
+        ADAPTIVE_POLLING=os.environ.get('ADAPTIVE_POLLING', '0') == '1',
+        ACQUISITION_MIN_INTERVAL=float(os.environ.get('ACQUISITION_MIN_INTERVAL', 2)),
+        ACQUISITION_MAX_INTERVAL=float(os.environ.get('ACQUISITION_MAX_INTERVAL', 60)),
+        POWER_SWING_THRESHOLD=float(os.environ.get('POWER_SWING_THRESHOLD', 50)),
+        ADAPTIVE_FAST_HOLD=float(os.environ.get('ADAPTIVE_FAST_HOLD', 60)),
+        SERIAL_DUTY_CYCLE=float(os.environ.get('SERIAL_DUTY_CYCLE', 0.25)),
+        MQTT_HOST=os.environ.get('MQTT_HOST', None),
+        MQTT_PORT=int(os.environ.get('MQTT_PORT', 1883)),
+        MQTT_TOPIC=os.environ.get('MQTT_TOPIC', 'p18'),
+        MQTT_MODE=os.environ.get('MQTT_MODE', 'fields'),
+        MQTT_QOS=int(os.environ.get('MQTT_QOS', 0)),
+        MQTT_RETAIN=os.environ.get('MQTT_RETAIN', '1') == '1',
+        MQTT_CHANGE_ONLY=os.environ.get('MQTT_CHANGE_ONLY', '1') == '1',
+        MQTT_QUEUE_SIZE=int(os.environ.get('MQTT_QUEUE_SIZE', 1000)),
+        MQTT_CLIENT_ID=os.environ.get('MQTT_CLIENT_ID', None),
+        MQTT_USERNAME=os.environ.get('MQTT_USERNAME', None),
+        MQTT_PASSWORD=os.environ.get('MQTT_PASSWORD', None),
+        ACQUISITION_FAULTS=os.environ.get('ACQUISITION_FAULTS', '0') == '1',
+        ENERGY_POLL_INTERVAL=float(os.environ.get('ENERGY_POLL_INTERVAL', 300)),
+        MODBUS_PORT=int(os.environ.get('MODBUS_PORT', 0)),
+        MODBUS_HOST=os.environ.get('MODBUS_HOST', '0.0.0.0'),
+        MODBUS_UNIT_ID=int(os.environ.get('MODBUS_UNIT_ID', 0)),
+        UPLINK_URL=os.environ.get('UPLINK_URL', ''),
+        UPLINK_DIR=os.environ.get('UPLINK_DIR', 'outbox'),
+        UPLINK_SITE=os.environ.get('UPLINK_SITE', None),
+        UPLINK_INTERVAL=float(os.environ.get('UPLINK_INTERVAL', 30)),
+        UPLINK_BATCH_SIZE=int(os.environ.get('UPLINK_BATCH_SIZE', 500)),
+        UPLINK_TIMEOUT=float(os.environ.get('UPLINK_TIMEOUT', 10)),
+        UPLINK_MAX_BYTES=int(os.environ.get('UPLINK_MAX_BYTES', 64 * 1024 * 1024)),
+        UPLINK_TOKEN=os.environ.get('UPLINK_TOKEN', None),
+        FLEET_NODES=os.environ.get('FLEET_NODES', ''),
+        FLEET_TIMEOUT=float(os.environ.get('FLEET_TIMEOUT', 2)),
+        FLEET_CACHE_TTL=float(os.environ.get('FLEET_CACHE_TTL', 5)),
+        FLEET_WORKERS=int(os.environ.get('FLEET_WORKERS', 16)),
+        TELEMETRY_STORE=os.environ.get('TELEMETRY_STORE', os.path.join(data_directory, 'telemetry')),
+        RETENTION_TIERS=os.environ.get('RETENTION_TIERS', 'raw=7d,1m=90d,1h=5y'),
+        RETENTION_INTERVAL=float(os.environ.get('RETENTION_INTERVAL', 300)),
+        RETENTION_BUDGET=float(os.environ.get('RETENTION_BUDGET', 2)),
+        SKETCH_FIELDS=os.environ.get('SKETCH_FIELDS', 'output.active_power,battery.voltage,temperature.heatsink'),
+        SKETCH_COMPRESSION=int(os.environ.get('SKETCH_COMPRESSION', 50)),
+        WRITE_COMMIT_INTERVAL=float(os.environ.get('WRITE_COMMIT_INTERVAL', 30)),
+        WRITE_COMMIT_BYTES=int(os.environ.get('WRITE_COMMIT_BYTES', 256 * 1024)),
+        WRITE_FSYNC=os.environ.get('WRITE_FSYNC', '1') == '1'
     )
     
     # Load configuration from file if exists
-    if os.path.exists(app.config['CONFIG_FILE']):
+    if os.path.exists(settings['CONFIG_FILE']):
         try:
-            with open(app.config['CONFIG_FILE'], 'r') as f:
+            with open(settings['CONFIG_FILE'], 'r') as f:
                 file_config = json.load(f)
-                app.config.update(file_config)
+                settings.update(file_config)
         except Exception as e:
-            app.logger.error(f"Error loading config file: {e}")
+            if logger:
+                logger.error(f"Error loading config file: {e}")
     
     # Override with provided config
     if config:
-        app.config.update(config)
+        settings.update(config)
+    return settings
+
+def create_monitor(config, port=None):
+    """Create the live monitor: through the serial broker or a serial process when configured"""
+    port = port or config['INVERTER_PORT']
+    capabilities = CapabilityMap(config['CAPABILITIES_FILE'] or None,
+                                 failure_threshold=config['COMMAND_BREAKER_THRESHOLD'],
+                                 cooldown=config['COMMAND_BREAKER_COOLDOWN'])
+    if config['SERIAL_BROKER_SOCKET']:
+        transport = BrokerTransport(config['SERIAL_BROKER_SOCKET'])
+    elif config['SERIAL_IO_PROCESS']:
+        transport = SerialProcessTransport(port, port_lock_file=config['SERIAL_LOCK_FILE'],
+                                           hotplug=config['HOTPLUG_WATCH'])
+    else:
+        return P18InverterMonitor(port=port, port_lock_file=config['SERIAL_LOCK_FILE'],
+                                  capabilities=capabilities)
+    return P18InverterMonitor(port=port, transport=transport, capabilities=capabilities)
+
+def watch_hotplug(app):
+    """(Re)start the hotplug watcher for the live monitor if it owns the port"""
+    if getattr(app, 'hotplug_watcher', None) is not None:
+        app.hotplug_watcher.stop()
+    app.hotplug_watcher = None
+    if app.config['HOTPLUG_WATCH'] and app.monitor.transport is None:
+        app.hotplug_watcher = start_hotplug_watcher(app.monitor, app.port_detector)
+
+def same_port(port, other):
+    """Return True if two port paths (e.g. a by-id link and its ttyUSB node) are one device"""
+    if not port or not other:
+        return False
+    return os.path.realpath(port) == os.path.realpath(other)
+
+def probe_device(app, port):
+    """Read protocol ID, serial number and firmware version of the inverter on port
+
+    The live monitor is borrowed when it already talks to that port, so the
+    test does not fight it for the port; only another port gets a temporary
+    connection. Either way the inverter is queried live, and None is
+    returned when it is not connected.
+    """
+    live = app.monitor
+    borrowed = same_port(port, live.port)
+    if borrowed:
+        monitor = live
+        if not monitor.connected:
+            return None
+    else:
+        monitor = P18InverterMonitor(port=port, auto_reconnect=False,
+                                     port_lock_file=app.config['SERIAL_LOCK_FILE'])
+        if not monitor.connect():
+            return None
+    try:
+        result, _ = monitor.send_p18_command('PI', fresh=True)
+        protocol_id = monitor.parse_protocol_id(result) if result else None
+        
+        serial_number = None
+        result, _ = monitor.send_p18_command('ID', fresh=True)
+        serial_data = monitor.parse_serial_number(result) if result else None
+        if serial_data:
+            serial_number = serial_data.get('serial_number')
+        
+        firmware_version = "Unknown"
+        result, _ = monitor.send_p18_command('VFW', fresh=True)
+        firmware = monitor.parse_firmware_version(result) if result else None
+        if firmware:
+            firmware_version = firmware['main_cpu_version']
+        if not monitor.connected:
+            return None
+    finally:
+        if not borrowed:
+            monitor.disconnect()
+    return {
+        'protocol_id': protocol_id,
+        'serial_number': serial_number,
+        'firmware_version': firmware_version,
+        'shared_connection': borrowed
+    }
+
+def switch_port(app, port):
+    """Move the live monitor to port without losing its caches or the acquisition history
+
+    A monitor that owns the port simply reattaches. One that talks through a
+    serial process is replaced by a new one sharing its capability map, and
+    the old one is closed only after every user points to the new one.
+
+    Returns:
+        str or None: What still has to be done by hand for the port to be used
+    """
+    monitor = app.monitor
+    if same_port(port, monitor.port):
+        return None
+    if monitor.transport is None:
+        monitor.reattach(port)
+    elif app.config['SERIAL_IO_PROCESS']:
+        replacement = create_monitor(app.config, port)
+        replacement.capabilities = monitor.capabilities
+        app.monitor = replacement
+        app.acquisition.monitor = replacement
+        if app.acquisition.configuration_watcher is not None:
+            app.acquisition.configuration_watcher.monitor = replacement
+        if app.parallel is not None and app.parallel.monitor is not None:
+            app.parallel.monitor = replacement
+        if app.warm_start is not None:
+            app.warm_start.monitor = replacement
+        monitor.disconnect()
+    else:
+        # The broker daemon owns the port; it has to be restarted with the new one
+        monitor.port = port
+        return f"The acquisition daemon owns the serial port: restart it to switch to {port}."
+    watch_hotplug(app)
+    return None
+
+def create_app(config=None):
+    """Create and configure the Flask application"""
+    app = Flask(__name__)
+    
+    # Enable CORS
+    CORS(app)
+    
+    # Set secret key for sessions and flash messages
+    app.secret_key = os.environ.get('SECRET_KEY', 'p18-inverter-monitor-secret-key')
+    
+    # Defaults, environment, config file and provided config
+    app.config.update(load_config(config, app.logger))
+    
+    # Select the JSON backend for hot responses and set up the response cache
+    serialization.configure(app.config['JSON_SERIALIZER'])
+    app.response_cache = serialization.SerializedResponseCache()
+    # Telemetry, events and settings reach the disk in group commits
+    app.writer = group_commit.configure(app.config['WRITE_COMMIT_INTERVAL'],
+                                        app.config['WRITE_COMMIT_BYTES'], app.config['WRITE_FSYNC'])
     
     # Initialize port detector
     app.port_detector = InverterPortDetector()
@@ -53,7 +263,51 @@ def create_app(config=None):
             app.config['INVERTER_PORT'] = preferred_port
     
     # Initialize inverter monitor
-    app.monitor = P18InverterMonitor(port=app.config['INVERTER_PORT'])
+    app.monitor = create_monitor(app.config)
+    watch_hotplug(app)
+    
+    # Start background acquisition of numbered snapshots. In shared mode a
+    # separate acquisition process owns the port and this worker only mirrors
+    # the snapshots it publishes to shared memory.
+    if app.config['ACQUISITION_MODE'] == 'shared':
+        app.acquisition = SharedAcquisitionView(app.config['SHARED_STATE_PATH'],
+                                                history_size=app.config['ACQUISITION_HISTORY_SIZE'])
+        app.acquisition.configuration_watcher = ConfigurationWatcher(app.monitor).attach(app.acquisition)
+    else:
+        app.acquisition = create_engine(app.monitor, app.config)
+    
+    # Serve the last known identity, ratings and snapshot right away (marked
+    # stale) while they are revalidated. In shared mode the acquisition
+    # process restores and saves the snapshot.
+    shared = app.config['ACQUISITION_MODE'] == 'shared'
+    app.warm_start = create_warm_start(app.monitor, None if shared else app.acquisition,
+                                       app.config, persist=not shared)
+    # Push snapshots to MQTT; in shared mode the acquisition process does it
+    app.mqtt = None if shared else create_mqtt_publisher(app.acquisition, app.config)
+    # Serve the snapshot as Modbus registers (likewise from the acquisition process in shared mode)
+    app.modbus = None if shared else create_modbus_gateway(app.acquisition, app.config)
+    # Store-and-forward telemetry to a central collector
+    app.uplink = None if shared else create_uplink(app.acquisition, app.config)
+    # Record every snapshot on disk; shared-mode workers only read what the daemon records
+    app.telemetry_store = create_telemetry_store(None if shared else app.acquisition, app.config)
+    # Downsample and expire old history in the background (the daemon does it in shared mode)
+    app.compactor = create_compactor(app.telemetry_store, app.config, start=not shared)
+    if app.config['ACQUISITION_ENABLED']:
+        app.acquisition.start()
+    
+    # Poll every unit of a parallel system in one batch per cycle. Shared-mode
+    # workers mirror the group snapshot the acquisition process publishes.
+    if shared and app.config['PARALLEL_ENABLED']:
+        app.parallel = SharedAcquisitionView(app.config['SHARED_STATE_PATH'],
+                                             history_size=app.config['ACQUISITION_HISTORY_SIZE'],
+                                             section='parallel')
+    else:
+        app.parallel = create_parallel_poller(app.monitor, app.config)
+    if app.parallel is not None and app.config['ACQUISITION_ENABLED']:
+        app.parallel.start()
+    
+    # Hub mode: aggregate other monitor instances
+    app.fleet = create_fleet_hub(app.config)
     
     # Register blueprints
     app.register_blueprint(api_bp)
@@ -71,7 +325,7 @@ def create_app(config=None):
         
         if request.method == 'POST':
             try:
-                # Get form data
+                # Validate the whole form before anything is applied
                 port = request.form.get('port')
                 baudrate = int(request.form.get('baudrate', 2400))
                 timeout = int(request.form.get('timeout', 1))
@@ -79,17 +333,6 @@ def create_app(config=None):
                 log_level = request.form.get('log_level', 'INFO')
                 inverter_serial = request.form.get('inverter_serial')
                 
-                # Update configuration
-                app.config.update(
-                    INVERTER_PORT=port,
-                    INVERTER_BAUDRATE=baudrate,
-                    INVERTER_TIMEOUT=timeout,
-                    DASHBOARD_REFRESH_INTERVAL=refresh_interval,
-                    LOG_LEVEL=log_level,
-                    INVERTER_SERIAL=inverter_serial
-                )
-                
-                # Save configuration to file
                 config_to_save = {
                     'INVERTER_PORT': port,
                     'INVERTER_BAUDRATE': baudrate,
@@ -99,48 +342,33 @@ def create_app(config=None):
                     'INVERTER_SERIAL': inverter_serial
                 }
                 
-                with open(app.config['CONFIG_FILE'], 'w') as f:
-                    json.dump(config_to_save, f, indent=4)
+                # Save configuration to file now (atomically, so a failed write
+                # changes nothing; an unchanged file is not rewritten)
+                app.writer.replace(app.config['CONFIG_FILE'], json.dumps(config_to_save, indent=4), 'config')
+                app.writer.commit()
+                if app.writer.pending(app.config['CONFIG_FILE']):
+                    raise OSError(app.writer.last_error)
+                
+                # Apply it: the live monitor moves to the new port (if it changed)
+                # and keeps its caches; acquisition and its history carry on
+                app.config.update(config_to_save)
+                pending = switch_port(app, port) if port else None
                 
                 # If inverter serial is provided, save the port mapping
                 if inverter_serial and port:
-                    # Test connection to get inverter info
-                    test_monitor = P18InverterMonitor(port=port)
-                    if test_monitor.connect():
-                        # Get serial number and protocol ID
-                        result, _ = test_monitor.send_p18_command('ID')
-                        serial_data = None
-                        if result:
-                            serial_data = test_monitor.parse_serial_number(result)
-                        
-                        # Get protocol ID
-                        result, _ = test_monitor.send_p18_command('PI')
-                        protocol_id = None
-                        if result:
-                            protocol_id = test_monitor.parse_protocol_id(result)
-                        
-                        # Get firmware version
-                        firmware_version = "Unknown"
-                        result, _ = test_monitor.send_p18_command('VFW')
-                        if result and ',' in result:
-                            firmware_version = result.split(',')[0].replace('^D', '').strip()
-                        
-                        # Save mapping
-                        app.port_detector.save_mapping(port, {
-                            "connected": True,
-                            "protocol_id": protocol_id,
-                            "serial_number": inverter_serial,
-                            "firmware_version": firmware_version
-                        })
-                        
-                        test_monitor.disconnect()
-                
-                # Reinitialize the monitor with new settings
-                if hasattr(app, 'monitor'):
-                    app.monitor.disconnect()
-                app.monitor = P18InverterMonitor(port=port)
+                    device = probe_device(app, port)
+                    if device is not None and not app.port_detector.save_mapping(port, {
+                        "connected": True,
+                        "protocol_id": device['protocol_id'],
+                        "serial_number": inverter_serial,
+                        "firmware_version": device['firmware_version']
+                    }):
+                        error_message = f"Settings saved, but not the port mapping: {app.writer.last_error}"
                 
-                success_message = "Settings saved successfully!"
+                if error_message is None:
+                    success_message = "Settings saved successfully!"
+                    if pending:
+                        success_message = f"Settings saved. {pending}"
             except Exception as e:
                 error_message = f"Error saving settings: {str(e)}"
         
@@ -157,40 +385,11 @@ def create_app(config=None):
             data = request.get_json()
             port = data.get('port', app.config['INVERTER_PORT'])
             
-            # Create a temporary monitor for testing
-            test_monitor = P18InverterMonitor(port=port)
-            if not test_monitor.connect():
+            # Borrows the live connection when port is the one in use
+            device = probe_device(app, port)
+            if device is None:
                 return jsonify({'success': False, 'error': 'Failed to connect to inverter'})
-            
-            # Try to get protocol ID
-            protocol_result, error = test_monitor.send_p18_command('PI')
-            protocol_id = None
-            if protocol_result:
-                protocol_id = test_monitor.parse_protocol_id(protocol_result)
-            
-            # Try to get serial number
-            serial_number = None
-            serial_result, error = test_monitor.send_p18_command('ID')
-            if serial_result:
-                serial_data = test_monitor.parse_serial_number(serial_result)
-                if serial_data:
-                    serial_number = serial_data.get('serial_number')
-            
-            # Try to get firmware version
-            firmware_version = "Unknown"
-            firmware_result, error = test_monitor.send_p18_command('VFW')
-            if firmware_result and ',' in firmware_result:
-                firmware_version = firmware_result.split(',')[0].replace('^D', '').strip()
-            
-            # Close the test connection
-            test_monitor.disconnect()
-            
-            return jsonify({
-                'success': True, 
-                'protocol_id': protocol_id,
-                'serial_number': serial_number,
-                'firmware_version': firmware_version
-            })
+            return jsonify(dict(device, success=True))
             
         except Exception as e:
             return jsonify({'success': False, 'error': str(e)})
@@ -205,7 +404,8 @@ def create_app(config=None):
                 ports.append({
                     'device': port.device,
                     'description': port.description,
-                    'hwid': port.hwid
+                    'hwid': port.hwid,
+                    'identity': app.port_detector.identity_of(port) or port.device
                 })
             return jsonify({'ports': ports})
         except Exception as e:
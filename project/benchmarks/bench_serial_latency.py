@@ -0,0 +1,112 @@
+# benchmarks/bench_serial_latency.py
+"""Benchmark P18 command latency while the web tier is under load
+
+Run from the repository root (Linux/macOS, needs pseudo-terminals):
+
+    python -m project.benchmarks.bench_serial_latency [commands] [load_threads]
+
+A SimulatedInverter answers on a pty as fast as it can, so the measured time
+is the host's own overhead rather than the 2400 baud line. For each
+serial mode the app is created, its history is filled with snapshots, and
+load threads request the full history as fast as they can (large JSON
+responses, i.e. CPU-bound work holding the GIL). Meanwhile GS commands are
+timed on app.monitor. "thread" is the in-process read loop, "process" is
+SERIAL_IO_PROCESS=1, for which the time spent inside the serial process is
+reported as well.
+"""
+import os
+import statistics
+import sys
+import threading
+import time
+
+from project.app import create_app
+from project.inverter.simulator import SimulatedInverter
+
+LINK = '/tmp/ttyP18BENCH'
+
+
+def percentile(values, fraction):
+    """Return the value at fraction (0..1) of the sorted values"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run(mode, commands, load_threads):
+    app = create_app({
+        'INVERTER_PORT': LINK,
+        'ACQUISITION_ENABLED': False,
+        'SERIAL_IO_PROCESS': mode == 'process',
+        'ACQUISITION_HEARTBEAT': 0,
+        'WARM_START_FILE': '',
+    })
+    monitor = app.monitor
+    # Seed the history so /history returns a large payload
+    result, _ = monitor.send_p18_command('GS')
+    data = monitor.parse_status_tree(result)
+    for _ in range(app.config['ACQUISITION_HISTORY_SIZE']):
+        app.acquisition.publish(data, force=True)
+
+    stop_event = threading.Event()
+    requests_served = [0]
+
+    def load():
+        client = app.test_client()
+        while not stop_event.is_set():
+            client.get('/api/v1/inverter/history')
+            requests_served[0] += 1
+
+    workers = [threading.Thread(target=load, daemon=True) for _ in range(load_threads)]
+    for worker in workers:
+        worker.start()
+    time.sleep(0.5)
+
+    latencies = []
+    wire_times = []
+    failures = 0
+    started = time.perf_counter()
+    for _ in range(commands):
+        begin = time.perf_counter()
+        response, _ = monitor.send_p18_command('GS')
+        latencies.append(time.perf_counter() - begin)
+        transport = monitor.transport
+        if transport is not None and transport.last_transaction_time is not None:
+            wire_times.append(transport.last_transaction_time)
+        if not response:
+            failures += 1
+    elapsed = time.perf_counter() - started
+
+    stop_event.set()
+    for worker in workers:
+        worker.join()
+    monitor.disconnect()
+
+    print(f"{mode:<8} {len(latencies):6d} cmds "
+          f"p50 {statistics.median(latencies) * 1000:8.1f} ms "
+          f"p99 {percentile(latencies, 0.99) * 1000:8.1f} ms "
+          f"max {max(latencies) * 1000:8.1f} ms "
+          f"failures {failures:3d} "
+          f"HTTP {requests_served[0] / elapsed:7.1f} req/s")
+    if wire_times:
+        print(f"{'':<8} inside the serial process: "
+              f"p50 {statistics.median(wire_times) * 1000:8.1f} ms "
+              f"p99 {percentile(wire_times, 0.99) * 1000:8.1f} ms")
+
+
+def main():
+    commands = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    load_threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    os.environ.setdefault('CONFIG_FILE', 'bench-config.json')
+
+    simulator = SimulatedInverter(LINK)
+    simulator.start()
+    try:
+        print(f"GS latency with {load_threads} threads requesting /history")
+        for mode in ('thread', 'process'):
+            run(mode, commands, load_threads)
+    finally:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# benchmarks/bench_serialization.py
+"""Benchmark JSON serialization of the hot status endpoint
+
+Run from the repository root:
+
+    python -m project.benchmarks.bench_serialization [iterations]
+
+Part 1 encodes a general status payload with the old pretty-printing jsonify
+path, compact stdlib json and orjson. Part 2 drives GET /api/v1/inverter/data/status
+through the Flask test client, once with a frame that changes on every poll
+(cache miss) and once with an unchanged frame (served from the bytes cache).
+"""
+import os
+import sys
+import time
+
+from flask import jsonify
+
+from project.app import create_app
+from project.inverter.monitor import P18InverterMonitor
+from project.inverter.utils import serialization
+
+GS_PAYLOAD = "2300,500,2300,500,1200,1050,018,482,000,000,022,000,085,038,035,000,0000,0000,0000,0000,0,1,1,1,2,2,0,0"
+
+
+class CannedMonitor(P18InverterMonitor):
+    """Monitor answering GS with a fixed or changing frame, parsed by the real parser"""
+
+    def __init__(self, changing=False):
+        super().__init__(port='canned', auto_reconnect=False)
+        self.changing = changing
+        self.counter = 0
+
+    def send_p18_command(self, command, fresh=False):
+        self.counter += 1
+        payload = GS_PAYLOAD
+        if self.changing:
+            # Vary the load power so every frame is distinct
+            fields = payload.split(',')
+            fields[5] = f"{1000 + self.counter % 9000:04d}"
+            payload = ','.join(fields)
+        return f"^D{len(payload) + 3:03d}{payload}", None
+
+
+def measure(label, func, iterations):
+    """Run func iterations times and print throughput and CPU per call"""
+    total_bytes = 0
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    for _ in range(iterations):
+        total_bytes += len(func())
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    print(f"{label:<32} {total_bytes / iterations:8.0f} B/op "
+          f"{total_bytes / wall / 1e6:8.2f} MB/s "
+          f"{cpu / iterations * 1e6:8.1f} us CPU/op "
+          f"{iterations / wall:10.0f} op/s")
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    os.environ.setdefault('CONFIG_FILE', 'bench-config.json')
+    app = create_app({'INVERTER_SERIAL': None, 'WARM_START_FILE': '', 'TELEMETRY_STORE': ''})
+
+    app.monitor = CannedMonitor()
+    with app.test_client() as client:
+        response = client.get('/api/v1/inverter/data/status')
+        # Timing error responses would say nothing about the status path
+        assert response.status_code == 200, response.get_data(as_text=True)
+        payload = response.get_json()
+
+    print(f"Serialization of the status payload ({iterations} iterations)")
+    with app.test_request_context():
+        app.config['DEBUG'] = True
+        measure('jsonify (debug, pretty)', lambda: jsonify(payload).get_data(), iterations)
+        app.config['DEBUG'] = False
+        measure('jsonify (compact)', lambda: jsonify(payload).get_data(), iterations)
+    serialization.configure('stdlib')
+    measure('stdlib json', lambda: serialization.dumps(payload), iterations)
+    if serialization.configure('orjson') == 'orjson':
+        measure('orjson', lambda: serialization.dumps(payload), iterations)
+    else:
+        print('orjson                           not installed')
+
+    print(f"\nGET /api/v1/inverter/data/status ({iterations} requests, backend={serialization.get_backend()})")
+    with app.test_client() as client:
+        app.monitor = CannedMonitor(changing=True)
+        assert client.get('/api/v1/inverter/data/status').status_code == 200
+        measure('changing frame (cache miss)',
+                lambda: client.get('/api/v1/inverter/data/status').get_data(), iterations)
+        app.monitor = CannedMonitor()
+        measure('unchanged frame (cache hit)',
+                lambda: client.get('/api/v1/inverter/data/status').get_data(), iterations)
+    print(f"\nresponse cache: {app.response_cache.stats()}")
+
+
+if __name__ == '__main__':
+    main()
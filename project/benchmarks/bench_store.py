@@ -0,0 +1,112 @@
+# benchmarks/bench_store.py
+"""Benchmark the telemetry store encoding: bytes per sample and query throughput
+
+Run from the repository root:
+
+    python -m project.benchmarks.bench_store [hours]
+
+Generates hours (default 24) of 1 Hz general status samples (every GS field,
+random-walking like a real day) and stores them three ways: NDJSON lines
+(the previous format), columnar blocks as committed every 10 s, and the
+same day after its blocks were merged. For each it prints the bytes per
+sample and the write amplification (bytes written per stored byte), then
+the throughput of a full-day row scan, a vectorized single-field column
+read and a one-hour range query. numpy is used for decoding when installed.
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from project.inverter import columnar
+from project.inverter.monitor import P18InverterMonitor
+from project.inverter.simulator import SIMULATED_RESPONSES, build_reply
+from project.inverter.store import LEGACY_SUFFIX, TelemetryStore
+from project.inverter.utils import serialization
+from project.inverter.utils.group_commit import GroupCommitWriter
+
+FLUSH_SAMPLES = 10
+
+
+def generate(hours, start=datetime(2025, 6, 1)):
+    """Yield (timestamp, flat GS sample) at 1 Hz with realistic slow variation"""
+    monitor = P18InverterMonitor.__new__(P18InverterMonitor)
+    reply = build_reply(SIMULATED_RESPONSES['GS']).decode('latin-1')
+    base = serialization.flatten(monitor.parse_status_tree(reply))
+    rng = random.Random(18)
+    state = dict(base)
+    for second in range(int(hours * 3600)):
+        for name, value in base.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            if rng.random() < 0.2:
+                step = rng.choice((-1, 1))
+                state[name] = round(max(0, state[name] + (step / 10 if isinstance(value, float) else step)), 1) \
+                    if isinstance(value, float) else max(0, state[name] + step)
+        # Poll jitter of a few milliseconds, as stamped by the acquisition clock
+        timestamp = start + timedelta(seconds=second, microseconds=rng.randint(0, 4000))
+        yield timestamp, dict(state)
+
+
+def throughput(label, samples, func):
+    started = time.perf_counter()
+    count = func()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<36} {count:10d} samples {elapsed:8.3f} s {count / elapsed:12.0f} samples/s")
+    return count
+
+
+def main():
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 24
+    directory = tempfile.mkdtemp(prefix='p18-bench-store-')
+    try:
+        store = TelemetryStore(directory, writer=GroupCommitWriter(fsync=False))
+        samples = list(generate(hours))
+        count = len(samples)
+        fields = len(samples[0][1])
+        day = samples[0][0].date()
+        print(f"{count} samples of {fields} fields, numpy {'on' if columnar.np is not None else 'off'}\n")
+
+        # Previous format: one JSON line per sample
+        legacy = b''.join(serialization.dumps({"seq": index, "timestamp": timestamp.isoformat(),
+                                                "fields": values}) + b'\n'
+                          for index, (timestamp, values) in enumerate(samples))
+
+        # Columnar, one block per commit
+        for offset in range(0, count, FLUSH_SAMPLES):
+            for timestamp, values in samples[offset:offset + FLUSH_SAMPLES]:
+                store.on_snapshot({"timestamp": timestamp.isoformat(), "flat": values})
+            store.flush()
+            store.writer.commit()
+        flushed = os.path.getsize(store._path(day))
+        written = store.bytes_written
+        started = time.perf_counter()
+        store.merge_day(day)
+        merge_time = time.perf_counter() - started
+        merged = os.path.getsize(store._path(day))
+
+        print(f"{'format':<36} {'bytes/sample':>12} {'bytes written/sample':>21}")
+        print(f"{'NDJSON lines':<36} {len(legacy) / count:12.1f} {len(legacy) / count:21.1f}")
+        print(f"{'columnar, 10 s blocks':<36} {flushed / count:12.1f} {written / count:21.1f}")
+        print(f"{'columnar, merged':<36} {merged / count:12.2f} {(written + merged) / count:21.1f}")
+        print(f"ratio NDJSON / merged: {len(legacy) / merged:.0f}x, merge took {merge_time:.2f} s\n")
+
+        throughput('row scan, merged day', count, lambda: sum(1 for _ in store.scan()))
+        throughput('column read (1 field, vectorized)', count,
+                   lambda: sum(len(timestamps) for timestamps, _ in store.columns(fields=['battery.voltage'])))
+        hour_start = samples[count // 2][0]
+        throughput('range query, 1 hour', count,
+                   lambda: sum(1 for _ in store.scan(hour_start, hour_start + timedelta(hours=1))))
+        os.remove(store._path(day))
+        with open(store._path(day, LEGACY_SUFFIX), 'wb') as f:
+            f.write(legacy)
+        throughput('row scan, NDJSON day', count, lambda: sum(1 for _ in store.scan()))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
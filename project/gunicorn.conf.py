@@ -0,0 +1,45 @@
+# gunicorn.conf.py
+"""Gunicorn configuration for running several web workers on one inverter
+
+    gunicorn -c project/gunicorn.conf.py wsgi:app
+
+The master starts one acquisition daemon that owns the serial port and
+publishes snapshots to shared memory; every worker runs in shared acquisition
+mode and reads them lock-free. Direct commands sent by workers go through the
+daemon's serial broker socket, so only the daemon ever opens the port.
+"""
+import os
+import tempfile
+
+from project.inverter.broker import default_broker_socket_path
+from project.inverter.daemon import start_acquisition_process
+from project.inverter.shared_state import default_shared_state_path
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+# Long-polling change feed requests hold a thread while they wait
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Set in the master before workers are forked, so everyone agrees on them
+os.environ['ACQUISITION_MODE'] = 'shared'
+os.environ.setdefault('SHARED_STATE_PATH', default_shared_state_path())
+os.environ.setdefault('SERIAL_LOCK_FILE', os.path.join(tempfile.gettempdir(), 'p18-monitor-serial.lock'))
+os.environ.setdefault('SERIAL_BROKER_SOCKET', default_broker_socket_path())
+
+
+def on_starting(server):
+    """Start the acquisition daemon before any worker is forked"""
+    daemon_env = dict(os.environ, ACQUISITION_MODE='daemon')
+    server.acquisition_process = start_acquisition_process(daemon_env)
+    server.log.info(f"Started acquisition daemon (pid {server.acquisition_process.pid})")
+
+
+def on_exit(server):
+    """Stop the acquisition daemon together with the master"""
+    process = getattr(server, 'acquisition_process', None)
+    if process and process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(10)
+        except Exception:
+            process.kill()
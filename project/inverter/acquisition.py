@@ -0,0 +1,380 @@
+# inverter/acquisition.py
+""" Background acquisition of inverter snapshots with a sequenced change feed """
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from .adaptive import create_scheduler
+from .clock import FixedRateClock, window_midpoint
+from .filters import SignificanceFilter
+from .utils.serialization import flatten, unflatten
+
+
+class AcquisitionEngine:
+    """Poll the inverter on a schedule and publish numbered snapshots
+
+    Every MOD/GS poll runs through an optional SignificanceFilter, and becomes a
+    snapshot with a monotonically increasing sequence number only when a field
+    actually changed (or heartbeat seconds passed since the last snapshot). The
+    most recent snapshots are kept in a ring so clients can ask for the fields
+    that changed since a sequence they already have, optionally blocking until
+    something changes (long-polling).
+    """
+
+    thread_name = 'p18-acquisition'
+
+    def __init__(self, monitor, interval=10, history_size=360, significance_filter=None, heartbeat=300):
+        self.monitor = monitor
+        self.interval = interval
+        self.significance_filter = significance_filter
+        self.heartbeat = heartbeat
+        self.samples = 0
+        self.last_sample_time = None
+        self.seq = 0
+        self.snapshots = deque(maxlen=history_size)
+        self.condition = threading.Condition()
+        self.listeners = []
+        self.configuration_watcher = None
+        # Optional AdaptivePollScheduler choosing the delay between polls
+        self.scheduler = None
+        # Polls start on a fixed-rate grid rather than interval seconds after the last one ended
+        self.clock = FixedRateClock(interval)
+        self.last_latency = None
+        # Also poll FWS every time, and ET/ED every energy_interval seconds (0: never)
+        self.poll_faults = False
+        self.energy_interval = 0
+        self._energy = None
+        self._energy_polled = None
+        self.last_error = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+    def start(self):
+        """Start the background polling thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the background polling thread"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def is_running(self):
+        """Return True while the polling thread is alive"""
+        return bool(self._thread and self._thread.is_alive())
+
+    def _run(self):
+        self.clock.reset()
+        while True:
+            self.clock.interval = self.scheduler.delay if self.scheduler is not None else self.interval
+            if not self.clock.wait(self._stop_event):
+                return
+            try:
+                self.poll_once()
+            except Exception as e:
+                self.last_error = f"Acquisition error: {str(e)}"
+
+    # ------------------------------------------------------------------
+    # Acquisition
+    # ------------------------------------------------------------------
+    def poll_once(self):
+        """Query MOD and GS (and FWS when polling adaptively) once and publish the result
+
+        Returns:
+            dict or None: The published snapshot, None if the poll failed
+        """
+        monitor = self.monitor
+        scheduler = self.scheduler
+        started = time.monotonic()
+
+        result, _ = monitor.send_p18_command('MOD', fresh=True)
+        working_mode = monitor.parse_mode_response(result) if result else 'Unknown'
+
+        result, error = monitor.send_p18_command('GS', fresh=True)
+        # The sample is stamped with the middle of the GS transaction, not the parse time
+        take_bus_window = getattr(monitor, 'take_bus_window', None)
+        window = take_bus_window() if take_bus_window else None
+        if not result:
+            self.last_error = error or 'No response to GS'
+            if scheduler is not None:
+                scheduler.observe_failure(time.monotonic() - started)
+            return None
+        try:
+            data = monitor.parse_status_tree(result)
+        except ValueError as e:
+            self.last_error = f"General status parse error: {str(e)}"
+            if scheduler is not None:
+                scheduler.observe_failure(time.monotonic() - started)
+            return None
+
+        data['working_mode'] = working_mode
+        if scheduler is not None or self.poll_faults:
+            # Fault flags are one of the triggers for faster polling
+            result, _ = monitor.send_p18_command('FWS', fresh=True)
+            try:
+                fault_status = monitor.parse_fault_status(result) if result else None
+            except ValueError:
+                fault_status = None
+            if fault_status is not None:
+                data['faults'] = dict(fault_status['faults'], code=fault_status['fault_code'])
+        if self.energy_interval:
+            self._poll_energy()
+            if self._energy is not None:
+                data['energy'] = dict(self._energy)
+        if scheduler is not None:
+            scheduler.observe(flatten(data), time.monotonic() - started)
+        self.last_error = None
+        self.samples += 1
+        self.last_sample_time = datetime.now().isoformat()
+        if window is None:
+            return self.publish(data)
+        self.last_latency = window[1] - window[0]
+        return self.publish(data, timestamp=window_midpoint(window), latency=self.last_latency)
+
+    def _poll_energy(self):
+        """Refresh the total and today's energy counters when they are due"""
+        now = time.monotonic()
+        if self._energy_polled is not None and now - self._energy_polled < self.energy_interval:
+            return
+        self._energy_polled = now
+        monitor = self.monitor
+        energy = {}
+        today = datetime.now()
+        for name, command in (('total_wh', 'ET'), ('today_wh', f"ED{today:%Y%m%d}")):
+            result, _ = monitor.send_p18_command(command, fresh=True)
+            try:
+                energy[name] = monitor.parse_energy(result) if result else None
+            except ValueError:
+                energy[name] = None
+        if any(value is not None for value in energy.values()):
+            self._energy = energy
+
+    def publish(self, data, force=False, timestamp=None, latency=None):
+        """Assign the next sequence number to data and notify waiters and listeners
+
+        The sample is filtered first; if no field changed and the heartbeat has
+        not expired the latest snapshot is returned and nothing is published.
+        timestamp is when the sample was measured (default: now) and latency the
+        seconds its serial transaction took.
+        """
+        flat = flatten(data)
+        if self.significance_filter is not None:
+            flat = self.significance_filter.apply(flat)
+            data = unflatten(flat)
+        return self._append(data, flat, force=force, timestamp=timestamp, latency=latency)
+
+    def ingest(self, snapshot):
+        """Append a snapshot published by another engine (or restored), keeping its sequence number"""
+        data = snapshot['data']
+        return self._append(data, flatten(data), force=True, seq=snapshot['seq'],
+                            timestamp=snapshot['timestamp'], stale=snapshot.get('stale', False),
+                            latency=snapshot.get('latency'))
+
+    def reset(self):
+        """Forget all retained snapshots and restart the sequence"""
+        with self.condition:
+            self.snapshots.clear()
+            self.seq = 0
+            self.condition.notify_all()
+
+    def _append(self, data, flat, force=False, seq=None, timestamp=None, stale=False, latency=None):
+        with self.condition:
+            last = self.snapshots[-1] if self.snapshots else None
+            previous = last['flat'] if last else {}
+            changed = {name for name, value in flat.items() if previous.get(name, object()) != value}
+            changed.update(name for name in previous if name not in flat)
+            # A live sample always replaces a stale (restored) snapshot
+            if last and not changed and not force and not last['stale'] and \
+                    (not self.heartbeat or time.monotonic() - last['monotonic'] < self.heartbeat):
+                return last
+            self.seq = seq if seq is not None else self.seq + 1
+            snapshot = {
+                'seq': self.seq,
+                'timestamp': timestamp or datetime.now().isoformat(),
+                'monotonic': time.monotonic(),
+                'data': data,
+                'flat': flat,
+                'changed': changed,
+                'stale': stale,
+                'latency': latency
+            }
+            self.snapshots.append(snapshot)
+            self.condition.notify_all()
+
+        for listener in list(self.listeners):
+            try:
+                listener(snapshot)
+            except Exception as e:
+                self.last_error = f"Snapshot listener error: {str(e)}"
+        return snapshot
+
+    def add_listener(self, callback):
+        """Register callback(snapshot) to be called for every published snapshot"""
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        """Unregister a snapshot listener"""
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    def stats(self):
+        """Return acquisition counters for diagnostics"""
+        with self.condition:
+            latest = self.snapshots[-1] if self.snapshots else None
+            stats = {
+                "running": self.is_running(),
+                "interval": self.interval,
+                "samples": self.samples,
+                "seq": self.seq,
+                "retained": len(self.snapshots),
+                "last_sample": self.last_sample_time,
+                "last_snapshot": latest['timestamp'] if latest else None,
+                "last_latency": round(self.last_latency, 4) if self.last_latency is not None else None,
+                "last_error": self.last_error,
+                "clock": self.clock.status()
+            }
+        if self.significance_filter is not None:
+            stats["suppressed_updates"] = self.significance_filter.suppressed
+        if self.configuration_watcher is not None:
+            stats["settings"] = self.configuration_watcher.status()
+        if self.scheduler is not None:
+            stats["adaptive"] = self.scheduler.status()
+        return stats
+
+    def latest(self):
+        """Return the most recent snapshot or None"""
+        with self.condition:
+            return self.snapshots[-1] if self.snapshots else None
+
+    def history(self, since=0, limit=None):
+        """Return retained snapshots with a sequence number greater than since"""
+        with self.condition:
+            snapshots = [s for s in self.snapshots if s['seq'] > since]
+        if limit:
+            snapshots = snapshots[-limit:]
+        return snapshots
+
+    def changes_since(self, since):
+        """Return the fields that changed after sequence number since
+
+        If since is 0, in the future or older than the retained ring, the client
+        cannot apply a delta and gets every field with reset set to True.
+        """
+        with self.condition:
+            if not self.snapshots:
+                return {'seq': self.seq, 'reset': False, 'changes': {}}
+            latest = self.snapshots[-1]
+            oldest_seq = self.snapshots[0]['seq']
+            if since <= 0 or since > latest['seq'] or since < oldest_seq - 1:
+                return {
+                    'seq': latest['seq'],
+                    'timestamp': latest['timestamp'],
+                    'reset': True,
+                    'changes': dict(latest['flat'])
+                }
+            names = set()
+            for snapshot in self.snapshots:
+                if snapshot['seq'] > since:
+                    names.update(snapshot['changed'])
+            return {
+                'seq': latest['seq'],
+                'timestamp': latest['timestamp'],
+                'reset': False,
+                'changes': {name: latest['flat'].get(name) for name in sorted(names)}
+            }
+
+    def wait_for_changes(self, since, timeout):
+        """Block until fields changed after since or timeout expires, then return them"""
+        deadline = time.monotonic() + timeout
+        result = self.changes_since(since)
+        while not result['changes'] and not result['reset']:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            seen = result['seq']
+            with self.condition:
+                self.condition.wait_for(lambda: self.seq > seen, remaining)
+            result = self.changes_since(since)
+        return result
+
+
+class ConfigurationWatcher:
+    """Refresh the cached settings when GS reports a configuration change
+
+    GS field U ("setting value configuration state") turns on when a setting
+    was changed, on the panel or over the wire. Watching it lets PIRI, ACCT,
+    ACLT and DI stay cached indefinitely: on a rising edge they are re-read
+    once, in a separate thread so the acquisition loop is not held up.
+    """
+
+    FIELD = 'status.configuration_changed'
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+        self.last_state = None
+        self.refreshes = 0
+        self.last_refresh = None
+        self.last_result = None
+        self._refreshing = threading.Lock()
+
+    def attach(self, engine):
+        """Watch every snapshot engine publishes"""
+        engine.add_listener(self.on_snapshot)
+        return self
+
+    def on_snapshot(self, snapshot):
+        state = snapshot['flat'].get(self.FIELD)
+        if state is None or snapshot['stale']:
+            return
+        previous, self.last_state = self.last_state, state
+        if state and previous is not True:
+            self.monitor.invalidate_settings()
+            threading.Thread(target=self.refresh, name='p18-settings-refresh', daemon=True).start()
+
+    def refresh(self):
+        """Re-read the settings commands (one refresh at a time)"""
+        if not self._refreshing.acquire(blocking=False):
+            return
+        try:
+            self.last_result = self.monitor.refresh_settings()
+            self.refreshes += 1
+            self.last_refresh = datetime.now().isoformat()
+        finally:
+            self._refreshing.release()
+
+    def status(self):
+        """Return the watcher state as a dict"""
+        return {
+            "configuration_changed": self.last_state,
+            "refreshes": self.refreshes,
+            "last_refresh": self.last_refresh,
+            "last_result": self.last_result
+        }
+
+
+def create_engine(monitor, config):
+    """Build an AcquisitionEngine from the application configuration"""
+    engine = AcquisitionEngine(
+        monitor,
+        interval=config['ACQUISITION_INTERVAL'],
+        history_size=config['ACQUISITION_HISTORY_SIZE'],
+        significance_filter=SignificanceFilter(config['TELEMETRY_FILTERS']),
+        heartbeat=config['ACQUISITION_HEARTBEAT']
+    )
+    engine.configuration_watcher = ConfigurationWatcher(monitor).attach(engine)
+    engine.scheduler = create_scheduler(config)
+    engine.poll_faults = config['ACQUISITION_FAULTS']
+    engine.energy_interval = config['ENERGY_POLL_INTERVAL']
+    return engine
@@ -0,0 +1,167 @@
+# inverter/adaptive.py
+""" Adaptive polling rate for the acquisition engine
+
+A fixed schedule wastes bus time at night, when nothing changes, and samples
+too slowly during mode transitions, faults and load swings. The scheduler
+looks at every sample and picks the delay before the next poll:
+
+- the working mode changed, a fault flag appeared or a power field moved
+  faster than the swing threshold: poll at min_interval for fast_hold seconds
+- a fault is still active: stay at the base interval
+- otherwise (steady state): back off step by step up to max_interval
+
+Whatever is chosen, the acquisition never keeps the serial bus busy for more
+than the duty-cycle budget: the delay is stretched so that bus time divided
+by cycle time stays below it.
+"""
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# Fields whose rate of change (W/s) counts as a power swing
+POWER_FIELDS = ('output.active_power', 'output.apparent_power', 'pv.pv1_power', 'pv.pv2_power')
+
+
+class AdaptivePollScheduler:
+    """Choose the delay before the next poll from the last samples
+
+    Args:
+        base_interval (float): Interval of normal operation, in seconds
+        min_interval (float): Interval while something is happening
+        max_interval (float): Longest interval in steady state
+        power_threshold (float): Power change rate (W/s) that triggers fast polling
+        fast_hold (float): Seconds to keep polling fast after a trigger
+        backoff (float): Factor the interval grows by per steady sample
+        duty_cycle (float): Largest fraction of time the polls may occupy the bus
+    """
+
+    def __init__(self, base_interval=10, min_interval=2, max_interval=60, power_threshold=50,
+                 fast_hold=60, backoff=1.5, duty_cycle=0.25, window=300):
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.power_threshold = power_threshold
+        self.fast_hold = fast_hold
+        self.backoff = backoff
+        self.duty_cycle = duty_cycle
+        self.window = window
+        self.interval = base_interval
+        self.delay = base_interval
+        self.triggers = 0
+        self.budget_limited = 0
+        self.last_trigger = None
+        self.last_reason = None
+        self._fast_until = 0.0
+        self._previous = None
+        self._bus_time = None
+        # (start, bus seconds) of the polls inside the window, for the measured duty cycle
+        self._polls = deque()
+        self._lock = threading.Lock()
+
+    def _active_faults(self, flat):
+        # Warning flags and a non-zero fault code from FWS
+        faults = {name for name, value in flat.items() if name.startswith('faults.') and value}
+        if flat.get('working_mode') == 'Fault':
+            faults.add('working_mode')
+        return faults
+
+    def _trigger_reason(self, flat, faults, now):
+        previous = self._previous
+        if previous is None:
+            return None
+        previous_flat, previous_faults, previous_time = previous
+        if flat.get('working_mode') != previous_flat.get('working_mode'):
+            return f"working mode {previous_flat.get('working_mode')} -> {flat.get('working_mode')}"
+        appeared = faults - previous_faults
+        if appeared:
+            return f"fault {', '.join(sorted(appeared))}"
+        elapsed = now - previous_time
+        if elapsed > 0:
+            for name in POWER_FIELDS:
+                value, last = flat.get(name), previous_flat.get(name)
+                if isinstance(value, (int, float)) and isinstance(last, (int, float)):
+                    rate = abs(value - last) / elapsed
+                    if rate > self.power_threshold:
+                        return f"{name} changing at {rate:.0f} W/s"
+        return None
+
+    def observe(self, flat, bus_time, now=None):
+        """Account for one poll (flattened sample, seconds on the bus) and return the next delay"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            faults = self._active_faults(flat)
+            reason = self._trigger_reason(flat, faults, now)
+            if reason:
+                self.triggers += 1
+                self.last_trigger = datetime.now().isoformat()
+                self.last_reason = reason
+                self._fast_until = now + self.fast_hold
+            if now < self._fast_until:
+                self.interval = self.min_interval
+            elif faults:
+                self.interval = self.base_interval
+            else:
+                self.interval = min(self.max_interval, max(self.base_interval, self.interval * self.backoff))
+            self._previous = (flat, faults, now)
+            return self._apply_budget(bus_time, now)
+
+    def observe_failure(self, bus_time, now=None):
+        """Account for a failed poll; the interval is kept but the bus time still counts"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return self._apply_budget(bus_time, now)
+
+    def _apply_budget(self, bus_time, now):
+        self._polls.append((now, bus_time))
+        while self._polls and self._polls[0][0] < now - self.window:
+            self._polls.popleft()
+        # Smooth the bus time so one slow reply does not stall polling
+        self._bus_time = bus_time if self._bus_time is None else 0.7 * self._bus_time + 0.3 * bus_time
+        delay = self.interval
+        if self.duty_cycle:
+            # The clock starts polls delay apart, bus time included: bus / delay <= duty_cycle
+            floor = self._bus_time / self.duty_cycle
+            if floor > delay:
+                delay = floor
+                self.budget_limited += 1
+        self.delay = delay
+        return delay
+
+    def measured_duty_cycle(self, now=None):
+        """Return the fraction of the window the polls kept the bus busy"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if not self._polls:
+                return 0.0
+            span = max(now - self._polls[0][0], self.delay)
+            return min(1.0, sum(busy for _, busy in self._polls) / span) if span > 0 else 0.0
+
+    def status(self):
+        """Return the scheduler state as a dict"""
+        return {
+            "interval": round(self.interval, 3),
+            "delay": round(self.delay, 3),
+            "fast": time.monotonic() < self._fast_until,
+            "triggers": self.triggers,
+            "last_trigger": self.last_trigger,
+            "last_reason": self.last_reason,
+            "bus_time": round(self._bus_time, 3) if self._bus_time is not None else None,
+            "duty_cycle": round(self.measured_duty_cycle(), 3),
+            "duty_cycle_budget": self.duty_cycle,
+            "budget_limited": self.budget_limited
+        }
+
+
+def create_scheduler(config):
+    """Build an AdaptivePollScheduler from the application configuration, or return None"""
+    if not config['ADAPTIVE_POLLING']:
+        return None
+    return AdaptivePollScheduler(
+        base_interval=config['ACQUISITION_INTERVAL'],
+        min_interval=config['ACQUISITION_MIN_INTERVAL'],
+        max_interval=config['ACQUISITION_MAX_INTERVAL'],
+        power_threshold=config['POWER_SWING_THRESHOLD'],
+        fast_hold=config['ADAPTIVE_FAST_HOLD'],
+        duty_cycle=config['SERIAL_DUTY_CYCLE']
+    )
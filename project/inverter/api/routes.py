@@ -1,8 +1,12 @@
 # inverter/api/routes.py
 """ REST API endpoints for P18 Inverter """
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, Response, jsonify, request, current_app, stream_with_context
 from datetime import datetime
 import re
+from .. import export
+from ..retention import rollup_fields
+from ..store import parse_time
+from ..utils.serialization import encoded_response, bytes_response, negotiate_mimetype, to_columnar
 
 api_bp = Blueprint('api', __name__)
 
@@ -10,6 +14,45 @@ def get_monitor():
     """Get monitor instance from Flask app context"""
     return current_app.monitor
 
+def get_response_cache():
+    """Get the pre-serialized response cache from Flask app context"""
+    return current_app.response_cache
+
+def get_acquisition():
+    """Get the acquisition engine from Flask app context"""
+    return current_app.acquisition
+
+@api_bp.before_request
+def reset_stale_flag():
+    """Start every request with clear stale-reply and refused-command flags"""
+    monitor = get_monitor()
+    for flag in ('take_stale_flag', 'take_refused_flag'):
+        take_flag = getattr(monitor, flag, None)
+        if take_flag:
+            take_flag()
+
+@api_bp.after_request
+def mark_stale_response(response):
+    """Flag responses built from warm-start data that was not revalidated yet"""
+    take_stale_flag = getattr(get_monitor(), 'take_stale_flag', None)
+    if take_stale_flag and take_stale_flag():
+        response.headers['Warning'] = '110 - "Response is Stale"'
+        response.headers['X-Data-Stale'] = '1'
+    return response
+
+@api_bp.after_request
+def report_refused_command(response):
+    """Turn a generic failure caused by a refused command into 501 (or 503 while suspended)"""
+    take_refused_flag = getattr(get_monitor(), 'take_refused_flag', None)
+    refused = take_refused_flag() if take_refused_flag else None
+    if refused is None or response.status_code < 500:
+        return response
+    refused_response = jsonify({'error': str(refused)})
+    refused_response.status_code = refused.status
+    if refused.retry_after:
+        refused_response.headers['Retry-After'] = str(refused.retry_after)
+    return refused_response
+
 # =========================================================================
 # System Information Endpoints (/api/v1/inverter/info)
 # =========================================================================
@@ -66,6 +109,28 @@ def get_ratings():
         return jsonify(ratings_data)
     return jsonify({'error': 'Failed to get rated information', 'details': error}), 500
 
+@api_bp.route('/api/v1/inverter/connection')
+def get_connection_status():
+    """Get serial connection health"""
+    status = get_monitor().connection_status()
+    watcher = getattr(current_app, 'hotplug_watcher', None)
+    if watcher is not None:
+        status['hotplug'] = watcher.status()
+    capabilities = getattr(get_monitor(), 'capabilities', None)
+    if capabilities is not None:
+        status['capabilities'] = capabilities.status()
+    return jsonify(status)
+
+@api_bp.route('/api/v1/inverter/capabilities', methods=['GET', 'DELETE'])
+def get_capabilities():
+    """Get (or with DELETE, reset) the commands known to be unsupported or suspended"""
+    capabilities = getattr(get_monitor(), 'capabilities', None)
+    if capabilities is None:
+        return jsonify({'error': 'Capability tracking is disabled'}), 404
+    if request.method == 'DELETE':
+        capabilities.forget(request.args.get('command'))
+    return jsonify(capabilities.status())
+
 @api_bp.route('/api/debug/piri')
 def debug_piri():
     """Debug PIRI command response"""
@@ -124,147 +189,18 @@ def get_general_status():
     result, error = monitor.send_p18_command('GS')
     if not result:
         return jsonify({'error': 'Failed to get general status'}), 500
+    
+    # An identical GS frame produces an identical payload, serve it pre-serialized
+    response_cache = get_response_cache()
+    mimetype = negotiate_mimetype()
+    cached_body = response_cache.get('status', result, mimetype)
+    if cached_body is not None:
+        return bytes_response(cached_body, mimetype=mimetype)
         
     try:
-        # Parse the raw GS command response
-        # Format: ^D106AAAA,BBB,CCCC,DDD,EEEE,FFFF,GGG,HHH,III,JJJ,KKK,LLL,MMM,NNN,OOO,PPP,QQQQ,RRRR,SSSS,TTTT,U,V,W,X,Y,Z,a,b<CRC><cr>
-        
-        # Extract the data part from the response
-        match = re.search(r'\^D\d+(.+?)(?:<|$)', result)
-        if not match:
-            return jsonify({'error': 'Invalid response format'}), 500
-            
-        # Split the data by commas
-        data_parts = match.group(1).split(',')
-        if len(data_parts) < 27:  # We expect at least 27 fields based on the documentation
-            return jsonify({'error': f'Incomplete response data. Got {len(data_parts)} fields, expected at least 27'}), 500
-        
-        # Parse the values according to the documentation
-        # Grid values (AAAA, BBB)
-        grid_voltage = float(data_parts[0]) / 10 if data_parts[0].isdigit() else 0.0  # AAAA: Grid voltage
-        grid_frequency = float(data_parts[1]) / 10 if data_parts[1].isdigit() else 0.0  # BBB: Grid frequency
-        
-        # AC output values (CCCC, DDD, EEEE, FFFF, GGG)
-        ac_out_voltage = float(data_parts[2]) / 10 if data_parts[2].isdigit() else 0.0  # CCCC: AC output voltage
-        ac_out_frequency = float(data_parts[3]) / 10 if data_parts[3].isdigit() else 0.0  # DDD: AC output frequency
-        ac_out_apparent_power = int(data_parts[4]) if data_parts[4].isdigit() else 0  # EEEE: AC output apparent power
-        ac_out_active_power = int(data_parts[5]) if data_parts[5].isdigit() else 0  # FFFF: AC output active power
-        output_load_percent = int(data_parts[6]) if data_parts[6].isdigit() else 0  # GGG: Output load percent
-        
-        # Battery values (HHH, III, JJJ, KKK, LLL, MMM)
-        battery_voltage = float(data_parts[7]) / 10 if data_parts[7].isdigit() else 0.0  # HHH: Battery voltage
-        battery_voltage_scc1 = float(data_parts[8]) / 10 if data_parts[8].isdigit() else 0.0  # III: Battery voltage from SCC1
-        battery_voltage_scc2 = float(data_parts[9]) / 10 if data_parts[9].isdigit() else 0.0  # JJJ: Battery voltage from SCC2
-        battery_discharge_current = int(data_parts[10]) if data_parts[10].isdigit() else 0  # KKK: Battery discharge current
-        battery_charging_current = int(data_parts[11]) if data_parts[11].isdigit() else 0  # LLL: Battery charging current
-        battery_capacity = int(data_parts[12]) if data_parts[12].isdigit() else 0  # MMM: Battery capacity
-        
-        # Temperature values (NNN, OOO, PPP)
-        inverter_heatsink_temp = int(data_parts[13]) if data_parts[13].isdigit() else 0  # NNN: Inverter heat sink temperature
-        mppt1_temperature = int(data_parts[14]) if data_parts[14].isdigit() else 0  # OOO: MPPT1 charger temperature
-        mppt2_temperature = int(data_parts[15]) if data_parts[15].isdigit() else 0  # PPP: MPPT2 charger temperature
-        
-        # PV values (QQQQ, RRRR, SSSS, TTTT)
-        pv1_power = int(data_parts[16]) if data_parts[16].isdigit() else 0  # QQQQ: PV1 Input power
-        pv2_power = int(data_parts[17]) if data_parts[17].isdigit() else 0  # RRRR: PV2 Input power
-        pv1_voltage = float(data_parts[18]) / 10 if data_parts[18].isdigit() else 0.0  # SSSS: PV1 Input voltage
-        pv2_voltage = float(data_parts[19]) / 10 if data_parts[19].isdigit() else 0.0  # TTTT: PV2 Input voltage
-        
-        # Status values (U, V, W, X, Y, Z, a)
-        setting_changed = data_parts[20] == "1" if len(data_parts) > 20 else False  # U: Setting value configuration state
-        
-        # MPPT charger status
-        mppt1_status = "normal"
-        if len(data_parts) > 21:
-            if data_parts[21] == "0":
-                mppt1_status = "abnormal"
-            elif data_parts[21] == "1":
-                mppt1_status = "normal"
-            elif data_parts[21] == "2":
-                mppt1_status = "charging"
-        
-        mppt2_status = "normal"
-        if len(data_parts) > 22:
-            if data_parts[22] == "0":
-                mppt2_status = "abnormal"
-            elif data_parts[22] == "1":
-                mppt2_status = "normal"
-            elif data_parts[22] == "2":
-                mppt2_status = "charging"
-        
-        # Load connection status
-        load_connected = False
-        if len(data_parts) > 23:
-            load_connected = data_parts[23] == "1"
-        
-        # Battery power direction
-        battery_direction = "donothing"
-        if len(data_parts) > 24:
-            if data_parts[24] == "1":
-                battery_direction = "charge"
-            elif data_parts[24] == "2":
-                battery_direction = "discharge"
-        
-        # DC/AC power direction
-        dc_ac_direction = "donothing"
-        if len(data_parts) > 25:
-            if data_parts[25] == "1":
-                dc_ac_direction = "AC-DC"
-            elif data_parts[25] == "2":
-                dc_ac_direction = "DC-AC"
-        
-        # Line power direction
-        line_direction = "donothing"
-        if len(data_parts) > 26:
-            if data_parts[26] == "1":
-                line_direction = "input"
-            elif data_parts[26] == "2":
-                line_direction = "output"
-        
-        # Format the response exactly as specified in the documentation
-        formatted_response = {
-            "grid": {
-                "voltage": grid_voltage,
-                "frequency": grid_frequency
-            },
-            "output": {
-                "voltage": ac_out_voltage,
-                "frequency": ac_out_frequency,
-                "apparent_power": ac_out_apparent_power,
-                "active_power": ac_out_active_power,
-                "load_percent": output_load_percent
-            },
-            "battery": {
-                "voltage": battery_voltage,
-                "voltage_scc1": battery_voltage_scc1,
-                "voltage_scc2": battery_voltage_scc2,
-                "discharge_current": battery_discharge_current,
-                "charging_current": battery_charging_current,
-                "capacity_percent": battery_capacity
-            },
-            "temperature": {
-                "heatsink": inverter_heatsink_temp,
-                "mppt1": mppt1_temperature,
-                "mppt2": mppt2_temperature
-            },
-            "pv": {
-                "pv1_power": pv1_power,
-                "pv2_power": pv2_power,
-                "pv1_voltage": pv1_voltage,
-                "pv2_voltage": pv2_voltage
-            },
-            "status": {
-                "configuration_changed": setting_changed,
-                "mppt1_status": mppt1_status,
-                "mppt2_status": mppt2_status,
-                "load_connected": load_connected,
-                "battery_direction": battery_direction,
-                "dc_ac_direction": dc_ac_direction,
-                "line_direction": line_direction
-            }
-        }
-        
-        return jsonify(formatted_response)
+        formatted_response = monitor.parse_status_tree(result)
+        body = response_cache.put('status', result, formatted_response, mimetype)
+        return bytes_response(body, mimetype=mimetype)
         
     except Exception as e:
         return jsonify({'error': f'Error parsing general status: {str(e)}'}), 500
@@ -289,7 +225,7 @@ def get_working_mode():
         
         mode_info = mode_mapping.get(mode, {'code': -1, 'description': 'Unknown mode'})
         
-        return jsonify({
+        return encoded_response({
             "mode": mode.lower(),
             "mode_code": mode_info['code'],
             "mode_description": mode_info['description']
@@ -303,94 +239,199 @@ def get_fault_status():
     result, error = monitor.send_p18_command('FWS')
     if result:
         try:
-            # Parse the fault status response based on the provided documentation
-            # Format: ^D034AA,B,C,D,E,F,G,H,I,J,K,L,M,N,O,P,Q<CRC><cr>
-            match = re.search(r'\^D\d+(.+?)(?:<|$)', result)
-            if not match:
-                return jsonify({'error': 'Invalid response format'}), 500
-                
-            # Split the data by commas
-            data_parts = match.group(1).split(',')
-            if len(data_parts) < 17:  # We expect at least 17 fields
-                return jsonify({'error': f'Incomplete response data. Got {len(data_parts)} fields, expected at least 17'}), 500
-            
-            # Extract fault code from the first field (AA)
-            fault_code = int(data_parts[0]) if data_parts[0].isdigit() else 0
-            
-            # Map the rest of the fields to their corresponding fault flags
-            # B through Q represent different fault conditions
-            fault_status = {
-                "line_fail": data_parts[1] == "1" if len(data_parts) > 1 else False,  # B: Line fail
-                "output_short": data_parts[2] == "1" if len(data_parts) > 2 else False,  # C: Output circuit short
-                "over_temperature": data_parts[3] == "1" if len(data_parts) > 3 else False,  # D: Inverter over temperature
-                "fan_locked": data_parts[4] == "1" if len(data_parts) > 4 else False,  # E: Fan lock
-                "battery_voltage_high": data_parts[5] == "1" if len(data_parts) > 5 else False,  # F: Battery voltage high
-                "battery_low": data_parts[6] == "1" if len(data_parts) > 6 else False,  # G: Battery low
-                "battery_under": data_parts[7] == "1" if len(data_parts) > 7 else False,  # H: Battery under
-                "overload": data_parts[8] == "1" if len(data_parts) > 8 else False,  # I: Over load
-                "eeprom_fail": data_parts[9] == "1" if len(data_parts) > 9 else False,  # J: Eeprom fail
-                "power_limit": data_parts[10] == "1" if len(data_parts) > 10 else False,  # K: Power limit
-                "pv1_voltage_high": data_parts[11] == "1" if len(data_parts) > 11 else False,  # L: PV1 voltage high
-                "pv2_voltage_high": data_parts[12] == "1" if len(data_parts) > 12 else False,  # M: PV2 voltage high
-                "mppt1_overload": data_parts[13] == "1" if len(data_parts) > 13 else False,  # N: MPPT1 overload warning
-                "mppt2_overload": data_parts[14] == "1" if len(data_parts) > 14 else False,  # O: MPPT2 overload warning
-                "battery_low_scc1": data_parts[15] == "1" if len(data_parts) > 15 else False,  # P: Battery too low to charge for SCC1
-                "battery_low_scc2": data_parts[16] == "1" if len(data_parts) > 16 else False   # Q: Battery too low to charge for SCC2
-            }
-            
-            # Add error code descriptions if fault_code is non-zero
-            error_descriptions = {}
-            if fault_code > 0:
-                error_codes = {
-                    "1": "Fan is locked",
-                    "2": "Over temperature",
-                    "3": "Battery voltage is too high",
-                    "4": "Battery voltage is too low",
-                    "5": "Output short circuited or Over temperature",
-                    "6": "Output voltage is too high",
-                    "7": "Over load time out",
-                    "8": "Bus voltage is too high",
-                    "9": "Bus soft start failed",
-                    "11": "Main relay failed",
-                    "51": "Over current inverter",
-                    "52": "Bus soft start failed",
-                    "53": "Inverter soft start failed",
-                    "54": "Self-test failed",
-                    "55": "Over DC voltage on output of inverter",
-                    "56": "Battery connection is open",
-                    "57": "Current sensor failed",
-                    "58": "Output voltage is too low",
-                    "60": "Inverter negative power",
-                    "71": "Parallel version different",
-                    "72": "Output circuit failed",
-                    "80": "CAN communication failed",
-                    "81": "Parallel host line lost",
-                    "82": "Parallel synchronized signal lost",
-                    "83": "Parallel battery voltage detect different",
-                    "84": "Parallel Line voltage or frequency detect different",
-                    "85": "Parallel Line input current unbalanced",
-                    "86": "Parallel output setting different"
-                }
-                error_descriptions = {
-                    "code": str(fault_code),
-                    "description": error_codes.get(str(fault_code), "Unknown error")
-                }
-            
-            response = {
-                "fault_code": fault_code,
-                "faults": fault_status
-            }
-            
-            # Add error description if available
-            if error_descriptions:
-                response["error"] = error_descriptions
-                
-            return jsonify(response)
-            
+            return encoded_response(monitor.parse_fault_status(result))
         except Exception as e:
             return jsonify({'error': f'Error parsing fault status: {str(e)}'}), 500
     return jsonify({'error': 'Failed to get fault status'}), 500
 
+# =========================================================================
+# Acquisition Endpoints (snapshots, change feed and history)
+# =========================================================================
+@api_bp.route('/api/v1/inverter/data/snapshot')
+def get_snapshot():
+    """Get the latest snapshot published by the acquisition engine"""
+    snapshot = get_acquisition().latest()
+    if not snapshot:
+        return jsonify({'error': 'No snapshot acquired yet'}), 503
+    
+    # Snapshots are immutable, so the sequence number identifies the body
+    response_cache = get_response_cache()
+    mimetype = negotiate_mimetype()
+    cached_body = response_cache.get('snapshot', snapshot['seq'], mimetype)
+    if cached_body is None:
+        payload = {
+            "seq": snapshot['seq'],
+            "timestamp": snapshot['timestamp'],
+            "data": snapshot['data']
+        }
+        if snapshot['stale']:
+            payload['stale'] = True
+        if snapshot.get('latency') is not None:
+            payload['latency'] = round(snapshot['latency'], 4)
+        cached_body = response_cache.put('snapshot', snapshot['seq'], payload, mimetype)
+    response = bytes_response(cached_body, mimetype=mimetype)
+    if snapshot['stale']:
+        response.headers['Warning'] = '110 - "Response is Stale"'
+        response.headers['X-Data-Stale'] = '1'
+    return response
+
+@api_bp.route('/api/v1/inverter/acquisition')
+def get_acquisition_stats():
+    """Get acquisition engine counters"""
+    stats = get_acquisition().stats()
+    warm_start = getattr(current_app, 'warm_start', None)
+    if warm_start is not None:
+        stats['warm_start'] = warm_start.status()
+    mqtt_publisher = getattr(current_app, 'mqtt', None)
+    if mqtt_publisher is not None:
+        stats['mqtt'] = mqtt_publisher.status()
+    modbus_gateway = getattr(current_app, 'modbus', None)
+    if modbus_gateway is not None:
+        stats['modbus'] = modbus_gateway.status()
+    uplink = getattr(current_app, 'uplink', None)
+    if uplink is not None:
+        stats['uplink'] = uplink.status()
+    store = getattr(current_app, 'telemetry_store', None)
+    if store is not None and 'store' not in stats:
+        stats['store'] = store.status()
+    compactor = getattr(current_app, 'compactor', None)
+    if compactor is not None and 'retention' not in stats:
+        stats['retention'] = compactor.status()
+    # Group commits of the process that records (the daemon's in shared mode)
+    writer = getattr(current_app, 'writer', None)
+    if writer is not None and 'writes' not in stats:
+        stats['writes'] = writer.stats()
+    return jsonify(stats)
+
+@api_bp.route('/api/v1/inverter/changes')
+def get_changes():
+    """Get the fields that changed since a sequence number, optionally long-polling"""
+    since = request.args.get('since', 0, type=int)
+    wait = request.args.get('wait', 0, type=float)
+    if since < 0 or wait < 0:
+        return jsonify({'error': 'since and wait must not be negative'}), 400
+    
+    acquisition = get_acquisition()
+    wait = min(wait, current_app.config['LONG_POLL_MAX_WAIT'])
+    if wait:
+        changes = acquisition.wait_for_changes(since, wait)
+    else:
+        changes = acquisition.changes_since(since)
+    return encoded_response(changes)
+
+@api_bp.route('/api/v1/inverter/history')
+def get_history():
+    """Get recent snapshots from the acquisition ring, optionally in compact columnar form
+
+    With from/to it summarizes stored telemetry over that range instead (see get_distribution).
+    """
+    if 'from' in request.args or 'to' in request.args:
+        return get_distribution()
+    since = request.args.get('since', 0, type=int)
+    limit = request.args.get('limit', None, type=int)
+    output_format = request.args.get('format', 'records')
+    if output_format not in ('records', 'compact'):
+        return jsonify({'error': "Invalid format. Use 'records' or 'compact'"}), 400
+    
+    records = []
+    for snapshot in get_acquisition().history(since=since, limit=limit):
+        record = {"seq": snapshot['seq'], "timestamp": snapshot['timestamp']}
+        if snapshot.get('latency') is not None:
+            record['latency'] = round(snapshot['latency'], 4)
+        record.update(snapshot['data'])
+        records.append(record)
+    
+    if output_format == 'compact':
+        return encoded_response(to_columnar(records))
+    return encoded_response({
+        "count": len(records),
+        "snapshots": records
+    })
+
+def get_distribution():
+    """Get count, min, max, mean, percentiles and the share below thresholds of fields over a range
+
+    Answered from the rollup sketches and the raw samples of the telemetry
+    store: ?from=2025-01-01&to=2025-12-31&fields=battery.voltage&percentiles=5,50,95&below=48
+    """
+    compactor = getattr(current_app, 'compactor', None)
+    if compactor is None:
+        return jsonify({'error': 'The telemetry store is disabled (set TELEMETRY_STORE)'}), 404
+    fields = [name for name in request.args.get('fields', '').split(',') if name] or compactor.sketch_fields
+    try:
+        start = parse_time(request.args.get('from') or compactor.store.days()[0].isoformat())
+        end = parse_time(request.args.get('to') or datetime.now().isoformat(), end=True)
+        percentiles = [float(value) for value in request.args.get('percentiles', '5,50,95').split(',') if value]
+        below = [float(value) for value in request.args.get('below', '').split(',') if value]
+    except IndexError:
+        return jsonify({'error': 'No telemetry stored yet'}), 404
+    except ValueError:
+        return jsonify({'error': 'from and to must be ISO dates or datetimes, percentiles and below numbers'}), 400
+    if not fields or any(not 0 <= value <= 100 for value in percentiles):
+        return jsonify({'error': 'fields must not be empty and percentiles must be within 0-100'}), 400
+    
+    summaries, tiers = compactor.distribution(start, end, fields)
+    result = {}
+    for field, summary in summaries.items():
+        digest = summary['digest']
+        # Without a sketch for every rollup bucket there are no percentiles
+        sketched = digest is not None and digest.count > 0
+        result[field] = {
+            "count": summary['count'],
+            "min": summary['min'],
+            "max": summary['max'],
+            "mean": round(summary['sum'] / summary['count'], 4) if summary['count'] else None,
+            "percentiles": {f"p{value:g}": round(digest.quantile(value / 100), 4) if sketched else None
+                            for value in percentiles},
+            "below": {f"{value:g}": round(digest.cdf(value), 4) if sketched else None for value in below}
+        }
+    return encoded_response({
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "tiers": tiers,
+        "fields": result
+    })
+
+@api_bp.route('/api/v1/inverter/export')
+def export_history():
+    """Stream stored telemetry between two dates as CSV, NDJSON or Parquet"""
+    store = getattr(current_app, 'telemetry_store', None)
+    if store is None:
+        return jsonify({'error': 'The telemetry store is disabled (set TELEMETRY_STORE)'}), 404
+    output_format = request.args.get('format', 'csv')
+    if output_format not in export.FORMATS:
+        return jsonify({'error': f"Invalid format. Use {', '.join(sorted(export.FORMATS))}"}), 400
+    if output_format == 'parquet' and export.pyarrow is None:
+        return jsonify({'error': 'Parquet export needs pyarrow (pip install pyarrow)'}), 501
+    start = request.args.get('from')
+    end = request.args.get('to')
+    try:
+        start = parse_time(start) if start else None
+        end = parse_time(end, end=True) if end else None
+    except ValueError:
+        return jsonify({'error': 'from and to must be ISO dates or datetimes'}), 400
+    fields = [name for name in request.args.get('fields', '').split(',') if name] or None
+    resolution = request.args.get('resolution', 'raw')
+    compactor = getattr(current_app, 'compactor', None)
+    if resolution != 'raw':
+        # Rollups have field@min, @max, @sum and @count (@last for text) columns
+        try:
+            store = compactor.tier(resolution)
+        except (AttributeError, KeyError):
+            tiers = [name for name, _, _ in compactor.tiers] if compactor is not None else ['raw']
+            return jsonify({'error': f"Invalid resolution. Use {', '.join(tiers)}"}), 400
+        fields = rollup_fields(fields) if fields else None
+    
+    # Generated while sent: no Content-Length, so the body goes out chunked
+    chunks = export.iter_export(store, start, end, output_format, fields)
+    headers = {'Content-Disposition': f'attachment; filename="telemetry.{output_format}"'}
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        chunks = export.gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    response = Response(stream_with_context(chunks), mimetype=export.FORMATS[output_format], headers=headers)
+    response.vary.add('Accept-Encoding')
+    return response
+
 # =========================================================================
 # Time Management Endpoints (/api/v1/inverter/time)
 # =========================================================================
@@ -617,27 +658,8 @@ def clear_energy_data():
         # The clear energy command needs special handling because it starts with S not P
         cmd = "^S006CLE\r"
         
-        # Send directly without using send_p18_command since this is an S command not P command
-        if not monitor.ser or not monitor.ser.is_open:
-            if not monitor.connect():
-                return jsonify({'error': 'Could not connect to inverter'}), 500
-        
-        monitor.ser.reset_input_buffer()
-        monitor.ser.reset_output_buffer()
-        monitor.ser.write(cmd.encode('ascii'))
-        monitor.ser.flush()
-        
-        # Read response
-        response = ""
-        while True:
-            char = monitor.ser.read(1)
-            if not char:
-                break
-            response += char.decode('ascii', errors='ignore')
-            if response.endswith('\r'):
-                break
-            if len(response) > 100:
-                break
+        # Send as a raw frame since this is an S command not P command
+        response, error = monitor.send_raw_frame(cmd)
         
         if response:
             # Check if the response starts with ^1 which indicates command acceptance
@@ -764,48 +786,101 @@ def factory_reset():
 # =========================================================================
 @api_bp.route('/api/v1/inverter/parallel/<int:id>/info')
 def get_parallel_info(id):
-    """Get parallel system info"""
+    """Get the rated information of one unit of a parallel system"""
     monitor = get_monitor()
-    command = f"PRI{id}"
-    result, error = monitor.send_p18_command(command)
-    
-    if result:
-        # This is a placeholder - adjust based on actual response format
-        try:
-            # Parse the response to extract parallel system info
-            return jsonify({
-                "id": id,
-                "status": "online",
-                "role": "master" if id == 1 else "slave",
-                "firmware_version": "1.0"
-            })
-        except Exception as e:
-            return jsonify({'error': f'Error parsing parallel system info: {str(e)}'}), 500
-    
-    return jsonify({'error': 'Failed to get parallel system info'}), 500
+    result, error = monitor.send_p18_command(f"PRI{id}")
+    if not result:
+        return jsonify({'error': f'Failed to get parallel system info: {error}'}), 500
+    try:
+        info = monitor.parse_parallel_info(result)
+    except ValueError as e:
+        return jsonify({'error': f'Error parsing parallel system info: {str(e)}'}), 500
+    if not info['connected']:
+        return jsonify({'error': f'No parallel unit with ID {id}'}), 404
+    return jsonify(dict(info, id=id))
 
 @api_bp.route('/api/v1/inverter/parallel/<int:id>/status')
 def get_parallel_status(id):
-    """Get parallel system status"""
+    """Get the general status of one unit of a parallel system"""
     monitor = get_monitor()
-    command = f"PGS{id}"
-    result, error = monitor.send_p18_command(command)
-    
-    if result:
-        # This is a placeholder - adjust based on actual response format
-        try:
-            # Parse the response to extract parallel system status
-            return jsonify({
-                "id": id,
-                "output_voltage": 230.0,
-                "output_frequency": 50.0,
-                "output_power": 500,
-                "load_percent": 10
-            })
-        except Exception as e:
-            return jsonify({'error': f'Error parsing parallel system status: {str(e)}'}), 500
-    
-    return jsonify({'error': 'Failed to get parallel system status'}), 500
+    result, error = monitor.send_p18_command(f"PGS{id}")
+    if not result:
+        return jsonify({'error': f'Failed to get parallel system status: {error}'}), 500
+    try:
+        status = monitor.parse_parallel_status(result)
+    except ValueError as e:
+        return jsonify({'error': f'Error parsing parallel system status: {str(e)}'}), 500
+    if not status['connected']:
+        return jsonify({'error': f'No parallel unit with ID {id}'}), 404
+    return jsonify(dict(status, id=id))
+
+@api_bp.route('/api/v1/inverter/parallel/group')
+def get_parallel_group():
+    """Get the latest group snapshot: every unit plus per-phase and overall totals"""
+    poller = getattr(current_app, 'parallel', None)
+    if poller is None:
+        return jsonify({'error': 'Parallel polling is disabled'}), 404
+    snapshot = poller.latest()
+    if not snapshot:
+        return jsonify({'error': 'No group snapshot acquired yet', 'stats': poller.stats()}), 503
+    return encoded_response({
+        "seq": snapshot['seq'],
+        "timestamp": snapshot['timestamp'],
+        "data": snapshot['data']
+    })
+
+@api_bp.route('/api/v1/inverter/parallel/group/changes')
+def get_parallel_group_changes():
+    """Get the group fields that changed since a sequence number, optionally long-polling"""
+    poller = getattr(current_app, 'parallel', None)
+    if poller is None:
+        return jsonify({'error': 'Parallel polling is disabled'}), 404
+    since = request.args.get('since', 0, type=int)
+    wait = request.args.get('wait', 0, type=float)
+    if since < 0 or wait < 0:
+        return jsonify({'error': 'since and wait must not be negative'}), 400
+    wait = min(wait, current_app.config['LONG_POLL_MAX_WAIT'])
+    if wait:
+        return encoded_response(poller.wait_for_changes(since, wait))
+    return encoded_response(poller.changes_since(since))
+
+@api_bp.route('/api/v1/inverter/parallel/group/stats')
+def get_parallel_group_stats():
+    """Get parallel poller counters"""
+    poller = getattr(current_app, 'parallel', None)
+    if poller is None:
+        return jsonify({'error': 'Parallel polling is disabled'}), 404
+    return jsonify(poller.stats())
+
+# =========================================================================
+# Fleet Endpoints (/api/v1/fleet, hub mode)
+# =========================================================================
+@api_bp.route('/api/v1/fleet/summary')
+def get_fleet_summary():
+    """Get the fleet summary aggregated from every node"""
+    hub = getattr(current_app, 'fleet', None)
+    if hub is None:
+        return jsonify({'error': 'Hub mode is disabled (set FLEET_NODES)'}), 404
+    return encoded_response(hub.summary())
+
+@api_bp.route('/api/v1/fleet/nodes/<string:name>')
+def get_fleet_node(name):
+    """Get the summary of one node"""
+    hub = getattr(current_app, 'fleet', None)
+    if hub is None:
+        return jsonify({'error': 'Hub mode is disabled (set FLEET_NODES)'}), 404
+    if name not in hub.nodes:
+        return jsonify({'error': f'Unknown node {name}'}), 404
+    hub.refresh([name])
+    return encoded_response(hub.node_summary(name))
+
+@api_bp.route('/api/v1/fleet/stats')
+def get_fleet_stats():
+    """Get hub counters"""
+    hub = getattr(current_app, 'fleet', None)
+    if hub is None:
+        return jsonify({'error': 'Hub mode is disabled (set FLEET_NODES)'}), 404
+    return jsonify(hub.stats())
 
 # =========================================================================
 # Legacy endpoints for backward compatibility
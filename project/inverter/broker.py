@@ -0,0 +1,512 @@
+# inverter/broker.py
+""" Serial broker: one process owns the port, every tool talks to it over a Unix socket
+
+The Flask app, ad-hoc scripts and exporters all used to open the serial port
+themselves. With the broker running they connect to its Unix-domain socket
+instead and speak newline-delimited JSON, one object per line:
+
+    {"op": "command", "command": "GS", "priority": 5}
+        -> {"ok": true, "response": "^D106...", "error": null, "connected": true}
+    {"op": "raw", "frame": "^S006CLE\\r", "priority": 0}
+        -> same reply shape; raw frames are used for ^S set commands
+    {"op": "status"}
+        -> broker, scheduler and serial connection counters
+    {"op": "subscribe", "since": 0}
+        -> a stream of {"snapshot": {"seq": ..., "timestamp": ..., "data": {...}}}
+
+Commands from all clients go through one CommandScheduler: lower priority
+numbers run first, and a query that is already waiting in the queue is not
+sent twice - every client that asked for it gets the same reply.
+"""
+import itertools
+import json
+import os
+import queue
+import re
+import socket
+import socketserver
+import tempfile
+import threading
+
+from .utils.serialization import dumps
+
+# Read-only P18 queries (by name, without arguments); everything else sent
+# as a ^P frame (PF, LON/LOFF, V<voltage>, ...) changes inverter state
+QUERY_COMMANDS = frozenset((
+    'PI', 'ID', 'VFW', 'VFW2', 'MD', 'PIRI', 'GS', 'MOD', 'FWS', 'FLAG', 'DI', 'T', 'ET', 'EY', 'EM', 'ED',
+    'MCHGCR', 'MUCHGCR', 'ACCT', 'ACLT', 'PRI', 'PGS', 'GMN', 'BATS'
+))
+
+# Lower numbers run first
+PRIORITY_HIGH = 0      # set commands and other interactive writes
+PRIORITY_NORMAL = 5    # API and tool queries
+PRIORITY_LOW = 10      # background acquisition polls
+
+
+def is_query(command):
+    """Return True if command only reads from the inverter: 'PGS3' and 'EY2024' do, 'LON' does not"""
+    match = re.match(r'[A-Z]+', command)
+    return match is not None and match.group(0) in QUERY_COMMANDS
+
+
+def default_broker_socket_path():
+    """Return the default broker socket path"""
+    return os.path.join(tempfile.gettempdir(), 'p18-monitor.sock')
+
+
+class _Job:
+    """One serial transaction waited on by one or more clients"""
+
+    def __init__(self, kind, payload, priority, key=None):
+        self.kind = kind
+        self.payload = payload
+        self.priority = priority
+        self.key = key
+        self.started = False
+        self.result = (None, None)
+        self.window = None  # (tx_start, rx_end) of the serial transaction
+        self.done = threading.Event()
+
+
+class CommandScheduler:
+    """Run serial transactions one at a time, by priority, with deduplication
+
+    Read-only queries (see is_query) are keyed by the command while they
+    wait: a second request for the same query joins the pending job instead
+    of queueing another transaction, and raises its priority if needed. Set
+    commands and raw frames change inverter state and are never merged.
+    """
+
+    def __init__(self, monitor, timeout=30):
+        self.monitor = monitor
+        self.timeout = timeout
+        self.submitted = 0
+        self.executed = 0
+        self.deduplicated = 0
+        self._queue = queue.PriorityQueue()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the worker thread that owns the serial port"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='p18-broker-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the worker thread and fail every job still waiting"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        with self._lock:
+            while True:
+                try:
+                    _, _, job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                job.result = (None, "Serial broker stopped")
+                job.done.set()
+            self._pending.clear()
+
+    def submit(self, payload, priority=PRIORITY_NORMAL, raw=False, timeout=None):
+        """Queue a command (or raw frame) and wait for its reply
+
+        Returns:
+            tuple: (response, error)
+        """
+        return self.submit_timed(payload, priority, raw, timeout)[0]
+
+    def submit_timed(self, payload, priority=PRIORITY_NORMAL, raw=False, timeout=None):
+        """Like submit(), also returning the monotonic (tx_start, rx_end) of the transaction
+
+        The window is measured in the scheduler thread, so it excludes the
+        time the job waited in the queue. None when there was no transaction.
+
+        Returns:
+            tuple: ((response, error), window)
+        """
+        key = payload if not raw and is_query(payload) else None
+        with self._lock:
+            if self._stop_event.is_set():
+                return (None, "Serial broker stopped"), None
+            self.submitted += 1
+            job = self._pending.get(key) if key is not None else None
+            if job is not None:
+                self.deduplicated += 1
+                if priority < job.priority:
+                    # Requeue the shared job at the better priority; the stale
+                    # entry is skipped once the job has started
+                    job.priority = priority
+                    self._queue.put((priority, next(self._counter), job))
+            else:
+                job = _Job('raw' if raw else 'command', payload, priority, key)
+                if key is not None:
+                    self._pending[key] = job
+                self._queue.put((priority, next(self._counter), job))
+
+        if not job.done.wait(timeout or self.timeout):
+            with self._lock:
+                if not job.started:
+                    # Cancel it: a command nobody awaits must not reach the
+                    # bus later, and waiters sharing the job time out too
+                    job.started = True
+                    if job.key is not None and self._pending.get(job.key) is job:
+                        del self._pending[job.key]
+                    job.result = (None, "Serial broker timeout")
+                    job.done.set()
+            if not job.done.is_set():
+                return (None, "Serial broker timeout"), None
+        return job.result, job.window
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                _, _, job = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            with self._lock:
+                if job.started:
+                    continue
+                job.started = True
+                if job.key is not None:
+                    self._pending.pop(job.key, None)
+            try:
+                if job.kind == 'raw':
+                    job.result = self.monitor.send_raw_frame(job.payload)
+                else:
+                    job.result = self.monitor.send_p18_command(job.payload)
+                    job.window = self.monitor.take_bus_window()
+            except Exception as e:
+                job.result = (None, f"Broker error: {str(e)}")
+            self.executed += 1
+            job.done.set()
+
+    def stats(self):
+        """Return scheduler counters"""
+        return {
+            "submitted": self.submitted,
+            "executed": self.executed,
+            "deduplicated": self.deduplicated,
+            "queued": self._queue.qsize()
+        }
+
+
+class SchedulerTransport:
+    """Monitor transport that submits to an in-process CommandScheduler
+
+    Used by the broker's own acquisition engine so its polls share the queue
+    (at low priority) with every connected client.
+    """
+
+    def __init__(self, scheduler, priority=PRIORITY_LOW):
+        self.scheduler = scheduler
+        self.priority = priority
+
+    def send(self, command):
+        return self.scheduler.submit(command, self.priority)
+
+    def send_timed(self, command):
+        """Send command; return ((response, error), window) with the scheduler's bus window"""
+        return self.scheduler.submit_timed(command, self.priority)
+
+    def send_raw(self, frame):
+        return self.scheduler.submit(frame, PRIORITY_HIGH, raw=True)
+
+    def connect(self):
+        return self.scheduler.monitor.connect()
+
+    def is_connected(self):
+        return self.scheduler.monitor.connected
+
+    def status(self):
+        return self.scheduler.monitor.connection_status()
+
+    def close(self):
+        pass
+
+
+class _BrokerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _BrokerHandler(socketserver.StreamRequestHandler):
+    """Serve newline-delimited JSON requests from one client connection"""
+
+    def handle(self):
+        broker = self.server.broker
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                message = json.loads(line)
+            except ValueError as e:
+                self._write({"ok": False, "error": f"Invalid request: {str(e)}"})
+                continue
+            if message.get('op') == 'subscribe':
+                broker.stream_snapshots(self, message.get('since', 0))
+                return
+            self._write(broker.handle(message))
+
+    def _write(self, document):
+        self.wfile.write(dumps(document) + b'\n')
+        self.wfile.flush()
+
+
+class SerialBroker:
+    """Unix-socket front end of a CommandScheduler and an acquisition engine"""
+
+    def __init__(self, scheduler, socket_path, engine=None, subscriber_queue=100):
+        self.scheduler = scheduler
+        self.socket_path = socket_path
+        self.engine = engine
+        self.subscriber_queue = subscriber_queue
+        self._subscribers = set()
+        self._subscribers_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """Bind the socket and serve clients in a background thread"""
+        if os.path.exists(self.socket_path):
+            # A stale socket left by a crashed broker would make bind() fail
+            os.unlink(self.socket_path)
+        self._server = _BrokerServer(self.socket_path, _BrokerHandler)
+        self._server.broker = self
+        os.chmod(self.socket_path, 0o660)
+        self.scheduler.start()
+        if self.engine is not None:
+            self.engine.add_listener(self._on_snapshot)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._server.serve_forever, name='p18-broker', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving and remove the socket"""
+        self._stop_event.set()
+        if self.engine is not None:
+            self.engine.remove_listener(self._on_snapshot)
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        self.scheduler.stop()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def handle(self, message):
+        """Answer one request message"""
+        op = message.get('op')
+        priority = message.get('priority', PRIORITY_NORMAL)
+        if op == 'command':
+            response, error = self.scheduler.submit(message.get('command', ''), priority)
+        elif op == 'raw':
+            response, error = self.scheduler.submit(message.get('frame', ''), priority, raw=True)
+        elif op in ('ping', 'status'):
+            return {"ok": True, "connected": self.scheduler.monitor.connected, "status": self.status()}
+        else:
+            return {"ok": False, "error": f"Unknown op: {op}"}
+        return {
+            "ok": error is None,
+            "response": response,
+            "error": error,
+            "connected": self.scheduler.monitor.connected
+        }
+
+    def status(self):
+        """Return broker, scheduler and connection counters"""
+        with self._subscribers_lock:
+            subscribers = len(self._subscribers)
+        return {
+            "socket": self.socket_path,
+            "subscribers": subscribers,
+            "scheduler": self.scheduler.stats(),
+            "connection": self.scheduler.monitor.connection_status()
+        }
+
+    def _on_snapshot(self, snapshot):
+        with self._subscribers_lock:
+            subscribers = list(self._subscribers)
+        for pending in subscribers:
+            try:
+                pending.put_nowait(snapshot)
+            except queue.Full:
+                # A slow subscriber loses its oldest snapshot, never blocks acquisition
+                try:
+                    pending.get_nowait()
+                    pending.put_nowait(snapshot)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def stream_snapshots(self, handler, since=0):
+        """Write snapshots to a subscribed client until it disconnects"""
+        pending = queue.Queue(maxsize=self.subscriber_queue)
+        with self._subscribers_lock:
+            self._subscribers.add(pending)
+        try:
+            latest = self.engine.latest() if self.engine is not None else None
+            if latest and latest['seq'] > since:
+                pending.put_nowait(latest)
+            while not self._stop_event.is_set():
+                try:
+                    snapshot = pending.get(timeout=1)
+                except queue.Empty:
+                    continue
+                handler._write({"snapshot": {
+                    "seq": snapshot['seq'],
+                    "timestamp": snapshot['timestamp'],
+                    "data": snapshot['data']
+                }})
+        except OSError:
+            pass
+        finally:
+            with self._subscribers_lock:
+                self._subscribers.discard(pending)
+
+
+class BrokerTransport:
+    """Monitor transport that sends commands to a SerialBroker
+
+    P18InverterMonitor(transport=BrokerTransport(path)) parses replies exactly
+    as before but never opens the serial port itself. The socket is opened on
+    first use and reopened after any failure. A request is never re-sent once
+    written: a timeout after that is reported as a failure.
+    """
+
+    def __init__(self, socket_path, priority=PRIORITY_NORMAL, timeout=30):
+        self.socket_path = socket_path
+        self.priority = priority
+        self.timeout = timeout
+        self.last_error = None
+        self.device_connected = False
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        return sock
+
+    def _close_socket(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._file = None
+
+    def _stale(self):
+        """Return True if the broker closed the idle connection (e.g. it restarted)"""
+        try:
+            return self._sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+
+    def _request(self, message):
+        with self._lock:
+            if self._sock is not None and self._stale():
+                self._close_socket()
+            # Only connecting is retried: once the frame is sent it may have
+            # reached the inverter, and a set command must not run twice
+            for _ in range(2):
+                if self._sock is not None:
+                    break
+                try:
+                    self._sock = self._open()
+                    self._file = self._sock.makefile('rb')
+                except OSError as e:
+                    self._close_socket()
+                    self.last_error = str(e)
+            if self._sock is None:
+                self.device_connected = False
+                return None
+            try:
+                self._sock.sendall(dumps(message) + b'\n')
+                line = self._file.readline()
+                if not line:
+                    raise ConnectionError("Broker closed the connection")
+                reply = json.loads(line)
+            except (OSError, ValueError) as e:
+                self._close_socket()
+                self.last_error = str(e)
+                self.device_connected = False
+                return None
+            self.last_error = None
+            self.device_connected = bool(reply.get('connected'))
+            return reply
+
+    def _unavailable(self):
+        return None, f"Serial broker unavailable: {self.last_error}"
+
+    def send(self, command):
+        # Settings changes jump ahead of the queued polls, like raw frames
+        priority = self.priority if is_query(command) else PRIORITY_HIGH
+        reply = self._request({"op": "command", "command": command, "priority": priority})
+        if reply is None:
+            return self._unavailable()
+        return reply.get('response'), reply.get('error')
+
+    def send_raw(self, frame):
+        reply = self._request({"op": "raw", "frame": frame, "priority": PRIORITY_HIGH})
+        if reply is None:
+            return self._unavailable()
+        return reply.get('response'), reply.get('error')
+
+    def connect(self):
+        return self._request({"op": "ping"}) is not None and self.device_connected
+
+    def is_connected(self):
+        return self._sock is not None and self.device_connected
+
+    def status(self):
+        reply = self._request({"op": "status"})
+        if reply is None:
+            return {
+                "state": "disconnected",
+                "connected": False,
+                "last_error": self._unavailable()[1],
+                "broker": self.socket_path
+            }
+        status = dict(reply['status'].get('connection') or {})
+        status['broker'] = {key: value for key, value in reply['status'].items() if key != 'connection'}
+        return status
+
+    def close(self):
+        with self._lock:
+            self._close_socket()
+
+    def subscribe(self, since=0):
+        """Yield snapshots pushed by the broker (blocks; uses its own connection)"""
+        sock = self._open()
+        sock.settimeout(None)
+        try:
+            sock.sendall(dumps({"op": "subscribe", "since": since}) + b'\n')
+            for line in sock.makefile('rb'):
+                message = json.loads(line)
+                if 'snapshot' in message:
+                    yield message['snapshot']
+        finally:
+            sock.close()
+
+
+def main():
+    """Run the acquisition daemon with the broker socket enabled"""
+    from .daemon import main as daemon_main
+
+    os.environ.setdefault('SERIAL_BROKER_SOCKET', default_broker_socket_path())
+    daemon_main()
+
+
+if __name__ == '__main__':
+    main()
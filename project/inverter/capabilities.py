@@ -0,0 +1,193 @@
+# inverter/capabilities.py
+""" Per-firmware command capabilities and a circuit breaker for failing commands
+
+Many firmwares answer some P18 queries (DI, PRI<n>, PGS<n>, GMN, ...) with a
+NAK, or not at all. A NAK is recorded as "unsupported" for the firmware
+version reported by VFW and persisted, so after the first try such a command
+is refused instantly instead of going over the wire. Commands that get no
+reply at all are not unsupported as such, but after a few consecutive
+failures they are suspended for a cooldown period (circuit breaker); one
+trial request is let through when the cooldown expires.
+
+Entries are kept per query including its arguments: PRI3 answered with a
+NAK says nothing about PRI0, nor does ED with an invalid date about other
+days. Set commands are never learned from, since their NAK means the value
+was refused rather than that the command is unknown.
+"""
+import json
+import threading
+import time
+from datetime import datetime
+
+from .broker import is_query
+from .utils.group_commit import get_writer
+
+# Optional queries checked once for every new firmware version
+PROBE_COMMANDS = ('GMN', 'DI', 'PRI0', 'PGS0')
+
+
+class CommandRefused(str):
+    """Error message for a command refused without sending it
+
+    It is a plain string, so it fits the usual (result, error) tuples, with
+    the HTTP status the API should answer with.
+    """
+
+    def __new__(cls, message, status=501, retry_after=None):
+        error = super().__new__(cls, message)
+        error.status = status
+        error.retry_after = retry_after
+        return error
+
+
+class CapabilityMap:
+    """Commands known to be unsupported, by firmware version, plus a circuit breaker
+
+    Args:
+        path (str): JSON file to persist the map to, or None to keep it in memory
+        failure_threshold (int): Consecutive failures that open the breaker
+        cooldown (float): Seconds the breaker stays open (doubled on every
+            failed trial, up to max_cooldown)
+    """
+
+    def __init__(self, path=None, failure_threshold=3, cooldown=30, max_cooldown=3600):
+        self.path = path
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.firmware = None
+        self.firmwares = self._load()
+        # Unsupported commands seen before the firmware version was known
+        self.session_unsupported = set()
+        # command -> {"failures", "open_until", "cooldown", "trial"}
+        self.breakers = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if not self.path:
+            return {}
+        try:
+            # Includes a save still waiting for the next group commit
+            data = get_writer().read(self.path)
+            return json.loads(data) if data else {}
+        except ValueError:
+            return {}
+
+    def save(self):
+        """Persist the map atomically with the next group commit"""
+        if not self.path:
+            return False
+        with self._lock:
+            data = json.dumps(self.firmwares, indent=4)
+        get_writer().replace(self.path, data, 'config')
+        return True
+
+    def set_firmware(self, firmware):
+        """Switch to the capabilities of firmware; return True if it was never probed"""
+        with self._lock:
+            self.firmware = firmware
+            entry = self.firmwares.setdefault(firmware, {"unsupported": [], "probed": None})
+            for command in self.session_unsupported:
+                if command not in entry['unsupported']:
+                    entry['unsupported'].append(command)
+            self.session_unsupported.clear()
+            needs_probe = entry['probed'] is None
+        self.save()
+        return needs_probe
+
+    def mark_probed(self):
+        """Record that the optional commands were probed for the current firmware"""
+        with self._lock:
+            if self.firmware is None:
+                return
+            self.firmwares[self.firmware]['probed'] = datetime.now().isoformat()
+        self.save()
+
+    def unsupported(self):
+        """Return the unsupported commands of the current firmware"""
+        with self._lock:
+            return self._unsupported()
+
+    def _unsupported(self):
+        if self.firmware is None:
+            return set(self.session_unsupported)
+        return set(self.firmwares[self.firmware]['unsupported'])
+
+    def check(self, command):
+        """Return a CommandRefused error if command must not be sent, else None"""
+        with self._lock:
+            if command in self._unsupported():
+                return CommandRefused(f"Command {command} is not supported by firmware {self.firmware or 'in use'}")
+            breaker = self.breakers.get(command)
+            if breaker is None or not breaker['open_until']:
+                return None
+            now = time.monotonic()
+            remaining = breaker['open_until'] - now
+            if remaining <= 0:
+                # Half-open: this caller is the one trial, the others wait
+                # for its outcome (or another cooldown if it never reports)
+                breaker['trial'] = True
+                breaker['open_until'] = now + breaker['cooldown']
+                return None
+            return CommandRefused(
+                f"Command {command} suspended after {breaker['failures']} failures "
+                f"(retry in {remaining:.0f}s)", status=503, retry_after=int(remaining) + 1)
+
+    def record(self, command, response):
+        """Learn from the outcome of a query that was sent
+
+        Returns:
+            CommandRefused or None: The error to report for a NAK
+        """
+        if not is_query(command):
+            return None
+        if response and response.startswith('^0'):
+            with self._lock:
+                if self.firmware is None:
+                    self.session_unsupported.add(command)
+                elif command not in self.firmwares[self.firmware]['unsupported']:
+                    self.firmwares[self.firmware]['unsupported'].append(command)
+                self.breakers.pop(command, None)
+            self.save()
+            return CommandRefused(f"Command {command} is not supported by firmware {self.firmware or 'in use'}")
+        with self._lock:
+            if response:
+                self.breakers.pop(command, None)
+                return None
+            breaker = self.breakers.setdefault(
+                command, {"failures": 0, "open_until": None, "cooldown": self.cooldown, "trial": False})
+            breaker['failures'] += 1
+            if breaker['trial']:
+                # The trial after the cooldown failed as well: back off further
+                breaker['cooldown'] = min(self.max_cooldown, breaker['cooldown'] * 2)
+                breaker['trial'] = False
+            if breaker['failures'] >= self.failure_threshold:
+                breaker['open_until'] = time.monotonic() + breaker['cooldown']
+        return None
+
+    def forget(self, command=None):
+        """Clear the unsupported flag and breaker of one command (or all)"""
+        with self._lock:
+            for entry in ([self.firmwares[self.firmware]] if self.firmware else []):
+                entry['unsupported'] = [c for c in entry['unsupported'] if command and c != command]
+            self.session_unsupported = {c for c in self.session_unsupported if command and c != command}
+            for key in [command] if command else list(self.breakers):
+                self.breakers.pop(key, None)
+        self.save()
+
+    def status(self):
+        """Return the capability map and open breakers as a dict"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "firmware": self.firmware,
+                "unsupported": sorted(self._unsupported()),
+                "probed": self.firmwares.get(self.firmware, {}).get('probed') if self.firmware else None,
+                "suspended": {
+                    command: {
+                        "failures": breaker['failures'],
+                        "retry_in": round(max(0.0, breaker['open_until'] - now), 1)
+                    }
+                    for command, breaker in self.breakers.items() if breaker['open_until']
+                }
+            }
@@ -0,0 +1,93 @@
+# inverter/clock.py
+""" Fixed-rate acquisition clock and sample timestamps
+
+Sleeping "interval" seconds after each poll lets the schedule drift by the
+poll duration (up to several seconds at 2400 baud) and stamps samples with
+the time they were parsed. Instead, polls start on a grid of slots on the
+monotonic clock: each slot is the previous one plus the interval, whatever
+the poll took, so timing errors never accumulate. A poll that overruns the
+next slot(s) skips them and the skipped slots are counted.
+
+Samples are stamped with the midpoint of the serial transaction that
+produced them (from writing the request to the end of the reply), which is
+the best estimate of when the inverter took the measurement.
+"""
+import threading
+import time
+from datetime import datetime
+
+
+def monotonic_to_datetime(monotonic):
+    """Convert a time.monotonic() reading into a wall-clock datetime"""
+    return datetime.fromtimestamp(time.time() - (time.monotonic() - monotonic))
+
+
+def window_midpoint(window):
+    """Return the ISO wall-clock timestamp of the middle of a (tx_start, rx_end) window"""
+    tx_start, rx_end = window
+    return monotonic_to_datetime((tx_start + rx_end) / 2).isoformat()
+
+
+class FixedRateClock:
+    """Wake up on a fixed-rate grid of slots on the monotonic clock
+
+    Args:
+        interval (float): Seconds between slots; may be changed between waits
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.slots = 0
+        self.skipped = 0
+        self.last_lateness = None
+        self.max_lateness = 0.0
+        self._total_lateness = 0.0
+        self._next_slot = None
+        self._lock = threading.Lock()
+
+    def wait(self, stop_event):
+        """Block until the next slot (or stop_event is set); return False if stopped
+
+        The first call returns at once and starts the grid.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._next_slot is None:
+                self._next_slot = now
+            else:
+                self._next_slot += self.interval
+                if now > self._next_slot + self.interval:
+                    # The last poll overran whole slots: skip them, stay on the grid
+                    missed = int((now - self._next_slot) // self.interval)
+                    self.skipped += missed
+                    self._next_slot += missed * self.interval
+            next_slot = self._next_slot
+        delay = next_slot - now
+        if delay > 0 and stop_event.wait(delay):
+            return False
+        if stop_event.is_set():
+            return False
+        lateness = max(0.0, time.monotonic() - next_slot)
+        with self._lock:
+            self.slots += 1
+            self.last_lateness = lateness
+            self.max_lateness = max(self.max_lateness, lateness)
+            self._total_lateness += lateness
+        return True
+
+    def reset(self):
+        """Start a new grid at the next wait"""
+        with self._lock:
+            self._next_slot = None
+
+    def status(self):
+        """Return the slot counters and wake-up lateness as a dict"""
+        with self._lock:
+            return {
+                "interval": self.interval,
+                "slots": self.slots,
+                "skipped_slots": self.skipped,
+                "last_lateness_ms": round(self.last_lateness * 1000, 2) if self.last_lateness is not None else None,
+                "max_lateness_ms": round(self.max_lateness * 1000, 2),
+                "mean_lateness_ms": round(self._total_lateness / self.slots * 1000, 2) if self.slots else None
+            }
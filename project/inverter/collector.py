@@ -0,0 +1,120 @@
+# inverter/collector.py
+""" Stand-in telemetry collector for testing the uplink without the real service
+
+    python -m project.inverter.collector --port 8088 --output received.ndjson
+
+Accepts the gzip-compressed NDJSON batches the uplink POSTs to any path,
+keeps the records in memory (and appends them to --output) and answers 204.
+Batches whose X-Batch-Cursor was already stored are acknowledged but not
+stored again. Set fail_with to an HTTP status to simulate an outage.
+"""
+import argparse
+import gzip
+import json
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _CollectorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real collector
+
+    def do_POST(self):
+        collector = self.server.collector
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        collector.requests += 1
+        if collector.fail_with:
+            self._reply(collector.fail_with)
+            return
+        try:
+            if self.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            records = [json.loads(line) for line in body.splitlines() if line.strip()]
+        except (OSError, ValueError):
+            self._reply(400)
+            return
+        collector.store(self.headers.get('X-Site-Id'), self.headers.get('X-Batch-Cursor'), records)
+        self._reply(204)
+
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInCollector:
+    """HTTP server storing the batches it receives
+
+    Args:
+        host (str): Address to listen on
+        port (int): TCP port (0 picks a free one)
+        output (str): File the received records are appended to, if any
+    """
+
+    def __init__(self, host='127.0.0.1', port=8088, output=None):
+        self.host = host
+        self.port = port
+        self.output = output
+        self.records = []
+        self.requests = 0
+        self.duplicates = 0
+        self.fail_with = None
+        self._cursors = set()
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/ingest"
+
+    def store(self, site, cursor, records):
+        with self._lock:
+            key = (site, cursor)
+            if cursor and key in self._cursors:
+                self.duplicates += 1
+                return
+            self._cursors.add(key)
+            self.records.extend(records)
+            if self.output:
+                with open(self.output, 'a') as f:
+                    for record in records:
+                        f.write(json.dumps(record) + '\n')
+
+    def start(self):
+        """Serve in a background thread and return the URL to post to"""
+        self._server = ThreadingHTTPServer((self.host, self.port), _CollectorHandler)
+        self._server.daemon_threads = True
+        self._server.collector = self
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name='p18-collector', daemon=True).start()
+        return self.url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def main():
+    """Run the collector in the foreground until SIGTERM/SIGINT"""
+    parser = argparse.ArgumentParser(description="Stand-in collector for the telemetry uplink")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on")
+    parser.add_argument('--port', type=int, default=8088, help="Port to listen on")
+    parser.add_argument('--output', default=None, help="Append the received records to this file")
+    args = parser.parse_args()
+
+    collector = StandInCollector(args.host, args.port, output=args.output)
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    print(f"Collecting on {collector.start()}")
+    stop_event.wait()
+    collector.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,372 @@
+# inverter/columnar.py
+""" Compressed columnar encoding of telemetry blocks
+
+A block holds a run of samples column by column, in the spirit of Gorilla
+(Facebook's in-memory time series store), adapted to byte-aligned arrays so
+decoding is a handful of vectorized operations instead of a bit-by-bit loop:
+
+- timestamps (microseconds) are stored as delta-of-delta: at a steady
+  polling rate nearly all of them are 0 or a few microseconds of jitter
+- numbers that are exact decimals with up to MAX_DECIMALS places (volts
+  x10, watts, percents...) become scaled integers stored as deltas
+- other floats are stored as the XOR of consecutive IEEE 754 values, which
+  is mostly zero bytes for slowly moving values
+- strings (working mode...) become indices into a per-block dictionary
+- booleans are 0/1 integers; missing values are marked in a bitmap
+
+Integer arrays use the narrowest width (1, 2, 4 or 8 bytes) that fits, then
+the whole block is zlib-compressed, which squeezes the runs of zero bytes
+the deltas and XORs produce. Decoding uses numpy when it is installed and
+array/itertools.accumulate otherwise.
+
+Block layout (little-endian):
+
+    MAGIC, body length (u32), samples (u32), first and last timestamp (i64),
+    CRC32 of the body (u32), then the zlib-compressed body
+
+The header lets range queries skip whole blocks without decompressing them.
+"""
+import itertools
+import json
+import math
+import operator
+import struct
+import sys
+import zlib
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, decoding falls back to pure Python
+    np = None
+
+MAGIC = b'P18C'
+HEADER = struct.Struct('<4sIIqqI')
+MAX_DECIMALS = 4
+
+# Column kinds
+FIXED = 0   # scaled integers, delta encoded
+XOR = 1     # float64, XOR of consecutive values
+STRING = 2  # dictionary indices
+OTHER = 3   # anything else, as a JSON list
+
+# Column flags
+HAS_MASK = 1
+IS_BOOL = 2
+IS_INT = 4
+
+_INT_CODES = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+_LITTLE_ENDIAN = sys.byteorder == 'little'
+
+
+class BlockError(ValueError):
+    """Raised for a truncated or corrupted block"""
+
+
+# ----------------------------------------------------------------------
+# Integer arrays
+# ----------------------------------------------------------------------
+def _width(values):
+    low, high = min(values, default=0), max(values, default=0)
+    for width in (1, 2, 4):
+        limit = 1 << (width * 8 - 1)
+        if -limit <= low and high < limit:
+            return width
+    return 8
+
+
+def _pack_ints(values):
+    width = _width(values)
+    data = array(_INT_CODES[width], values)
+    if not _LITTLE_ENDIAN:
+        data.byteswap()
+    return bytes([width]) + data.tobytes()
+
+
+def _unpack_ints(buffer, offset, count):
+    """Return (values, next offset) of an array written by _pack_ints"""
+    width = buffer[offset]
+    offset += 1
+    end = offset + width * count
+    if np is not None:
+        values = np.frombuffer(buffer, dtype=f'<i{width}', count=count, offset=offset).astype(np.int64)
+    else:
+        values = array(_INT_CODES[width])
+        values.frombytes(buffer[offset:end])
+        if not _LITTLE_ENDIAN:
+            values.byteswap()
+    return values, end
+
+
+def _delta(values, order):
+    for _ in range(order):
+        values = values[:1] + [b - a for a, b in zip(values, values[1:])]
+    return values
+
+
+def _undelta(values, order):
+    for _ in range(order):
+        values = np.cumsum(values) if np is not None else list(itertools.accumulate(values))
+    return values
+
+
+def encode_ints(values, order=1):
+    """Encode integers relative to the first one, delta encoded order times"""
+    base = values[0] if values else 0
+    return struct.pack('<qB', base, order) + _pack_ints(_delta([v - base for v in values], order))
+
+
+def decode_ints(buffer, offset, count):
+    """Return (integers, next offset); an ndarray with numpy, a list otherwise"""
+    base, order = struct.unpack_from('<qB', buffer, offset)
+    values, offset = _unpack_ints(buffer, offset + 9, count)
+    values = _undelta(values, order)
+    if np is not None:
+        return values + base, offset
+    return [value + base for value in values], offset
+
+
+# ----------------------------------------------------------------------
+# Columns
+# ----------------------------------------------------------------------
+def _decimals(value):
+    """Return the number of decimal places of value (None if more than MAX_DECIMALS)"""
+    if isinstance(value, int) or value.is_integer():
+        return 0
+    for places in range(1, MAX_DECIMALS + 1):
+        scaled = round(value * 10 ** places)
+        if scaled / 10 ** places == value:
+            return places
+    return None
+
+
+def _kind(present):
+    if all(isinstance(value, bool) for value in present):
+        return FIXED
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+        if any(isinstance(value, float) and not math.isfinite(value) for value in present):
+            return XOR
+        return FIXED
+    if all(isinstance(value, str) for value in present):
+        return STRING
+    return OTHER
+
+
+def encode_column(values):
+    """Encode one column (a list with None for missing values) into bytes"""
+    present = [value for value in values if value is not None]
+    kind = _kind(present)
+    flags = 0
+    chunks = []
+    if len(present) < len(values):
+        flags |= HAS_MASK
+        mask = bytearray((len(values) + 7) // 8)
+        for index, value in enumerate(values):
+            if value is not None:
+                mask[index >> 3] |= 1 << (index & 7)
+        chunks.append(bytes(mask))
+        # Repeat the previous value in the gaps so the deltas stay small
+        filled, last = [], present[0] if present else 0
+        for value in values:
+            last = last if value is None else value
+            filled.append(last)
+        values = filled
+
+    if kind == FIXED:
+        if present and all(isinstance(value, bool) for value in present):
+            flags |= IS_BOOL
+        elif all(isinstance(value, int) for value in present):
+            flags |= IS_INT
+        places = [_decimals(value) for value in present]
+        scaled = None
+        if None not in places:
+            places = max(places, default=0)
+            scaled = [round(value * 10 ** places) for value in values]
+            if any(abs(value) >= 1 << 62 for value in scaled):
+                scaled = None  # too large to take deltas safely
+        if scaled is not None:
+            chunks.append(struct.pack('<B', places) + encode_ints(scaled))
+        else:
+            kind = OTHER if flags & IS_INT else XOR
+    if kind == XOR:
+        flags &= ~IS_BOOL
+        bits = array('Q', struct.pack(f'<{len(values)}d', *(float(value) for value in values)))
+        if not _LITTLE_ENDIAN:
+            bits.byteswap()
+        xors = array('Q', [bits[0]] if bits else [])
+        xors.extend(a ^ b for a, b in zip(bits, bits[1:]))
+        if not _LITTLE_ENDIAN:
+            xors.byteswap()
+        chunks.append(xors.tobytes())
+    elif kind == STRING:
+        dictionary = list(dict.fromkeys(values))
+        codes = {value: index for index, value in enumerate(dictionary)}
+        encoded = [value.encode('utf-8') for value in dictionary]
+        chunks.append(struct.pack('<H', len(dictionary)))
+        chunks.extend(struct.pack('<H', len(value)) + value for value in encoded)
+        chunks.append(_pack_ints([codes[value] for value in values]))
+    elif kind == OTHER:
+        data = json.dumps(values, separators=(',', ':'), default=str).encode('utf-8')
+        chunks.append(struct.pack('<I', len(data)) + data)
+    return bytes([kind, flags]) + b''.join(chunks)
+
+
+def decode_column(buffer, offset, count, vectorized=False):
+    """Return (values, next offset) of a column written by encode_column
+
+    With vectorized=True (and numpy installed) numeric columns without
+    missing values are returned as ndarrays; otherwise values is a list.
+    """
+    kind, flags = buffer[offset], buffer[offset + 1]
+    offset += 2
+    mask = None
+    if flags & HAS_MASK:
+        size = (count + 7) // 8
+        mask = buffer[offset:offset + size]
+        offset += size
+
+    if kind == FIXED:
+        places = buffer[offset]
+        values, offset = decode_ints(buffer, offset + 1, count)
+        if flags & IS_BOOL:
+            values = values != 0 if np is not None else [value != 0 for value in values]
+        elif places:
+            scale = 10 ** places
+            values = values / scale if np is not None else [value / scale for value in values]
+        elif not flags & IS_INT:
+            # Floats that happened to be whole numbers
+            values = values.astype(np.float64) if np is not None else [float(value) for value in values]
+    elif kind == XOR:
+        end = offset + 8 * count
+        if np is not None:
+            xors = np.frombuffer(buffer, dtype='<u8', count=count, offset=offset)
+            values = np.bitwise_xor.accumulate(xors).view('<f8') if count else np.zeros(0)
+        else:
+            xors = array('Q')
+            xors.frombytes(buffer[offset:end])
+            if not _LITTLE_ENDIAN:
+                xors.byteswap()
+            bits = array('Q', itertools.accumulate(xors, operator.xor))
+            values = list(struct.unpack(f'={count}d', bits.tobytes()))
+        offset = end
+    elif kind == STRING:
+        size, = struct.unpack_from('<H', buffer, offset)
+        offset += 2
+        dictionary = []
+        for _ in range(size):
+            length, = struct.unpack_from('<H', buffer, offset)
+            dictionary.append(bytes(buffer[offset + 2:offset + 2 + length]).decode('utf-8'))
+            offset += 2 + length
+        codes, offset = _unpack_ints(buffer, offset, count)
+        values = [dictionary[code] for code in (codes.tolist() if np is not None else codes)]
+    elif kind == OTHER:
+        size, = struct.unpack_from('<I', buffer, offset)
+        values = json.loads(bytes(buffer[offset + 4:offset + 4 + size]))
+        offset += 4 + size
+    else:
+        raise BlockError(f"Unknown column kind {kind}")
+
+    if mask is not None or not vectorized or np is None:
+        if np is not None and not isinstance(values, list):
+            values = values.tolist()
+        if mask is not None:
+            values = [value if mask[index >> 3] >> (index & 7) & 1 else None
+                      for index, value in enumerate(values)]
+    return values, offset
+
+
+def skip_column(buffer, offset, count):
+    """Return the offset after the column at offset without decoding its values"""
+    kind, flags = buffer[offset], buffer[offset + 1]
+    offset += 2
+    if flags & HAS_MASK:
+        offset += (count + 7) // 8
+    if kind == FIXED:
+        # places (u8), base (i64), delta order (u8), then the integer array
+        offset += 10
+        return offset + 1 + buffer[offset] * count
+    if kind == XOR:
+        return offset + 8 * count
+    if kind == STRING:
+        size, = struct.unpack_from('<H', buffer, offset)
+        offset += 2
+        for _ in range(size):
+            length, = struct.unpack_from('<H', buffer, offset)
+            offset += 2 + length
+        return offset + 1 + buffer[offset] * count
+    if kind == OTHER:
+        size, = struct.unpack_from('<I', buffer, offset)
+        return offset + 4 + size
+    raise BlockError(f"Unknown column kind {kind}")
+
+
+# ----------------------------------------------------------------------
+# Blocks
+# ----------------------------------------------------------------------
+def encode_block(timestamps, columns, level=6):
+    """Encode one block
+
+    Args:
+        timestamps (list): Sample times in integer microseconds, ascending
+        columns (dict): Field name -> list of values, one per timestamp
+    """
+    count = len(timestamps)
+    parts = [struct.pack('<IH', count, len(columns)), encode_ints(timestamps, order=2)]
+    for name, values in columns.items():
+        encoded_name = name.encode('utf-8')
+        parts.append(struct.pack('<H', len(encoded_name)) + encoded_name)
+        parts.append(encode_column(values))
+    body = zlib.compress(b''.join(parts), level)
+    return HEADER.pack(MAGIC, len(body), count, timestamps[0], timestamps[-1], zlib.crc32(body)) + body
+
+
+def read_header(data, offset=0):
+    """Return (samples, first, last, body length) of the block at offset"""
+    if len(data) - offset < HEADER.size:
+        raise BlockError("Truncated block header")
+    magic, length, count, first, last, crc = HEADER.unpack_from(data, offset)
+    if magic != MAGIC:
+        raise BlockError("Bad block magic")
+    return count, first, last, length
+
+
+def decode_block(data, offset=0, fields=None, vectorized=False):
+    """Decode the block at offset into (timestamps, {name: values})
+
+    fields limits the columns decoded (the others are skipped, not decoded).
+    """
+    count, first, last, length = read_header(data, offset)
+    start = offset + HEADER.size
+    body = data[start:start + length]
+    if len(body) != length or zlib.crc32(body) != HEADER.unpack_from(data, offset)[5]:
+        raise BlockError("Corrupted block body")
+    buffer = memoryview(zlib.decompress(body))
+    stored_count, column_count = struct.unpack_from('<IH', buffer, 0)
+    timestamps, position = decode_ints(buffer, 6, stored_count)
+    if not vectorized and np is not None:
+        timestamps = timestamps.tolist()
+    wanted = None if fields is None else set(fields)
+    columns = {}
+    for _ in range(column_count):
+        size, = struct.unpack_from('<H', buffer, position)
+        name = bytes(buffer[position + 2:position + 2 + size]).decode('utf-8')
+        position += 2 + size
+        if wanted is not None and name not in wanted:
+            position = skip_column(buffer, position, stored_count)
+            continue
+        columns[name], position = decode_column(buffer, position, stored_count, vectorized)
+    return timestamps, columns
+
+
+def iter_blocks(data):
+    """Yield (offset, samples, first, last) of every complete block in data"""
+    offset = 0
+    while offset < len(data):
+        try:
+            count, first, last, length = read_header(data, offset)
+        except BlockError:
+            return  # a block cut short by a crash ends the file
+        if offset + HEADER.size + length > len(data):
+            return
+        yield offset, count, first, last
+        offset += HEADER.size + length
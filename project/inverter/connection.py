@@ -0,0 +1,173 @@
+# inverter/connection.py
+""" Serial connection supervision with background reconnects """
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows has no fcntl, serial access stays per process
+    fcntl = None
+
+
+class InterProcessLock:
+    """Advisory file lock that serializes serial transactions across processes
+
+    The per-process threading.Lock cannot stop two gunicorn workers (or a
+    worker and the acquisition process) from interleaving frames on the same
+    port. Holding this lock around every request/response exchange can. With
+    no path it is a no-op.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        if not self.path or fcntl is None:
+            return self
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return False
+
+
+class ConnectionSupervisor:
+    """Keep the serial port open and recover from real faults off the request path
+
+    A slow or empty reply is not a fault and leaves the port alone. Only I/O
+    errors raised by the port (EIO, device unplugged, port vanished) close it;
+    a background thread then reopens it with jittered exponential backoff while
+    callers fail fast with the cached fault instead of queueing on the port.
+    """
+
+    def __init__(self, open_port, base_delay=0.5, max_delay=30, jitter=0.25):
+        self.open_port = open_port
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.ser = None
+        self.state = 'disconnected'
+        self.last_error = None
+        self.last_fault_time = None
+        self.failures = 0
+        self.reconnects = 0
+        self.next_attempt = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def is_connected(self):
+        """Return True while the port is open and healthy"""
+        return self.state == 'connected' and self.ser is not None and self.ser.is_open
+
+    def is_reconnecting(self):
+        """Return True while the background thread is trying to reopen the port"""
+        return self.state == 'reconnecting'
+
+    def open(self):
+        """Open the port synchronously
+
+        Returns:
+            bool: True on success. On failure the error is recorded and the
+            port is left closed.
+        """
+        with self._lock:
+            if self.is_connected():
+                return True
+            self._close_port()
+            try:
+                self.ser = self.open_port()
+            except Exception as e:
+                self.ser = None
+                if self.state != 'reconnecting':
+                    self.state = 'disconnected'
+                self.last_error = str(e)
+                self.failures += 1
+                return False
+            self.state = 'connected'
+            self.failures = 0
+            self.last_error = None
+            self.next_attempt = None
+            return True
+
+    def close(self):
+        """Close the port and stop any background reconnect"""
+        self._stop_event.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(1)
+        self._thread = None
+        with self._lock:
+            self._close_port()
+            self.state = 'disconnected'
+            self.next_attempt = None
+
+    def _close_port(self):
+        if self.ser is not None:
+            try:
+                self.ser.close()
+            except Exception:
+                pass
+        self.ser = None
+
+    def report_fault(self, error):
+        """Record a real I/O fault, close the port and reconnect in the background"""
+        with self._lock:
+            self._close_port()
+            self.last_error = str(error)
+            self.last_fault_time = datetime.now().isoformat()
+        self.start_reconnect()
+
+    def start_reconnect(self):
+        """Start the background reconnect thread if it is not already running"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self.state = 'reconnecting'
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._reconnect_loop, name='p18-reconnect', daemon=True)
+            self._thread.start()
+
+    def backoff_delay(self):
+        """Return the next reconnect delay: exponential in the failure count, with jitter"""
+        delay = min(self.max_delay, self.base_delay * (2 ** min(self.failures, 16)))
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _reconnect_loop(self):
+        while not self._stop_event.is_set():
+            delay = self.backoff_delay()
+            self.next_attempt = time.time() + delay
+            if self._stop_event.wait(delay):
+                return
+            if self.open():
+                self.reconnects += 1
+                return
+
+    def unavailable_message(self):
+        """Describe why the device is unavailable, for fast failure responses"""
+        message = "Device unavailable"
+        if self.last_error:
+            message += f": {self.last_error}"
+        if self.is_reconnecting() and self.next_attempt:
+            message += f" (retrying in {max(0.0, self.next_attempt - time.time()):.1f}s)"
+        return message
+
+    def status(self):
+        """Return the connection health as a dict"""
+        return {
+            "state": self.state,
+            "connected": self.is_connected(),
+            "failures": self.failures,
+            "reconnects": self.reconnects,
+            "last_error": self.last_error,
+            "last_fault": self.last_fault_time,
+            "next_attempt_in": round(max(0.0, self.next_attempt - time.time()), 1)
+            if self.is_reconnecting() and self.next_attempt else None
+        }
@@ -0,0 +1,178 @@
+# inverter/daemon.py
+""" Acquisition daemon: the single owner of the serial port
+
+Run it next to any number of web workers started with ACQUISITION_MODE=shared:
+
+    python -m project.inverter.daemon
+
+or let gunicorn start it from project/gunicorn.conf.py. It polls the inverter
+with the usual AcquisitionEngine and publishes every snapshot, together with
+the engine counters, into the shared-memory segment at SHARED_STATE_PATH.
+
+With SERIAL_BROKER_SOCKET set it also serves the serial broker on that
+socket, and its own polls go through the broker queue at low priority.
+"""
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from .acquisition import create_engine
+from .broker import CommandScheduler, SchedulerTransport, SerialBroker
+from .monitor import P18InverterMonitor
+from .modbus import create_modbus_gateway
+from .mqtt import create_mqtt_publisher
+from .parallel import create_parallel_poller
+from .shared_state import SharedSnapshotWriter
+from .retention import create_compactor
+from .store import create_telemetry_store
+from .uplink import create_uplink
+from .warm_start import create_warm_start
+from .utils import group_commit
+from .utils.port_detector import InverterPortDetector, start_hotplug_watcher
+
+
+def _shared_snapshot(engine):
+    """Return the latest snapshot of engine in the shared document layout, or None"""
+    latest = engine.latest()
+    if not latest:
+        return None
+    return {
+        "seq": latest['seq'],
+        "timestamp": latest['timestamp'],
+        "data": latest['data'],
+        "stale": latest['stale'],
+        "latency": latest['latency']
+    }
+
+
+def _shared_document(engine, epoch, mqtt_publisher=None, modbus_gateway=None, uplink=None, store=None,
+                     compactor=None, parallel=None):
+    """Build the document published to the shared segment"""
+    snapshot = _shared_snapshot(engine)
+    stats = engine.stats()
+    stats['mode'] = 'daemon'
+    stats['pid'] = os.getpid()
+    stats['writes'] = group_commit.get_writer().stats()
+    if mqtt_publisher is not None:
+        stats['mqtt'] = mqtt_publisher.status()
+    if modbus_gateway is not None:
+        stats['modbus'] = modbus_gateway.status()
+    if uplink is not None:
+        stats['uplink'] = uplink.status()
+    if store is not None:
+        stats['store'] = store.status()
+    if compactor is not None:
+        stats['retention'] = compactor.status()
+    document = {"epoch": epoch, "snapshot": snapshot, "stats": stats}
+    if parallel is not None:
+        # Workers mirror the group snapshot from here instead of polling the units
+        document['parallel'] = {"snapshot": _shared_snapshot(parallel), "stats": parallel.stats()}
+    return document
+
+
+def run_acquisition_daemon(config=None, stop_event=None):
+    """Own the serial port, acquire snapshots and publish them until stopped"""
+    # Imported here so gunicorn.conf.py can import this module cheaply
+    from project.app import load_config
+
+    settings = load_config(config)
+    stop_event = stop_event or threading.Event()
+    commit_writer = group_commit.configure(settings['WRITE_COMMIT_INTERVAL'], settings['WRITE_COMMIT_BYTES'],
+                                           settings['WRITE_FSYNC'])
+
+    detector = InverterPortDetector()
+    if settings['INVERTER_SERIAL']:
+        preferred_port = detector.get_preferred_port(settings['INVERTER_SERIAL'])
+        if preferred_port:
+            settings['INVERTER_PORT'] = preferred_port
+
+    monitor = P18InverterMonitor(port=settings['INVERTER_PORT'],
+                                 port_lock_file=settings['SERIAL_LOCK_FILE'],
+                                 cache_replies=not settings['SERIAL_BROKER_SOCKET'])
+    watcher = start_hotplug_watcher(monitor, detector) if settings['HOTPLUG_WATCH'] else None
+    broker = None
+    if settings['SERIAL_BROKER_SOCKET']:
+        scheduler = CommandScheduler(monitor)
+        engine = create_engine(P18InverterMonitor(port=settings['INVERTER_PORT'],
+                                                  transport=SchedulerTransport(scheduler)), settings)
+        broker = SerialBroker(scheduler, settings['SERIAL_BROKER_SOCKET'], engine=engine)
+        broker.start()
+    else:
+        engine = create_engine(monitor, settings)
+    writer = SharedSnapshotWriter(settings['SHARED_STATE_PATH'])
+    epoch = f"{os.getpid()}-{time.time():.0f}"
+    write_lock = threading.Lock()
+    mqtt_publisher = create_mqtt_publisher(engine, settings)
+    modbus_gateway = create_modbus_gateway(engine, settings)
+    uplink = create_uplink(engine, settings)
+    store = create_telemetry_store(engine, settings)
+    compactor = create_compactor(store, settings)
+    parallel = create_parallel_poller(engine.monitor, settings)
+
+    def publish(_snapshot=None):
+        with write_lock:
+            writer.write(_shared_document(engine, epoch, mqtt_publisher, modbus_gateway, uplink, store,
+                                          compactor, parallel))
+
+    engine.add_listener(publish)
+    if parallel is not None:
+        parallel.add_listener(publish)
+    warm_start = create_warm_start(engine.monitor, engine, settings)
+    publish()
+    engine.start()
+    if parallel is not None:
+        parallel.start()
+    try:
+        # Refresh the published counters even when no snapshot changes
+        while not stop_event.wait(max(1.0, engine.interval)):
+            publish()
+    finally:
+        if parallel is not None:
+            parallel.stop()
+        engine.stop()
+        if mqtt_publisher is not None:
+            mqtt_publisher.stop()
+        if modbus_gateway is not None:
+            modbus_gateway.stop()
+        if uplink is not None:
+            uplink.stop()
+        if compactor is not None:
+            compactor.stop()
+        if store is not None:
+            store.stop()
+        if warm_start is not None:
+            warm_start.stop()
+        if watcher is not None:
+            watcher.stop()
+        if broker is not None:
+            broker.stop()
+        monitor.disconnect()
+        writer.close()
+        commit_writer.stop()
+
+
+def main():
+    """Run the daemon in the foreground until SIGTERM/SIGINT"""
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    run_acquisition_daemon(stop_event=stop_event)
+
+
+def start_acquisition_process(env=None):
+    """Start the acquisition daemon as a separate Python process and return it
+
+    A plain subprocess (not multiprocessing) is used on purpose: gunicorn forks
+    its workers from the process that calls this, and forked workers must not
+    inherit a multiprocessing child they would terminate on exit.
+    """
+    repo_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return subprocess.Popen([sys.executable, '-m', 'project.inverter.daemon'],
+                            cwd=repo_root, env=env)
+
+
+if __name__ == '__main__':
+    main()
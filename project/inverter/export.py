@@ -0,0 +1,238 @@
+# inverter/export.py
+""" Bulk export of the telemetry store as CSV, NDJSON or Parquet
+
+The exporters are generators of byte chunks fed straight from
+TelemetryStore.scan(), so the export endpoint and the command line stream
+any range in constant memory:
+
+    python -m project.inverter.export --from 2025-01-01 --to 2025-03-31 \\
+        --format csv --fields battery.voltage,pv.pv1_power -o q1.csv.gz --gzip
+
+Parquet needs pyarrow (pip install pyarrow); rows are written in row groups
+of ROW_GROUP_SIZE samples, each yielded as soon as it is encoded. The rollup
+tiers of retention.py (--resolution 1m, 1h...) export the same way.
+"""
+import argparse
+import csv
+import io
+import os
+import sys
+import zlib
+
+from .utils import serialization
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrow is optional
+    pyarrow = None
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+CHUNK_SIZE = 64 * 1024
+ROW_GROUP_SIZE = 50000
+
+
+def iter_csv(rows, fields=None, chunk_size=CHUNK_SIZE):
+    """Yield CSV chunks; without fields the columns are those of the first sample"""
+    buffer = io.StringIO()
+    writer = None
+    for timestamp, values in rows:
+        if writer is None:
+            fields = list(fields or values)
+            writer = csv.writer(buffer)
+            writer.writerow(['timestamp'] + fields)
+        writer.writerow([timestamp.isoformat()] + ['' if values.get(name) is None else values.get(name)
+                                                   for name in fields])
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if writer is None and fields:
+        buffer.write(','.join(['timestamp'] + list(fields)) + '\r\n')
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def iter_ndjson(rows, fields=None, chunk_size=CHUNK_SIZE):
+    """Yield NDJSON chunks, one {"timestamp", fields...} object per sample"""
+    lines = []
+    size = 0
+    for timestamp, values in rows:
+        line = serialization.dumps(dict(values, timestamp=timestamp.isoformat())) + b'\n'
+        lines.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield b''.join(lines)
+            lines, size = [], 0
+    if lines:
+        yield b''.join(lines)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file collecting what pyarrow writes until it is taken"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def _as_float(value):
+    return float(value) if isinstance(value, (int, float)) else None
+
+
+def _as_bool(value):
+    return value if isinstance(value, bool) else None
+
+
+def _as_string(value):
+    return None if value is None else str(value)
+
+
+def _column_kind(values):
+    """Return the Parquet kind of a field from its values: 'bool', 'float' or 'string'
+
+    A field without any value yet is a (nullable) float column, the kind of
+    nearly every telemetry field.
+    """
+    present = [value for value in values if value is not None]
+    if present and all(isinstance(value, bool) for value in present):
+        return 'bool'
+    if all(isinstance(value, (int, float)) for value in present):
+        return 'float'
+    return 'string'
+
+
+_KINDS = {'bool': _as_bool, 'float': _as_float, 'string': _as_string}
+
+
+def iter_parquet(rows, fields=None, row_group_size=ROW_GROUP_SIZE):
+    """Yield a Parquet file in chunks, one row group at a time
+
+    The schema is taken from the kinds of the values in the first row group,
+    and later values are converted to it (a value of another kind is written
+    as null), so a column never changes type in the middle of the stream.
+    """
+    if pyarrow is None:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+    arrow_types = {'bool': pyarrow.bool_(), 'float': pyarrow.float64(), 'string': pyarrow.string()}
+    sink = _ChunkSink()
+    writer = None
+    schema = None
+    converters = None
+    timestamps = []
+    columns = None
+
+    def write_group():
+        nonlocal writer, schema, converters
+        if schema is None:
+            kinds = {name: _column_kind(values) for name, values in columns.items()}
+            schema = pyarrow.schema([('timestamp', pyarrow.timestamp('us'))] +
+                                    [(name, arrow_types[kind]) for name, kind in kinds.items()])
+            converters = {name: _KINDS[kind] for name, kind in kinds.items()}
+            writer = pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd')
+        data = {'timestamp': timestamps}
+        for name, values in columns.items():
+            data[name] = [converters[name](value) for value in values]
+        writer.write_table(pyarrow.Table.from_pydict(data, schema=schema))
+        timestamps.clear()
+        for values in columns.values():
+            values.clear()
+
+    for timestamp, values in rows:
+        if columns is None:
+            fields = list(fields or values)
+            columns = {name: [] for name in fields}
+        timestamps.append(timestamp)
+        for name in fields:
+            columns[name].append(values.get(name))
+        if len(timestamps) >= row_group_size:
+            write_group()
+            yield sink.take()
+    if columns is None:
+        return
+    if timestamps:
+        write_group()
+    writer.close()
+    yield sink.take()
+
+
+WRITERS = {'csv': iter_csv, 'ndjson': iter_ndjson, 'parquet': iter_parquet}
+
+
+def iter_export(store, start=None, end=None, fmt='csv', fields=None):
+    """Yield the chunks of an export of store between start and end"""
+    return WRITERS[fmt](store.scan(start, end, fields), fields)
+
+
+def gzip_chunks(chunks, level=6):
+    """Gzip-compress a stream of chunks on the fly"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def main():
+    """Export a range of the telemetry store to a file or stdout"""
+    # Imported here: project.app imports this module through the API routes
+    from project.app import load_config
+    from .retention import rollup_fields
+    from .store import TelemetryStore
+
+    parser = argparse.ArgumentParser(description="Export stored telemetry as CSV, NDJSON or Parquet")
+    parser.add_argument('--from', dest='start', default=None, help="Start date or datetime (ISO)")
+    parser.add_argument('--to', dest='end', default=None, help="End date (inclusive) or datetime (exclusive)")
+    parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+    parser.add_argument('--fields', default=None, help="Comma-separated dotted field names")
+    parser.add_argument('--store', default=None, help="Store directory (default: TELEMETRY_STORE)")
+    parser.add_argument('--resolution', default='raw',
+                        help="raw, or a rollup tier of RETENTION_TIERS such as 1m or 1h")
+    parser.add_argument('--gzip', action='store_true', help="Compress the output")
+    parser.add_argument('-o', '--output', default='-', help="Output file (default: stdout)")
+    args = parser.parse_args()
+
+    directory = args.store or load_config()['TELEMETRY_STORE']
+    if not directory:
+        parser.error("No telemetry store configured, use --store")
+    fields = args.fields.split(',') if args.fields else None
+    if args.resolution != 'raw':
+        directory = os.path.join(directory, args.resolution)
+        if not os.path.isdir(directory):
+            parser.error(f"No {args.resolution} rollups in the store")
+        fields = rollup_fields(fields) if fields else None
+    try:
+        chunks = iter_export(TelemetryStore(directory), args.start, args.end, args.format, fields)
+        if args.gzip:
+            chunks = gzip_chunks(chunks)
+        output = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+        with output:
+            for chunk in chunks:
+                output.write(chunk)
+    except (ValueError, RuntimeError) as e:
+        parser.error(str(e))
+
+
+if __name__ == '__main__':
+    main()
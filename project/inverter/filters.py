@@ -0,0 +1,70 @@
+# inverter/filters.py
+""" Deadband and rate-limit filtering of acquired telemetry """
+import threading
+import time
+
+# Default per-field rules, keyed by dotted snapshot field name.
+#   deadband:     emit only when the value moved by more than this amount
+#   max_interval: emit anyway once this many seconds passed since the last emit
+#   min_interval: never emit more often than this many seconds
+DEFAULT_RULES = {
+    'battery.voltage': {'deadband': 0.2, 'max_interval': 60},
+    'battery.voltage_scc1': {'deadband': 0.2, 'max_interval': 60},
+    'battery.voltage_scc2': {'deadband': 0.2, 'max_interval': 60},
+    'pv.pv1_voltage': {'deadband': 1.0, 'max_interval': 60},
+    'pv.pv2_voltage': {'deadband': 1.0, 'max_interval': 60},
+    'grid.voltage': {'deadband': 1.0, 'max_interval': 60},
+    'output.voltage': {'deadband': 1.0, 'max_interval': 60},
+}
+
+
+class SignificanceFilter:
+    """Suppress insignificant changes of noisy fields before they are published
+
+    Fields without a rule pass through unchanged. For a field with a rule the
+    last emitted value is held until the new value is significant, so jitter
+    does not show up as a change anywhere downstream (change feed, history,
+    push integrations).
+    """
+
+    def __init__(self, rules=None):
+        self.rules = dict(DEFAULT_RULES if rules is None else rules)
+        self.suppressed = 0
+        self._emitted = {}
+        self._lock = threading.Lock()
+
+    def _is_significant(self, rule, emitted, value, now):
+        """Decide whether value should replace the emitted one"""
+        last_value, last_time = emitted
+        elapsed = now - last_time
+        if rule.get('min_interval') and elapsed < rule['min_interval']:
+            return False
+        if rule.get('max_interval') and elapsed >= rule['max_interval']:
+            return True
+        numeric = (int, float)
+        if isinstance(value, numeric) and isinstance(last_value, numeric) \
+                and not isinstance(value, bool) and not isinstance(last_value, bool):
+            return abs(value - last_value) > rule.get('deadband', 0)
+        return value != last_value
+
+    def apply(self, flat, now=None):
+        """Return a copy of flat (dotted field -> value) with insignificant updates held back"""
+        now = time.monotonic() if now is None else now
+        filtered = dict(flat)
+        with self._lock:
+            for name, rule in self.rules.items():
+                if name not in flat:
+                    continue
+                value = flat[name]
+                emitted = self._emitted.get(name)
+                if emitted is None or self._is_significant(rule, emitted, value, now):
+                    self._emitted[name] = (value, now)
+                else:
+                    filtered[name] = emitted[0]
+                    self.suppressed += 1
+        return filtered
+
+    def reset(self):
+        """Forget the emitted values so the next sample passes unfiltered"""
+        with self._lock:
+            self._emitted.clear()
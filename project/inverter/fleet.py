@@ -0,0 +1,201 @@
+# inverter/fleet.py
+""" Hub mode: a fleet summary aggregated from many pi18-monitor instances
+
+A hub queries the status, mode, fault and energy endpoints of every node
+concurrently from a thread pool sharing one pooled keep-alive session, so a
+summary costs one round trip to the slowest node rather than the sum of them.
+
+Latency is bounded even when nodes are slow or down:
+
+- every request has the per-node timeout
+- a summary waits at most that timeout; a node that has not answered by
+  then is reported from its last cached reply (flagged stale) while its
+  request keeps running in the background for the next summary
+- a node never has more than one request per endpoint in flight
+- replies younger than the cache TTL are reused without asking again
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Name -> (path, cache TTL multiplier); energy counters change slowly
+NODE_ENDPOINTS = {
+    'status': ('/api/v1/inverter/data/status', 1),
+    'mode': ('/api/v1/inverter/data/mode', 1),
+    'faults': ('/api/v1/inverter/data/faults', 1),
+    'energy': ('/api/v1/inverter/energy/total', 12),
+}
+
+
+def parse_nodes(spec):
+    """Parse 'name=url,url,...' into {name: base url}; unnamed nodes are named after their URL"""
+    nodes = {}
+    for entry in (spec or '').split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, url = entry.partition('=') if '=' in entry.split('://')[0] else ('', '', entry)
+        url = url.rstrip('/')
+        nodes[name or url.split('://')[-1]] = url
+    return nodes
+
+
+class FleetHub:
+    """Query many monitor nodes concurrently and summarize them
+
+    Args:
+        nodes (dict): Node name -> base URL (e.g. http://site-a:5000)
+        timeout (float): Per-node request timeout, and the longest a summary waits
+        cache_ttl (float): Seconds a node reply is reused without asking again
+        max_workers (int): Requests in flight at most
+    """
+
+    def __init__(self, nodes, timeout=2.0, cache_ttl=5.0, max_workers=16):
+        self.nodes = dict(nodes)
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.requests = 0
+        self.failures = 0
+        self.cache_hits = 0
+        # (node, endpoint) -> {"data", "error", "fetched" (monotonic), "elapsed"}
+        self._cache = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='p18-fleet')
+        self.session = requests.Session()
+        # One pool per node, each big enough for all endpoints at once
+        adapter = HTTPAdapter(pool_connections=max(10, len(self.nodes)), pool_maxsize=len(NODE_ENDPOINTS))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _fetch(self, node, endpoint):
+        path = NODE_ENDPOINTS[endpoint][0]
+        started = time.monotonic()
+        entry = {"data": None, "error": None}
+        try:
+            response = self.session.get(self.nodes[node] + path, timeout=self.timeout)
+            if response.status_code == 200:
+                entry['data'] = response.json()
+            else:
+                entry['error'] = f"HTTP {response.status_code}"
+        except (requests.RequestException, ValueError) as e:
+            entry['error'] = str(e)
+        entry['fetched'] = time.monotonic()
+        entry['elapsed'] = entry['fetched'] - started
+        with self._lock:
+            self.requests += 1
+            if entry['error']:
+                self.failures += 1
+                # Keep serving the last good reply, but remember the error
+                previous = self._cache.get((node, endpoint))
+                if previous and previous['data'] is not None:
+                    entry['data'] = previous['data']
+                    entry['data_fetched'] = previous.get('data_fetched', previous['fetched'])
+            self._cache[(node, endpoint)] = entry
+            del self._inflight[(node, endpoint)]
+        return entry
+
+    def refresh(self, nodes=None):
+        """Fetch what is not fresh in the cache and wait up to the timeout for it"""
+        now = time.monotonic()
+        futures = []
+        with self._lock:
+            for node in nodes or self.nodes:
+                for endpoint, (_, ttl_factor) in NODE_ENDPOINTS.items():
+                    key = (node, endpoint)
+                    cached = self._cache.get(key)
+                    if cached and now - cached['fetched'] < self.cache_ttl * ttl_factor:
+                        self.cache_hits += 1
+                        continue
+                    future = self._inflight.get(key)
+                    if future is None:
+                        future = self.executor.submit(self._fetch, node, endpoint)
+                        self._inflight[key] = future
+                    futures.append(future)
+        if futures:
+            wait(futures, timeout=self.timeout)
+
+    def node_summary(self, node):
+        """Return the summary of one node from the cache"""
+        now = time.monotonic()
+        with self._lock:
+            entries = {endpoint: self._cache.get((node, endpoint)) for endpoint in NODE_ENDPOINTS}
+            pending = [endpoint for endpoint in NODE_ENDPOINTS if (node, endpoint) in self._inflight]
+        status = (entries['status'] or {}).get('data') or {}
+        mode = (entries['mode'] or {}).get('data') or {}
+        faults = (entries['faults'] or {}).get('data') or {}
+        energy = (entries['energy'] or {}).get('data') or {}
+        errors = {endpoint: entry['error'] for endpoint, entry in entries.items() if entry and entry['error']}
+        status_entry = entries['status']
+        pv = status.get('pv', {})
+        pv_power = None
+        if pv:
+            pv_power = (pv.get('pv1_power') or 0) + (pv.get('pv2_power') or 0)
+        fault_code = faults.get('fault_code')
+        return {
+            "name": node,
+            "url": self.nodes[node],
+            "online": bool(status_entry) and not status_entry['error'],
+            # Older than the TTL: the node did not answer in time (or at all) this round
+            "stale": not status_entry or bool(status_entry['error']) or 'status' in pending
+                     or now - status_entry['fetched'] > self.cache_ttl,
+            "age": round(now - status_entry.get('data_fetched', status_entry['fetched']), 1) if status else None,
+            "latency_ms": round(status_entry['elapsed'] * 1000, 1) if status_entry else None,
+            "working_mode": mode.get('mode'),
+            "in_fault": mode.get('mode') == 'fault' or bool(fault_code),
+            "fault_code": fault_code,
+            "pv_power": pv_power,
+            "load_power": status.get('output', {}).get('active_power'),
+            "battery_capacity": status.get('battery', {}).get('capacity_percent'),
+            "total_energy_wh": energy.get('total_energy_wh'),
+            "errors": errors
+        }
+
+    def summary(self):
+        """Refresh every node (bounded by the timeout) and return the fleet summary"""
+        started = time.monotonic()
+        self.refresh()
+        nodes = [self.node_summary(node) for node in self.nodes]
+        reporting = [node for node in nodes if node['pv_power'] is not None]
+        return {
+            "timestamp": datetime.now().isoformat(),
+            "nodes": len(nodes),
+            "online": sum(1 for node in nodes if node['online']),
+            "stale": sum(1 for node in nodes if node['stale']),
+            "total_pv_power": sum(node['pv_power'] for node in reporting),
+            "total_load_power": sum(node['load_power'] or 0 for node in reporting),
+            "total_energy_wh": sum(node['total_energy_wh'] or 0 for node in nodes),
+            "nodes_in_fault": [node['name'] for node in nodes if node['in_fault']],
+            "elapsed_ms": round((time.monotonic() - started) * 1000, 1),
+            "node_status": nodes
+        }
+
+    def stats(self):
+        """Return the hub counters as a dict"""
+        with self._lock:
+            return {
+                "nodes": len(self.nodes),
+                "requests": self.requests,
+                "failures": self.failures,
+                "cache_hits": self.cache_hits,
+                "in_flight": len(self._inflight),
+                "timeout": self.timeout,
+                "cache_ttl": self.cache_ttl
+            }
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+def create_fleet_hub(config):
+    """Build a FleetHub from the application configuration, or return None"""
+    nodes = parse_nodes(config['FLEET_NODES'])
+    if not nodes:
+        return None
+    return FleetHub(nodes, timeout=config['FLEET_TIMEOUT'], cache_ttl=config['FLEET_CACHE_TTL'],
+                    max_workers=config['FLEET_WORKERS'])
@@ -0,0 +1,238 @@
+# inverter/modbus.py
+""" Modbus/TCP server exposing the latest acquisition snapshot as registers
+
+SCADA masters poll Modbus devices every second or so. Rather than turning
+every poll into a P18 round trip, the registers are rebuilt from each
+acquisition snapshot and reads are answered from that image, so any number
+of masters can poll at any rate without extra serial traffic.
+
+Function codes 3 (read holding registers) and 4 (read input registers) both
+read the same read-only map (see REGISTER_MAP); anything else is answered
+with an "illegal function" exception. Values are scaled to integers (e.g.
+volts x10); a field missing from the snapshot reads as 0xFFFF (0x8000 for
+signed registers, 0xFFFFFFFF for 32-bit ones).
+"""
+import socketserver
+import struct
+import threading
+import time
+
+# Exception codes
+ILLEGAL_FUNCTION = 0x01
+ILLEGAL_DATA_ADDRESS = 0x02
+ILLEGAL_DATA_VALUE = 0x03
+
+# Working modes (MOD) as register values
+WORKING_MODE_CODES = {'Power On': 0, 'Standby': 1, 'Bypass': 2, 'Battery': 3, 'Fault': 4, 'Hybrid': 5}
+
+# FWS warning flags, bit 0 first, packed into one register
+FAULT_FLAGS = ('line_fail', 'output_short', 'over_temperature', 'fan_locked', 'battery_voltage_high',
+               'battery_low', 'battery_under', 'overload', 'eeprom_fail', 'power_limit',
+               'pv1_voltage_high', 'pv2_voltage_high', 'mppt1_overload', 'mppt2_overload',
+               'battery_low_scc1', 'battery_low_scc2')
+
+# address -> (snapshot field, scale, type); types: u16, s16, u32 (two registers, high word first)
+REGISTER_MAP = {
+    0: ('grid.voltage', 10, 'u16'),
+    1: ('grid.frequency', 10, 'u16'),
+    2: ('output.voltage', 10, 'u16'),
+    3: ('output.frequency', 10, 'u16'),
+    4: ('output.apparent_power', 1, 'u16'),
+    5: ('output.active_power', 1, 'u16'),
+    6: ('output.load_percent', 1, 'u16'),
+    7: ('battery.voltage', 10, 'u16'),
+    8: ('battery.voltage_scc1', 10, 'u16'),
+    9: ('battery.voltage_scc2', 10, 'u16'),
+    10: ('battery.discharge_current', 1, 'u16'),
+    11: ('battery.charging_current', 1, 'u16'),
+    12: ('battery.capacity_percent', 1, 'u16'),
+    13: ('temperature.heatsink', 1, 's16'),
+    14: ('temperature.mppt1', 1, 's16'),
+    15: ('temperature.mppt2', 1, 's16'),
+    16: ('pv.pv1_power', 1, 'u16'),
+    17: ('pv.pv2_power', 1, 'u16'),
+    18: ('pv.pv1_voltage', 10, 'u16'),
+    19: ('pv.pv2_voltage', 10, 'u16'),
+    20: ('status.configuration_changed', 1, 'u16'),
+    21: ('status.load_connected', 1, 'u16'),
+    22: ('working_mode', 1, 'u16'),
+    23: ('faults.code', 1, 'u16'),
+    24: ('faults', 1, 'u16'),
+    30: ('energy.total_wh', 1, 'u32'),
+    32: ('energy.today_wh', 1, 'u32'),
+    40: ('seq', 1, 'u32'),
+}
+# Register 42: seconds since the snapshot was taken, computed at read time
+AGE_REGISTER = 42
+REGISTER_COUNT = 43
+
+MISSING = {'u16': 0xFFFF, 's16': 0x8000, 'u32': 0xFFFFFFFF}
+
+
+def encode_registers(snapshot):
+    """Build the register image (bytes, 2 per register) of a snapshot"""
+    flat = snapshot['flat']
+    registers = [0] * REGISTER_COUNT
+    for address, (field, scale, kind) in REGISTER_MAP.items():
+        if field == 'seq':
+            value = snapshot['seq']
+        elif field == 'working_mode':
+            value = WORKING_MODE_CODES.get(flat.get('working_mode'))
+        elif field == 'faults':
+            flags = [flat.get(f"faults.{name}") for name in FAULT_FLAGS]
+            value = None if all(flag is None for flag in flags) else \
+                sum(1 << bit for bit, flag in enumerate(flags) if flag)
+        else:
+            value = flat.get(field)
+        if isinstance(value, bool):
+            value = int(value)
+        if not isinstance(value, (int, float)):
+            value = MISSING[kind]
+        else:
+            value = int(round(value * scale))
+        if kind == 'u32':
+            value &= 0xFFFFFFFF
+            registers[address] = value >> 16
+            registers[address + 1] = value & 0xFFFF
+        else:
+            registers[address] = value & 0xFFFF
+    return struct.pack(f">{REGISTER_COUNT}H", *registers)
+
+
+class ModbusRequestHandler(socketserver.BaseRequestHandler):
+    """Serve Modbus/TCP requests on one connection until the master closes it"""
+
+    def handle(self):
+        server = self.server
+        while True:
+            header = self._recv(7)
+            if header is None:
+                return
+            transaction, protocol, length, unit = struct.unpack('>HHHB', header)
+            pdu = self._recv(length - 1) if length > 1 else b''
+            if pdu is None or protocol != 0:
+                return
+            reply = server.gateway.respond(unit, pdu)
+            if reply is None:
+                continue
+            self.request.sendall(struct.pack('>HHHB', transaction, 0, len(reply) + 1, unit) + reply)
+
+    def _recv(self, size):
+        data = b''
+        while len(data) < size:
+            try:
+                chunk = self.request.recv(size - len(data))
+            except OSError:
+                return None
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ModbusGateway:
+    """Modbus/TCP server answering from the register image of the latest snapshot
+
+    Args:
+        host (str): Address to listen on
+        port (int): TCP port (502 is the standard one but needs privileges)
+        unit_id (int): Unit identifier to answer to; 0 answers every unit
+    """
+
+    def __init__(self, host='0.0.0.0', port=5020, unit_id=0):
+        self.host = host
+        self.port = port
+        self.unit_id = unit_id
+        self.engine = None
+        self.requests = 0
+        self.exceptions = 0
+        self.updates = 0
+        self._image = None
+        self._monotonic = None
+        self._server = None
+        self._thread = None
+
+    def attach(self, engine):
+        """Refresh the registers from every snapshot engine publishes"""
+        self.engine = engine
+        engine.add_listener(self.on_snapshot)
+        latest = engine.latest()
+        if latest:
+            self.on_snapshot(latest)
+        return self
+
+    def on_snapshot(self, snapshot):
+        # One reference assignment: readers see the old image or the new one, never a mix
+        self._image = (encode_registers(snapshot), snapshot['monotonic'])
+        self.updates += 1
+
+    def respond(self, unit, pdu):
+        """Return the response PDU for a request PDU, or None to ignore the request"""
+        if self.unit_id and unit not in (self.unit_id, 0xFF):
+            return None
+        self.requests += 1
+        function = pdu[0] if pdu else 0
+        if function not in (3, 4):
+            return self._exception(function, ILLEGAL_FUNCTION)
+        if len(pdu) < 5:
+            return self._exception(function, ILLEGAL_DATA_VALUE)
+        address, count = struct.unpack('>HH', pdu[1:5])
+        if not 1 <= count <= 125:
+            return self._exception(function, ILLEGAL_DATA_VALUE)
+        if address + count > REGISTER_COUNT:
+            return self._exception(function, ILLEGAL_DATA_ADDRESS)
+        image = self._image
+        if image is None:
+            registers = struct.pack(f">{REGISTER_COUNT}H", *([0xFFFF] * REGISTER_COUNT))
+        else:
+            registers, taken = image
+            age = min(0xFFFF, int(time.monotonic() - taken))
+            registers = registers[:AGE_REGISTER * 2] + struct.pack('>H', age) + registers[AGE_REGISTER * 2 + 2:]
+        data = registers[address * 2:(address + count) * 2]
+        return struct.pack('>BB', function, len(data)) + data
+
+    def _exception(self, function, code):
+        self.exceptions += 1
+        return struct.pack('>BB', (function | 0x80) & 0xFF, code)
+
+    def start(self):
+        """Listen and serve in a background thread"""
+        self._server = _ThreadingTCPServer((self.host, self.port), ModbusRequestHandler)
+        self._server.gateway = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='p18-modbus', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving"""
+        if self.engine is not None:
+            self.engine.remove_listener(self.on_snapshot)
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def status(self):
+        """Return the gateway counters as a dict"""
+        return {
+            "listen": f"{self.host}:{self.port}",
+            "unit_id": self.unit_id,
+            "requests": self.requests,
+            "exceptions": self.exceptions,
+            "updates": self.updates,
+            "registers": REGISTER_COUNT
+        }
+
+
+def create_modbus_gateway(engine, config):
+    """Build, attach and start a ModbusGateway from the application configuration, or return None"""
+    if not config['MODBUS_PORT']:
+        return None
+    gateway = ModbusGateway(config['MODBUS_HOST'], config['MODBUS_PORT'], unit_id=config['MODBUS_UNIT_ID'])
+    gateway.attach(engine).start()
+    return gateway
@@ -7,10 +7,26 @@ import re
 from datetime import datetime
 import glob
 import os
+from .broker import is_query
+from .capabilities import PROBE_COMMANDS
+from .clock import window_midpoint
+from .connection import ConnectionSupervisor, InterProcessLock
 
 class P18InverterMonitor:
-    def __init__(self, port="/dev/ttyUSB1"):
+    # Device identity replies, kept in memory once known for the connected device
+    IDENTITY_COMMANDS = ('PI', 'ID', 'VFW', 'GMN')
+    # Settings replies, kept until a set command or the GS configuration flag invalidates them
+    SETTINGS_COMMANDS = ('PIRI', 'ACCT', 'ACLT', 'DI')
+
+    def __init__(self, port="/dev/ttyUSB1", auto_reconnect=True, port_lock_file=None, transport=None,
+                 cache_replies=True, capabilities=None):
         self.port = port
+        # Optional CapabilityMap: unsupported and failing commands are refused without sending
+        self.capabilities = capabilities
+        # Port owners serving other clients (broker, serial process) leave caching to those clients
+        self.cache_replies = cache_replies
+        # Optional transport (e.g. a broker client) used instead of opening the port
+        self.transport = transport
         self.serial_config = {
             'baudrate': 2400,
             'bytesize': serial.EIGHTBITS,
@@ -19,15 +35,18 @@ class P18InverterMonitor:
             'timeout': 3,
             'write_timeout': 3
         }
-        self.ser = None
-        self.connected = False
         self.lock = threading.Lock()
+        self.port_lock = InterProcessLock(port_lock_file)
         self.last_values = {}
+        # Replies answered from memory (identity, and warm-start frames until revalidated)
+        self.cached_responses = {}
+        self.stale_commands = set()
+        # Last live reply per command
+        self.last_responses = {}
+        self._request_state = threading.local()
         self.error_log = []
-        self.connection_attempts = 0
-        self.max_connection_attempts = 3
-        self.last_connection_time = 0
-        self.connection_cooldown = 2  # seconds
+        self.auto_reconnect = auto_reconnect
+        self.supervisor = ConnectionSupervisor(self._open_serial)
         
         # Status mappings
         self.working_modes = {
@@ -62,74 +81,93 @@ class P18InverterMonitor:
         self.solar_power_priorities = {
             '0': 'Load-Battery-Utility', '1': 'Battery-Load-Utility'
         }
+        self.fault_codes = {
+            '1': 'Fan is locked', '2': 'Over temperature', '3': 'Battery voltage is too high',
+            '4': 'Battery voltage is too low', '5': 'Output short circuited or Over temperature',
+            '6': 'Output voltage is too high', '7': 'Over load time out', '8': 'Bus voltage is too high',
+            '9': 'Bus soft start failed', '11': 'Main relay failed', '51': 'Over current inverter',
+            '52': 'Bus soft start failed', '53': 'Inverter soft start failed', '54': 'Self-test failed',
+            '55': 'Over DC voltage on output of inverter', '56': 'Battery connection is open',
+            '57': 'Current sensor failed', '58': 'Output voltage is too low', '60': 'Inverter negative power',
+            '71': 'Parallel version different', '72': 'Output circuit failed', '80': 'CAN communication failed',
+            '81': 'Parallel host line lost', '82': 'Parallel synchronized signal lost',
+            '83': 'Parallel battery voltage detect different',
+            '84': 'Parallel Line voltage or frequency detect different',
+            '85': 'Parallel Line input current unbalanced', '86': 'Parallel output setting different'
+        }
         
         # Try to connect on initialization
         self.connect()
         
+    @property
+    def ser(self):
+        """The open serial port, or None"""
+        return self.supervisor.ser
+
+    @property
+    def connected(self):
+        """True while the serial port (or transport) is open and healthy"""
+        if self.transport is not None:
+            return self.transport.is_connected()
+        return self.supervisor.is_connected()
+
+    def _open_serial(self):
+        """Open the configured port (used by the connection supervisor)"""
+        return serial.Serial(port=self.port, **self.serial_config)
+
     def connect(self):
-        """Establish connection to the inverter with retry logic"""
-        # Check if we've tried too recently
-        current_time = time.time()
-        if (current_time - self.last_connection_time) < self.connection_cooldown:
-            time.sleep(0.5)  # Small delay to avoid hammering the port
-            
-        self.last_connection_time = current_time
-        
-        # Don't try to reconnect if we're already connected
-        if self.ser and self.ser.is_open:
-            self.connected = True
+        """Establish connection to the inverter
+
+        While the supervisor is reconnecting in the background this fails fast
+        instead of blocking the caller on the port.
+        """
+        if self.transport is not None:
+            return self.transport.connect()
+        if self.supervisor.is_connected():
             return True
-            
-        # Try alternative ports if main port fails repeatedly
-        ports_to_try = [self.port]
-        
-        # If we've failed multiple times, try other ports
-        if self.connection_attempts >= 2:
-            if self.port == "/dev/ttyUSB0":
-                ports_to_try.append("/dev/ttyUSB1")
-            elif self.port == "/dev/ttyUSB1":
-                ports_to_try.append("/dev/ttyUSB0")
-                
-        for port in ports_to_try:
-            try:
-                # Close existing connection if any
-                if self.ser:
-                    try:
-                        self.ser.close()
-                    except:
-                        pass
-                
-                # Open new connection
-                self.ser = serial.Serial(port=port, **self.serial_config)
-                self.connected = True
-                self.connection_attempts = 0  # Reset counter on success
-                
-                # If we connected to an alternative port, update our port
-                if port != self.port:
-                    print(f"Connected to alternative port: {port}")
-                    self.port = port
-                    
-                return True
-            except Exception as e:
-                self.error_log.append({
-                    'time': datetime.now().isoformat(),
-                    'code': 'E-CONN',
-                    'error': f"Connection error on {port}: {str(e)}"
-                })
-                
-        # Increment connection attempt counter
-        self.connection_attempts += 1
-        self.connected = False
+        if self.supervisor.is_reconnecting():
+            return False
+
+        if self.supervisor.open():
+            return True
+
+        self.error_log.append({
+            'time': datetime.now().isoformat(),
+            'code': 'E-CONN',
+            'error': f"Connection error on {self.port}: {self.supervisor.last_error}"
+        })
+        if self.auto_reconnect:
+            self.supervisor.start_reconnect()
         return False
             
+    def reattach(self, port):
+        """Switch to port (e.g. an adapter that was replugged) and reconnect at once
+
+        Skips whatever backoff delay the supervisor was waiting out.
+        """
+        with self.lock:
+            self.port = port
+            self.supervisor.close()
+            # The adapter may now lead to a different inverter
+            for command in self.IDENTITY_COMMANDS:
+                self.cached_responses.pop(command, None)
+        return self.connect()
+
     def disconnect(self):
         """Close the serial connection"""
-        if self.ser and self.ser.is_open:
-            try:
-                self.ser.close()
-            except:
-                pass
-        self.connected = False
+        if self.transport is not None:
+            self.transport.close()
+            return
+        self.supervisor.close()
+
+    def connection_status(self):
+        """Return the serial connection health"""
+        if self.transport is not None:
+            status = self.transport.status()
+        else:
+            status = self.supervisor.status()
+        status['port'] = self.port
+        return status
         
     def calculate_crc16_modbus(self, data):
         """Calculate CRC-16/MODBUS"""
@@ -150,34 +188,176 @@ class P18InverterMonitor:
         frame_start = f"^P{total_length:03d}{command}"
         frame_bytes = frame_start.encode('ascii')
         crc = self.calculate_crc16_modbus(frame_bytes)
-        complete_frame = frame_bytes + bytes([(crc >> 8) & 0xFF, crc & 0xFF, 0x0D])
+        # CRC bytes that would read as '(', CR or LF are sent incremented by one
+        crc_bytes = bytes(b + 1 if b in (0x28, 0x0D, 0x0A) else b for b in ((crc >> 8) & 0xFF, crc & 0xFF))
+        complete_frame = frame_bytes + crc_bytes + b'\r'
         return complete_frame
         
-    def send_p18_command(self, command):
-        """Send command to P18 inverter and get response with retry logic"""
-        # Try to connect if not connected
+    def send_p18_command(self, command, fresh=False):
+        """Send command to P18 inverter and get response with retry logic
+
+        Identity commands and warm-start frames are answered from memory unless
+        fresh is set. A stale (warm-start) answer is flagged for the current
+        thread, see take_stale_flag().
+        """
+        self._request_state.bus_window = None
+        if not fresh:
+            cached = self.cached_responses.get(command)
+            if cached is not None:
+                if command in self.stale_commands:
+                    self._request_state.stale = True
+                return cached, None
+
+        capabilities = self.capabilities
+        if capabilities is not None:
+            refused = capabilities.check(command)
+            if refused:
+                self._request_state.refused = refused
+                return None, refused
+
+        response, error = self._send_p18_command(command)
+        if capabilities is not None and (response or self.connected):
+            # Only a device that is reachable can tell us about a command
+            refused = capabilities.record(command, response)
+            if refused:
+                self._request_state.refused = refused
+                return None, refused
+        if response:
+            self.remember_response(command, response)
+            if response.startswith('^1') and not is_query(command):
+                # An accepted set command changes the settings behind the cache
+                self.invalidate_settings()
+        return response, error
+
+    def take_bus_window(self):
+        """Return (tx_start, rx_end) on the monotonic clock of this thread's last serial transaction
+
+        None if the last command was answered from memory or got no reply.
+        """
+        window = getattr(self._request_state, 'bus_window', None)
+        self._request_state.bus_window = None
+        return window
+
+    def sample_time(self):
+        """Return the ISO timestamp of the middle of the last transaction, or now"""
+        window = self.take_bus_window()
+        return window_midpoint(window) if window else datetime.now().isoformat()
+
+    def take_refused_flag(self):
+        """Return (once) the CommandRefused error this thread got, or None"""
+        refused = getattr(self._request_state, 'refused', None)
+        self._request_state.refused = None
+        return refused
+
+    def probe_capabilities(self):
+        """Try every optional command once so the capability map knows the firmware"""
+        for command in PROBE_COMMANDS:
+            self.send_p18_command(command, fresh=True)
+        self.capabilities.mark_probed()
+
+    def remember_response(self, command, response):
+        """Record a live reply, replacing any stale warm-start frame for command"""
+        self.last_responses[command] = response
+        self.stale_commands.discard(command)
+        if command == 'VFW' and self.capabilities is not None:
+            firmware = self.safe_extract_payload(response)
+            if firmware and firmware != self.capabilities.firmware and self.capabilities.set_firmware(firmware):
+                threading.Thread(target=self.probe_capabilities, name='p18-capability-probe', daemon=True).start()
+        if self.cache_replies and (command in self.IDENTITY_COMMANDS or command in self.SETTINGS_COMMANDS):
+            self.cached_responses[command] = response
+        else:
+            self.cached_responses.pop(command, None)
+
+    def invalidate_settings(self):
+        """Drop the cached settings replies so the next request reads them live"""
+        for command in self.SETTINGS_COMMANDS:
+            self.cached_responses.pop(command, None)
+            self.stale_commands.discard(command)
+        self.last_values.pop('rated_info', None)
+
+    def refresh_settings(self):
+        """Re-read every settings command live, dropping the ones that fail
+
+        Returns:
+            dict: {command: error or None}
+        """
+        results = {}
+        for command in self.SETTINGS_COMMANDS:
+            response, error = self.send_p18_command(command, fresh=True)
+            if not response:
+                self.cached_responses.pop(command, None)
+            results[command] = None if response else (error or "No response from inverter")
+        if self.cached_responses.get('PIRI'):
+            self.get_rated_info()
+        return results
+
+    def load_warm_responses(self, responses):
+        """Serve previously persisted replies, marked stale, until they are revalidated"""
+        for command, response in responses.items():
+            if command not in self.last_responses:
+                self.cached_responses[command] = response
+                self.stale_commands.add(command)
+
+    def discard_stale_responses(self):
+        """Forget every warm-start frame that was not revalidated yet"""
+        for command in list(self.stale_commands):
+            self.cached_responses.pop(command, None)
+        self.stale_commands.clear()
+
+    def take_stale_flag(self):
+        """Return True (once) if this thread was served a stale reply"""
+        stale = getattr(self._request_state, 'stale', False)
+        self._request_state.stale = False
+        return stale
+
+    def _send_p18_command(self, command):
+        """Send command over the transport or the serial port
+
+        An empty reply means the inverter is busy and is retried on the open
+        port. An I/O error is a real fault: the supervisor closes the port and
+        reconnects in the background while this call returns immediately.
+        """
+        if self.transport is not None:
+            send_timed = getattr(self.transport, 'send_timed', None)
+            if send_timed is not None:
+                # An in-process scheduler measures the transaction in its own thread
+                result, self._request_state.bus_window = send_timed(command)
+                return result
+            started = time.monotonic()
+            result = self.transport.send(command)
+            finished = time.monotonic()
+            # A serial process reports its own transaction time, without the queueing
+            elapsed = getattr(self.transport, 'last_transaction_time', None)
+            self._request_state.bus_window = (finished - elapsed if elapsed else started, finished)
+            return result
+
+        # Try to connect if not connected (fails fast while reconnecting)
         if not self.connected:
             if not self.connect():
-                return None, "Not connected to inverter"
+                return None, self.supervisor.unavailable_message()
                 
-        # Use a lock to prevent multiple threads from accessing the serial port simultaneously
-        with self.lock:
+        # Use a lock to prevent multiple threads (and processes) from accessing the serial port simultaneously
+        with self.lock, self.port_lock:
             max_retries = 2
             for attempt in range(max_retries + 1):
+                ser = self.ser
+                if ser is None:
+                    return None, self.supervisor.unavailable_message()
                 try:
                     # Format and send command
                     frame = self.build_p18_command(command)
-                    self.ser.reset_input_buffer()
-                    self.ser.reset_output_buffer()
+                    ser.reset_input_buffer()
+                    ser.reset_output_buffer()
                     
-                    self.ser.write(frame)
-                    self.ser.flush()
+                    tx_start = time.monotonic()
+                    ser.write(frame)
+                    ser.flush()
                     
                     # Read response
                     response = ""
                     start_time = time.time()
                     while (time.time() - start_time) < self.serial_config['timeout']:
-                        char = self.ser.read(1)
+                        char = ser.read(1)
                         if not char:
                             if response:  # If we have some response but hit a timeout
                                 break
@@ -188,13 +368,10 @@ class P18InverterMonitor:
                         if len(response) > 1000:
                             break
                     
-                    if not response and attempt < max_retries:
-                        # Try reconnecting
-                        self.disconnect()
-                        if not self.connect():
-                            continue  # Skip to next retry
-                    elif response:
+                    if response:
+                        self._request_state.bus_window = (tx_start, time.monotonic())
                         return response.strip(), None
+                    # No reply: the inverter is slow or busy, retry on the same port
                         
                 except Exception as e:
                     self.error_log.append({
@@ -202,18 +379,67 @@ class P18InverterMonitor:
                         'code': 'E-CMD',
                         'error': f"Command error: {str(e)}"
                     })
-                    
-                    if attempt < max_retries:
-                        # Try reconnecting
-                        self.disconnect()
-                        if not self.connect():
-                            continue  # Skip to next retry
-                    else:
-                        return None, str(e)
+                    self.supervisor.report_fault(e)
+                    return None, self.supervisor.unavailable_message()
             
             # If we get here, all retries failed
             return None, "No response from inverter after multiple attempts"
 
+    def send_raw_frame(self, frame):
+        """Send a pre-built frame (such as a ^S set command) and read one reply
+
+        Returns:
+            tuple: (response, error)
+        """
+        response, error = self._send_raw_frame(frame)
+        if response and response.startswith('^1'):
+            # An accepted set command changes the settings behind the cache
+            self.invalidate_settings()
+        return response, error
+
+    def _send_raw_frame(self, frame):
+        """Send a raw frame over the transport or the serial port"""
+        if self.transport is not None:
+            return self.transport.send_raw(frame)
+
+        if not self.connected:
+            if not self.connect():
+                return None, self.supervisor.unavailable_message()
+
+        with self.lock, self.port_lock:
+            ser = self.ser
+            if ser is None:
+                return None, self.supervisor.unavailable_message()
+            try:
+                ser.reset_input_buffer()
+                ser.reset_output_buffer()
+                ser.write(frame.encode('ascii'))
+                ser.flush()
+                
+                # Read response
+                response = ""
+                while True:
+                    char = ser.read(1)
+                    if not char:
+                        break
+                    response += char.decode('ascii', errors='ignore')
+                    if response.endswith('\r'):
+                        break
+                    if len(response) > 100:
+                        break
+                
+                if response:
+                    return response, None
+                return None, "No response from inverter"
+            except Exception as e:
+                self.error_log.append({
+                    'time': datetime.now().isoformat(),
+                    'code': 'E-CMD',
+                    'error': f"Command error: {str(e)}"
+                })
+                self.supervisor.report_fault(e)
+                return None, self.supervisor.unavailable_message()
+
     def validate_p18_response(self, response):
         """
         Validate P18 protocol response format and length
@@ -409,6 +635,150 @@ class P18InverterMonitor:
             })
             return None
         
+    def parse_status_tree(self, response):
+        """Parse GS command response into the documented nested status structure
+
+        Raises:
+            ValueError: If the response is malformed or incomplete
+        """
+        # Parse the raw GS command response
+        # Format: ^D106AAAA,BBB,CCCC,DDD,EEEE,FFFF,GGG,HHH,III,JJJ,KKK,LLL,MMM,NNN,OOO,PPP,QQQQ,RRRR,SSSS,TTTT,U,V,W,X,Y,Z,a,b<CRC><cr>
+
+        # Extract the data part from the response
+        match = re.search(r'\^D\d{3}(.+?)(?:<|$)', response)
+        if not match:
+            raise ValueError('Invalid response format')
+
+        # Split the data by commas
+        data_parts = match.group(1).split(',')
+        if len(data_parts) < 27:  # We expect at least 27 fields based on the documentation
+            raise ValueError(f'Incomplete response data. Got {len(data_parts)} fields, expected at least 27')
+
+        # Parse the values according to the documentation
+        # Grid values (AAAA, BBB)
+        grid_voltage = float(data_parts[0]) / 10 if data_parts[0].isdigit() else 0.0  # AAAA: Grid voltage
+        grid_frequency = float(data_parts[1]) / 10 if data_parts[1].isdigit() else 0.0  # BBB: Grid frequency
+
+        # AC output values (CCCC, DDD, EEEE, FFFF, GGG)
+        ac_out_voltage = float(data_parts[2]) / 10 if data_parts[2].isdigit() else 0.0  # CCCC: AC output voltage
+        ac_out_frequency = float(data_parts[3]) / 10 if data_parts[3].isdigit() else 0.0  # DDD: AC output frequency
+        ac_out_apparent_power = int(data_parts[4]) if data_parts[4].isdigit() else 0  # EEEE: AC output apparent power
+        ac_out_active_power = int(data_parts[5]) if data_parts[5].isdigit() else 0  # FFFF: AC output active power
+        output_load_percent = int(data_parts[6]) if data_parts[6].isdigit() else 0  # GGG: Output load percent
+
+        # Battery values (HHH, III, JJJ, KKK, LLL, MMM)
+        battery_voltage = float(data_parts[7]) / 10 if data_parts[7].isdigit() else 0.0  # HHH: Battery voltage
+        battery_voltage_scc1 = float(data_parts[8]) / 10 if data_parts[8].isdigit() else 0.0  # III: Battery voltage from SCC1
+        battery_voltage_scc2 = float(data_parts[9]) / 10 if data_parts[9].isdigit() else 0.0  # JJJ: Battery voltage from SCC2
+        battery_discharge_current = int(data_parts[10]) if data_parts[10].isdigit() else 0  # KKK: Battery discharge current
+        battery_charging_current = int(data_parts[11]) if data_parts[11].isdigit() else 0  # LLL: Battery charging current
+        battery_capacity = int(data_parts[12]) if data_parts[12].isdigit() else 0  # MMM: Battery capacity
+
+        # Temperature values (NNN, OOO, PPP)
+        inverter_heatsink_temp = int(data_parts[13]) if data_parts[13].isdigit() else 0  # NNN: Inverter heat sink temperature
+        mppt1_temperature = int(data_parts[14]) if data_parts[14].isdigit() else 0  # OOO: MPPT1 charger temperature
+        mppt2_temperature = int(data_parts[15]) if data_parts[15].isdigit() else 0  # PPP: MPPT2 charger temperature
+
+        # PV values (QQQQ, RRRR, SSSS, TTTT)
+        pv1_power = int(data_parts[16]) if data_parts[16].isdigit() else 0  # QQQQ: PV1 Input power
+        pv2_power = int(data_parts[17]) if data_parts[17].isdigit() else 0  # RRRR: PV2 Input power
+        pv1_voltage = float(data_parts[18]) / 10 if data_parts[18].isdigit() else 0.0  # SSSS: PV1 Input voltage
+        pv2_voltage = float(data_parts[19]) / 10 if data_parts[19].isdigit() else 0.0  # TTTT: PV2 Input voltage
+
+        # Status values (U, V, W, X, Y, Z, a)
+        setting_changed = data_parts[20] == "1" if len(data_parts) > 20 else False  # U: Setting value configuration state
+
+        # MPPT charger status
+        mppt1_status = "normal"
+        if len(data_parts) > 21:
+            if data_parts[21] == "0":
+                mppt1_status = "abnormal"
+            elif data_parts[21] == "1":
+                mppt1_status = "normal"
+            elif data_parts[21] == "2":
+                mppt1_status = "charging"
+
+        mppt2_status = "normal"
+        if len(data_parts) > 22:
+            if data_parts[22] == "0":
+                mppt2_status = "abnormal"
+            elif data_parts[22] == "1":
+                mppt2_status = "normal"
+            elif data_parts[22] == "2":
+                mppt2_status = "charging"
+
+        # Load connection status
+        load_connected = False
+        if len(data_parts) > 23:
+            load_connected = data_parts[23] == "1"
+
+        # Battery power direction
+        battery_direction = "donothing"
+        if len(data_parts) > 24:
+            if data_parts[24] == "1":
+                battery_direction = "charge"
+            elif data_parts[24] == "2":
+                battery_direction = "discharge"
+
+        # DC/AC power direction
+        dc_ac_direction = "donothing"
+        if len(data_parts) > 25:
+            if data_parts[25] == "1":
+                dc_ac_direction = "AC-DC"
+            elif data_parts[25] == "2":
+                dc_ac_direction = "DC-AC"
+
+        # Line power direction
+        line_direction = "donothing"
+        if len(data_parts) > 26:
+            if data_parts[26] == "1":
+                line_direction = "input"
+            elif data_parts[26] == "2":
+                line_direction = "output"
+
+        # Format the response exactly as specified in the documentation
+        return {
+            "grid": {
+                "voltage": grid_voltage,
+                "frequency": grid_frequency
+            },
+            "output": {
+                "voltage": ac_out_voltage,
+                "frequency": ac_out_frequency,
+                "apparent_power": ac_out_apparent_power,
+                "active_power": ac_out_active_power,
+                "load_percent": output_load_percent
+            },
+            "battery": {
+                "voltage": battery_voltage,
+                "voltage_scc1": battery_voltage_scc1,
+                "voltage_scc2": battery_voltage_scc2,
+                "discharge_current": battery_discharge_current,
+                "charging_current": battery_charging_current,
+                "capacity_percent": battery_capacity
+            },
+            "temperature": {
+                "heatsink": inverter_heatsink_temp,
+                "mppt1": mppt1_temperature,
+                "mppt2": mppt2_temperature
+            },
+            "pv": {
+                "pv1_power": pv1_power,
+                "pv2_power": pv2_power,
+                "pv1_voltage": pv1_voltage,
+                "pv2_voltage": pv2_voltage
+            },
+            "status": {
+                "configuration_changed": setting_changed,
+                "mppt1_status": mppt1_status,
+                "mppt2_status": mppt2_status,
+                "load_connected": load_connected,
+                "battery_direction": battery_direction,
+                "dc_ac_direction": dc_ac_direction,
+                "line_direction": line_direction
+            }
+        }
+
     def parse_mode_response(self, response):
         """Parse MOD command response to extract working mode"""
         try:
@@ -902,47 +1272,19 @@ class P18InverterMonitor:
             # The set time command needs special handling because it starts with S not P
             cmd = f"^S018DAT{time_str}\r"
             
-            # Send directly without using send_p18_command since this is an S command not P command
-            if not self.ser or not self.ser.is_open:
-                if not self.connect():
-                    return {'error': 'Could not connect to inverter', 'timestamp': datetime.now().isoformat()}
+            # Send as a raw frame since this is an S command not P command
+            response, error = self.send_raw_frame(cmd)
             
-            with self.lock:
-                try:
-                    self.ser.reset_input_buffer()
-                    self.ser.reset_output_buffer()
-                    self.ser.write(cmd.encode('ascii'))
-                    self.ser.flush()
-                    
-                    # Read response
-                    response = ""
-                    while True:
-                        char = self.ser.read(1)
-                        if not char:
-                            break
-                        response += char.decode('ascii', errors='ignore')
-                        if response.endswith('\r'):
-                            break
-                        if len(response) > 100:
-                            break
-                    
-                    if response:
-                        if response.startswith('^1'):
-                            return {
-                                "status": "success",
-                                "datetime": dt.isoformat(),
-                                "timestamp": datetime.now().isoformat()
-                            }
-                        else:
-                            return {'error': f'Command refused: {response}', 'timestamp': datetime.now().isoformat()}
-                    return {'error': 'No response from inverter', 'timestamp': datetime.now().isoformat()}
-                except Exception as e:
-                    self.error_log.append({
-                        'time': datetime.now().isoformat(),
-                        'code': 'E-TIME',
-                        'error': f"Time setting error: {str(e)}"
-                    })
-                    return {'error': str(e), 'timestamp': datetime.now().isoformat()}
+            if response:
+                if response.startswith('^1'):
+                    return {
+                        "status": "success",
+                        "datetime": dt.isoformat(),
+                        "timestamp": datetime.now().isoformat()
+                    }
+                else:
+                    return {'error': f'Command refused: {response}', 'timestamp': datetime.now().isoformat()}
+            return {'error': error or 'No response from inverter', 'timestamp': datetime.now().isoformat()}
         except Exception as e:
             self.error_log.append({
                 'time': datetime.now().isoformat(),
@@ -1030,6 +1372,147 @@ class P18InverterMonitor:
             })
             return None
         
+    def parse_payload_fields(self, response, minimum):
+        """Split the payload of a ^D reply into its fields
+
+        The length field is used to find the end of the payload, so CRC bytes
+        never end up in the last field.
+
+        Raises:
+            ValueError: If the reply is malformed or has fewer than minimum fields
+        """
+        match = re.match(r'\^D(\d{3})', response or '')
+        if not match:
+            raise ValueError('Invalid response format')
+        # The length covers the payload, the 2 CRC bytes and the CR
+        payload = response[5:5 + int(match.group(1)) - 3]
+        fields = payload.split(',')
+        if len(fields) < minimum:
+            raise ValueError(f'Incomplete response data. Got {len(fields)} fields, expected at least {minimum}')
+        return fields
+
+    def parse_fault_status(self, response):
+        """Parse FWS response into the fault code, its description and the warning flags
+
+        Format: ^D034AA,B,C,D,E,F,G,H,I,J,K,L,M,N,O,P,Q<CRC><cr>
+
+        Raises:
+            ValueError: If the response is malformed or incomplete
+        """
+        data_parts = self.parse_payload_fields(response, 17)
+
+        # Extract fault code from the first field (AA)
+        fault_code = int(data_parts[0]) if data_parts[0].isdigit() else 0
+
+        # B through Q represent different fault conditions
+        flags = ('line_fail', 'output_short', 'over_temperature', 'fan_locked', 'battery_voltage_high',
+                 'battery_low', 'battery_under', 'overload', 'eeprom_fail', 'power_limit',
+                 'pv1_voltage_high', 'pv2_voltage_high', 'mppt1_overload', 'mppt2_overload',
+                 'battery_low_scc1', 'battery_low_scc2')
+        fault_status = {name: data_parts[index + 1] == "1" for index, name in enumerate(flags)}
+
+        status = {
+            "fault_code": fault_code,
+            "faults": fault_status
+        }
+        if fault_code > 0:
+            status["error"] = {
+                "code": str(fault_code),
+                "description": self.fault_codes.get(str(fault_code), "Unknown error")
+            }
+        return status
+
+    def parse_energy(self, response):
+        """Parse an energy reply (ET, EY, EM, ED) into watt-hours
+
+        Raises:
+            ValueError: If the response is malformed
+        """
+        return int(self.parse_payload_fields(response, 1)[0])
+
+    def parse_parallel_info(self, response):
+        """Parse PRI<n> response (rated information of one unit of a parallel system)
+
+        Format: ^D0xxA,BB,CCCCCCCCCCCCCCCCCCCC,D,EEE,FFF,G<CRC><cr>
+        A: unit present, BB: serial number length, C: serial number,
+        D: charger priority, EEE/FFF: max (AC) charging current, G: output mode
+
+        Raises:
+            ValueError: If the response is malformed or incomplete
+        """
+        fields = self.parse_payload_fields(response, 7)
+        serial_length = int(fields[1])
+        return {
+            "connected": fields[0] == '1',
+            "serial_number": fields[2][:serial_length],
+            "charger_priority": self.charger_priorities.get(fields[3], f"Unknown ({fields[3]})"),
+            "max_charging_current": int(fields[4]),
+            "max_ac_charging_current": int(fields[5]),
+            "output_mode": self.output_modes.get(fields[6], f"Unknown ({fields[6]})")
+        }
+
+    def parse_parallel_status(self, response):
+        """Parse PGS<n> response (general status of one unit of a parallel system)
+
+        Format: ^D1xxA,B,CC,DDDD,EEE,FFFF,GGG,HHHH,IIII,JJJJJ,KKKKK,LLL,MMM,NNN,OOO,PPP,QQQ,
+        MMM,RRRR,SSSS,TTTT,UUUU,V,W,X,Y,Z,a,bbb<CRC><cr>
+        Like GS, plus the unit presence, work mode, fault code and the totals of the
+        whole parallel system (apparent/active power, load, charging current).
+
+        Raises:
+            ValueError: If the response is malformed or incomplete
+        """
+        fields = self.parse_payload_fields(response, 28)
+        charger_status = {'0': 'abnormal', '1': 'normal', '2': 'charging'}
+        battery_directions = {'1': 'charge', '2': 'discharge'}
+        dc_ac_directions = {'1': 'AC-DC', '2': 'DC-AC'}
+        line_directions = {'1': 'input', '2': 'output'}
+        return {
+            "connected": fields[0] == '1',
+            "working_mode": self.working_modes.get(fields[1], 'Unknown'),
+            "fault_code": int(fields[2]),
+            "grid": {
+                "voltage": int(fields[3]) / 10,
+                "frequency": int(fields[4]) / 10
+            },
+            "output": {
+                "voltage": int(fields[5]) / 10,
+                "frequency": int(fields[6]) / 10,
+                "apparent_power": int(fields[7]),
+                "active_power": int(fields[8]),
+                "load_percent": int(fields[11])
+            },
+            "system": {
+                "apparent_power": int(fields[9]),
+                "active_power": int(fields[10]),
+                "load_percent": int(fields[12]),
+                "charging_current": int(fields[16])
+            },
+            "battery": {
+                "voltage": int(fields[13]) / 10,
+                "discharge_current": int(fields[14]),
+                "charging_current": int(fields[15]),
+                "capacity_percent": int(fields[17])
+            },
+            "pv": {
+                "pv1_power": int(fields[18]),
+                "pv2_power": int(fields[19]),
+                "pv1_voltage": int(fields[20]) / 10,
+                "pv2_voltage": int(fields[21]) / 10
+            },
+            "status": {
+                "mppt1_status": charger_status.get(fields[22], 'normal'),
+                "mppt2_status": charger_status.get(fields[23], 'normal'),
+                "load_connected": fields[24] == '1',
+                "battery_direction": battery_directions.get(fields[25], 'donothing'),
+                "dc_ac_direction": dc_ac_directions.get(fields[26], 'donothing'),
+                "line_direction": line_directions.get(fields[27], 'donothing')
+            },
+            "temperature": {
+                "max": int(fields[28]) if len(fields) > 28 and fields[28].isdigit() else None
+            }
+        }
+
     def get_status(self):
         """Get current inverter status"""
         # Get working mode
@@ -1046,7 +1529,7 @@ class P18InverterMonitor:
             status_data = self.parse_general_status(result)
             if status_data:
                 status_data['working_mode'] = working_mode
-                status_data['timestamp'] = datetime.now().isoformat()
+                status_data['timestamp'] = self.sample_time()
                 self.last_values.update(status_data)
                 return status_data
         return {'error': error or 'Unknown error', 'timestamp': datetime.now().isoformat()}
@@ -1055,6 +1538,7 @@ class P18InverterMonitor:
         """Get power generation data"""
         result, error = self.send_p18_command('GS')
         if result:
+            sampled = self.sample_time()
             # Parse the power data from response
             status_data = self.parse_general_status(result)
             if status_data:
@@ -1066,7 +1550,7 @@ class P18InverterMonitor:
                     'pv2_voltage': status_data.get('pv2_voltage', 0),
                     'daily_yield': 0,  # Need to calculate from historical data
                     'total_yield': 0,  # Need separate command for this
-                    'timestamp': datetime.now().isoformat()
+                    'timestamp': sampled
                 }
                 self.last_values.update(power_data)
                 return power_data
@@ -1111,7 +1595,7 @@ class P18InverterMonitor:
             data = self.parse_general_status(result)
             if data:
                 data['working_mode'] = working_mode
-                data['last_update'] = datetime.now().isoformat()
+                data['last_update'] = self.sample_time()
                 with self.lock:
                     self.last_values.update(data)
                 return True
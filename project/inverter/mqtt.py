@@ -0,0 +1,248 @@
+# inverter/mqtt.py
+""" MQTT publisher fed by the acquisition snapshots
+
+Every snapshot the acquisition engine publishes becomes one batch of MQTT
+messages: one message per field (topic <base>/<field/path>) or a single
+packed JSON message (topic <base>/state). With change_only only the fields
+that changed are sent, except right after (re)connecting, when the batches
+queued while offline are delivered in order and then the full state is sent
+once so retained topics are complete.
+
+The snapshot listener only queues the batch, so the serial loop never waits
+for the network. A worker thread sends the batches while connected; while
+offline they wait in a bounded queue (oldest dropped first) and paho keeps
+reconnecting in its own network thread.
+
+Needs paho-mqtt (pip install paho-mqtt).
+"""
+import threading
+from collections import deque
+from datetime import datetime
+
+from .utils import serialization
+
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:  # paho-mqtt is optional
+    mqtt = None
+
+MODES = ('fields', 'packed')
+
+
+class MqttPublisher:
+    """Publish acquisition snapshots to an MQTT broker
+
+    Args:
+        host (str): Broker host name
+        port (int): Broker port
+        base_topic (str): Prefix of every topic
+        mode (str): 'fields' for one topic per field, 'packed' for one JSON message
+        qos (int): MQTT quality of service (0, 1 or 2)
+        retain (bool): Publish with the retain flag (last value kept by the broker)
+        change_only (bool): Send only the fields that changed in each snapshot
+        queue_size (int): Batches kept while the broker is unreachable
+    """
+
+    def __init__(self, host, port=1883, base_topic='p18', mode='fields', qos=0, retain=True,
+                 change_only=True, queue_size=1000, client_id=None, username=None, password=None,
+                 keepalive=60):
+        if mqtt is None:
+            raise RuntimeError("MQTT publishing needs paho-mqtt (pip install paho-mqtt)")
+        if mode not in MODES:
+            raise ValueError(f"Invalid MQTT mode '{mode}', use one of {', '.join(MODES)}")
+        if qos not in (0, 1, 2):
+            raise ValueError(f"Invalid MQTT QoS {qos}")
+        self.host = host
+        self.port = port
+        self.base_topic = base_topic.rstrip('/')
+        self.mode = mode
+        self.qos = qos
+        self.retain = retain
+        self.change_only = change_only
+        self.keepalive = keepalive
+        self.queue = deque(maxlen=queue_size)
+        self.published = 0
+        self.batches = 0
+        self.dropped = 0
+        self.connects = 0
+        self.last_connect = None
+        self.last_error = None
+        self.engine = None
+        self._full_pending = True
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        if hasattr(mqtt, 'CallbackAPIVersion'):  # paho-mqtt 2.x
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id or '')
+        else:
+            self.client = mqtt.Client(client_id=client_id or '')
+        if username:
+            self.client.username_pw_set(username, password)
+        self.client.will_set(self.status_topic, 'offline', qos=1, retain=True)
+        self.client.reconnect_delay_set(min_delay=1, max_delay=60)
+        # paho's own queue only holds what is in flight; the backlog lives in self.queue
+        self.client.max_queued_messages_set(1000)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+
+    @property
+    def status_topic(self):
+        return f"{self.base_topic}/status"
+
+    def topic_for(self, field):
+        """Return the topic of a dotted field name: battery.voltage -> p18/battery/voltage"""
+        return f"{self.base_topic}/{field.replace('.', '/')}"
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+    def attach(self, engine):
+        """Publish every snapshot engine publishes"""
+        self.engine = engine
+        engine.add_listener(self.on_snapshot)
+        return self
+
+    def start(self):
+        """Connect in the background and start sending queued batches"""
+        self._stop_event.clear()
+        # connect_async returns at once; paho connects (and reconnects) in loop_start's thread
+        self.client.connect_async(self.host, self.port, self.keepalive)
+        self.client.loop_start()
+        self._thread = threading.Thread(target=self._run, name='p18-mqtt', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Announce going offline, stop the worker and disconnect"""
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
+        if self.engine is not None:
+            self.engine.remove_listener(self.on_snapshot)
+        if self.client.is_connected():
+            self.client.publish(self.status_topic, 'offline', qos=1, retain=True)
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def _on_connect(self, client, userdata, flags, *args):
+        self.connects += 1
+        self.last_connect = datetime.now().isoformat()
+        client.publish(self.status_topic, 'online', qos=1, retain=True)
+        # Retained topics may be stale or missing: resend the full state once
+        self._full_pending = True
+        self._wakeup.set()
+
+    def _on_disconnect(self, client, userdata, *args):
+        self.last_error = f"Disconnected from {self.host}:{self.port}"
+
+    # ------------------------------------------------------------------
+    # Publishing
+    # ------------------------------------------------------------------
+    def build_batch(self, snapshot, full=False):
+        """Return the (topic, payload) messages of one snapshot"""
+        flat = snapshot['flat']
+        if self.change_only and not full:
+            flat = {name: flat[name] for name in snapshot['changed'] if name in flat}
+        if not flat:
+            return []
+        if self.mode == 'packed':
+            payload = {"seq": snapshot['seq'], "timestamp": snapshot['timestamp'], "fields": flat}
+            return [(f"{self.base_topic}/state", serialization.dumps(payload))]
+        messages = [(self.topic_for(name), self._encode(value)) for name, value in sorted(flat.items())]
+        messages.append((f"{self.base_topic}/timestamp", snapshot['timestamp']))
+        return messages
+
+    def _encode(self, value):
+        if isinstance(value, str):
+            return value
+        return serialization.dumps(value)
+
+    def on_snapshot(self, snapshot):
+        """Queue the messages of a snapshot (runs in the acquisition thread, never blocks)"""
+        if snapshot.get('stale'):
+            return
+        batch = self.build_batch(snapshot)
+        if not batch:
+            return
+        with self._lock:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append(batch)
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._wakeup.wait(1)
+            self._wakeup.clear()
+            if not self.client.is_connected():
+                continue
+            # The backlog goes out first, in order, so subscribers see every
+            # change; the full state then completes the retained topics
+            if not self._drain() or not self._full_pending:
+                continue
+            self._full_pending = False
+            latest = self.engine.latest() if self.engine is not None else None
+            if latest and not latest.get('stale'):
+                with self._lock:
+                    self.queue.appendleft(self.build_batch(latest, full=True))
+                self._drain()
+
+    def _drain(self):
+        """Send queued batches until the queue is empty (True) or publishing fails (False)"""
+        while not self._stop_event.is_set():
+            with self._lock:
+                if not self.queue:
+                    return True
+                batch = self.queue.popleft()
+            for index, (topic, payload) in enumerate(batch):
+                info = self.client.publish(topic, payload, qos=self.qos, retain=self.retain)
+                if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                    # Connection lost mid-batch: keep the rest for after the reconnect
+                    with self._lock:
+                        self.queue.appendleft(batch[index:])
+                    self.last_error = f"Publish failed ({mqtt.error_string(info.rc)})"
+                    return False
+                self.published += 1
+            self.batches += 1
+        return False
+
+    def status(self):
+        """Return the publisher state as a dict"""
+        return {
+            "broker": f"{self.host}:{self.port}",
+            "connected": self.client.is_connected(),
+            "mode": self.mode,
+            "qos": self.qos,
+            "change_only": self.change_only,
+            "queued_batches": len(self.queue),
+            "published": self.published,
+            "batches": self.batches,
+            "dropped_batches": self.dropped,
+            "connects": self.connects,
+            "last_connect": self.last_connect,
+            "last_error": self.last_error
+        }
+
+
+def create_mqtt_publisher(engine, config):
+    """Build, attach and start an MqttPublisher from the application configuration, or return None"""
+    if not config['MQTT_HOST']:
+        return None
+    publisher = MqttPublisher(
+        config['MQTT_HOST'],
+        port=config['MQTT_PORT'],
+        base_topic=config['MQTT_TOPIC'],
+        mode=config['MQTT_MODE'],
+        qos=config['MQTT_QOS'],
+        retain=config['MQTT_RETAIN'],
+        change_only=config['MQTT_CHANGE_ONLY'],
+        queue_size=config['MQTT_QUEUE_SIZE'],
+        client_id=config['MQTT_CLIENT_ID'],
+        username=config['MQTT_USERNAME'],
+        password=config['MQTT_PASSWORD']
+    )
+    publisher.attach(engine).start()
+    return publisher
@@ -0,0 +1,162 @@
+# inverter/parallel.py
+""" Parallel-system acquisition: every unit polled in one batch, one group snapshot
+
+Parallel and 3-phase stacks answer PRI<n> (rated information) and PGS<n>
+(general status) for each unit ID. PRI only changes when the stack is rewired,
+so the units present and their phase are discovered with PRI now and then;
+every cycle sends PGS for the present units back to back, in one batch, and
+publishes the group as a single snapshot with per-phase and overall totals.
+"""
+import time
+from datetime import datetime
+
+from .acquisition import AcquisitionEngine
+
+# Output modes (PRI field G) of the units of a 3-phase system
+PHASES = {'Phase 1 of 3': 'L1', 'Phase 2 of 3': 'L2', 'Phase 3 of 3': 'L3'}
+
+
+def phase_of(info):
+    """Return the phase a unit feeds: L1-L3 in 3-phase systems, L1 otherwise"""
+    return PHASES.get(info.get('output_mode'), 'L1')
+
+
+def aggregate(units):
+    """Sum the power and currents of units, averaging voltages, frequency and load"""
+    count = len(units)
+    total = {
+        "units": count,
+        "active_power": sum(u['output']['active_power'] for u in units),
+        "apparent_power": sum(u['output']['apparent_power'] for u in units),
+        "pv_power": sum(u['pv']['pv1_power'] + u['pv']['pv2_power'] for u in units),
+        "battery_charging_current": sum(u['battery']['charging_current'] for u in units),
+        "battery_discharge_current": sum(u['battery']['discharge_current'] for u in units),
+        "faults": sum(1 for u in units if u['working_mode'] == 'Fault')
+    }
+    if count:
+        total.update({
+            "output_voltage": round(sum(u['output']['voltage'] for u in units) / count, 1),
+            "output_frequency": round(sum(u['output']['frequency'] for u in units) / count, 1),
+            "load_percent": round(sum(u['output']['load_percent'] for u in units) / count, 1)
+        })
+    return total
+
+
+class ParallelGroupPoller(AcquisitionEngine):
+    """Poll all units of a parallel system and publish aggregated group snapshots
+
+    Args:
+        monitor: P18InverterMonitor connected to the parallel system
+        unit_ids: IDs to look for (PRI0..PRI8 on a full 9-unit stack)
+        interval (float): Seconds between PGS batches
+        discovery_interval (float): Seconds between PRI scans for added or removed units
+    """
+
+    thread_name = 'p18-parallel'
+
+    def __init__(self, monitor, unit_ids=range(9), interval=10, history_size=360, heartbeat=300,
+                 discovery_interval=300):
+        super().__init__(monitor, interval=interval, history_size=history_size, heartbeat=heartbeat)
+        self.unit_ids = list(unit_ids)
+        self.discovery_interval = discovery_interval
+        # unit ID -> parsed PRI reply of the units present
+        self.units = {}
+        self.last_discovery = None
+        self.batch_time = None
+        self._discovered_at = None
+
+    def discover(self):
+        """Send PRI to every unit ID and remember the units that are present"""
+        units = {}
+        for unit_id in self.unit_ids:
+            result, error = self.monitor.send_p18_command(f"PRI{unit_id}", fresh=True)
+            if not result:
+                if unit_id == self.unit_ids[0]:
+                    # Not a parallel system (or PRI unsupported): no point trying the others
+                    self.last_error = error or 'No response to PRI'
+                    break
+                continue
+            try:
+                info = self.monitor.parse_parallel_info(result)
+            except ValueError as e:
+                self.last_error = f"Parallel info parse error: {str(e)}"
+                continue
+            if info['connected']:
+                units[unit_id] = info
+        self.units = units
+        self._discovered_at = time.monotonic()
+        self.last_discovery = datetime.now().isoformat()
+        return units
+
+    def poll_once(self):
+        """Send PGS to every present unit in one batch and publish the group snapshot
+
+        Returns:
+            dict or None: The published snapshot, None if no unit answered
+        """
+        if self._discovered_at is None or time.monotonic() - self._discovered_at >= self.discovery_interval:
+            self.discover()
+        if not self.units:
+            return None
+
+        started = time.monotonic()
+        statuses = {}
+        errors = []
+        for unit_id in list(self.units):
+            result, error = self.monitor.send_p18_command(f"PGS{unit_id}", fresh=True)
+            if not result:
+                errors.append(f"PGS{unit_id}: {error or 'no response'}")
+                continue
+            try:
+                status = self.monitor.parse_parallel_status(result)
+            except ValueError as e:
+                errors.append(f"PGS{unit_id}: {str(e)}")
+                continue
+            if not status['connected']:
+                # The unit left the stack; the next discovery may find it again
+                self.units.pop(unit_id, None)
+                continue
+            info = self.units[unit_id]
+            status.update(serial_number=info['serial_number'], output_mode=info['output_mode'],
+                          phase=phase_of(info))
+            statuses[unit_id] = status
+        self.batch_time = round(time.monotonic() - started, 3)
+        self.last_error = '; '.join(errors) or None
+        if not statuses:
+            return None
+
+        phases = {}
+        for status in statuses.values():
+            phases.setdefault(status['phase'], []).append(status)
+        data = {
+            "units": {str(unit_id): status for unit_id, status in sorted(statuses.items())},
+            "phases": {phase: aggregate(members) for phase, members in sorted(phases.items())},
+            "total": aggregate(list(statuses.values()))
+        }
+        self.samples += 1
+        self.last_sample_time = datetime.now().isoformat()
+        return self.publish(data)
+
+    def stats(self):
+        """Return poller counters, including the units found and the last batch duration"""
+        stats = super().stats()
+        stats.update({
+            "units": sorted(self.units),
+            "last_discovery": self.last_discovery,
+            "batch_time": self.batch_time
+        })
+        return stats
+
+
+def create_parallel_poller(monitor, config):
+    """Build a ParallelGroupPoller from the application configuration, or return None"""
+    if not config['PARALLEL_ENABLED']:
+        return None
+    return ParallelGroupPoller(
+        monitor,
+        unit_ids=range(config['PARALLEL_UNITS']),
+        interval=config['PARALLEL_INTERVAL'],
+        history_size=config['ACQUISITION_HISTORY_SIZE'],
+        heartbeat=config['ACQUISITION_HEARTBEAT'],
+        discovery_interval=config['PARALLEL_DISCOVERY_INTERVAL']
+    )
@@ -0,0 +1,558 @@
+# inverter/retention.py
+""" Tiered retention, downsampling and compaction of the telemetry store
+
+A store kept at full resolution grows without bound, so history is kept
+in tiers, e.g. RETENTION_TIERS='raw=7d,1m=90d,1h=5y': raw samples for 7
+days, 1-minute rollups for 90 days and hourly rollups for 5 years. Each
+rollup tier is a TelemetryStore of its own in a subdirectory named after
+it (telemetry/1m, telemetry/1h), so it is read with the same scan() and
+columns() and exported the same way.
+
+A rollup row stands for one bucket (timestamp = start of the bucket) and
+has, per numeric field, the columns field@min, field@max, field@sum and
+field@count (booleans count as 0/1, so sum/count is the share of the time
+they were on), and field@last for the other fields. The fields listed in
+SKETCH_FIELDS also get field@sketch, a t-digest of the bucket's values
+(see sketch.py), so percentiles over any range are answered by merging the
+sketches of its buckets (distribution()). A tier is built from
+the one before it, one finished day at a time; aggregates of rollups are
+the aggregates of the underlying samples, so the hourly tier outlives the
+raw data it summarizes.
+
+A Compactor thread wakes up every interval seconds and works through the
+pending steps, oldest first, until its budget of seconds per cycle is
+spent: merge the small blocks of a finished day, roll a finished day up
+into the next tier, or delete a day past its tier's retention (only once
+a later tier has it). Every step touches one day file, and a merge is
+done in slices of blocks that stop at the budget and resume next cycle,
+so a cycle never holds the disk for long and what is left carries over.
+Files are replaced by rename, so queries running meanwhile read either
+the old or the new file. With every tier bounded the disk usage is the
+bytes per day of each tier times its retention, which status() projects
+from the days stored so far.
+"""
+import operator
+import os
+import threading
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+
+from . import columnar
+from .sketch import DEFAULT_COMPRESSION, TDigest
+from .store import LEGACY_SUFFIX, TelemetryStore, parse_time, to_micros
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, aggregation falls back to pure Python
+    np = None
+
+DEFAULT_TIERS = 'raw=7d,1m=90d,1h=5y'
+UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400, 'y': 365 * 86400}
+DAY = 86400
+STATS = ('min', 'max', 'sum', 'count')
+
+_COMBINE = {
+    'min': min,
+    'max': max,
+    'sum': operator.add,
+    'count': operator.add,
+    'last': lambda current, value: value,
+}
+_NP_REDUCERS = {'min': 'minimum', 'max': 'maximum', 'sum': 'add', 'count': 'add'}
+
+
+def parse_duration(text):
+    """Parse '90d', '5y', '1m'... into seconds; 'forever' (or empty) means None"""
+    text = text.strip().lower()
+    if text in ('', 'forever'):
+        return None
+    if text[-1:] not in UNITS or not text[:-1].isdigit():
+        raise ValueError(f"Invalid duration {text!r}, use a number with one of {', '.join(UNITS)}")
+    return int(text[:-1]) * UNITS[text[-1]]
+
+
+def parse_tiers(text):
+    """Parse 'raw=7d,1m=90d,1h=5y' into [(name, bucket seconds, kept days)]
+
+    The first tier is raw (bucket None); each rollup bucket is a multiple of
+    the previous one and divides a day. Kept days are None for 'forever'.
+    """
+    tiers = []
+    for item in (text or 'raw=forever').split(','):
+        name, _, keep = item.strip().partition('=')
+        keep = parse_duration(keep)
+        keep_days = None if keep is None else max(1, -(-keep // DAY))
+        if not tiers:
+            if name != 'raw':
+                raise ValueError("The first retention tier must be raw")
+            tiers.append((name, None, keep_days))
+            continue
+        width = parse_duration(name)
+        previous = tiers[-1][1]
+        if width is None or DAY % width or (previous and width % previous) or width == previous:
+            raise ValueError(f"Invalid rollup tier {name!r}: it must divide a day and "
+                             f"be a multiple of the previous tier")
+        tiers.append((name, width, keep_days))
+    return tiers
+
+
+def rollup_fields(fields):
+    """Expand field names into the rollup columns of their numeric summary
+
+    Names that already name a column (battery.voltage@max) are kept as they are.
+    """
+    columns = []
+    for name in fields:
+        columns.extend([name] if '@' in name else [f"{name}@{stat}" for stat in STATS])
+    return columns
+
+
+# ----------------------------------------------------------------------
+# Aggregation
+# ----------------------------------------------------------------------
+def _is_number(value):
+    return isinstance(value, (int, float))
+
+
+def _sources(name, values, raw, sketch_fields=()):
+    """Return (field, {stat: values}) of one column of a block"""
+    if not raw:
+        field, _, stat = name.rpartition('@')
+        return field, {stat: values}
+    if np is not None and isinstance(values, np.ndarray):
+        if values.dtype == bool:
+            values = values.astype(np.int64)
+        sources = {'min': values, 'max': values, 'sum': values, 'count': np.ones(len(values), np.int64)}
+    else:
+        present = next((value for value in values if value is not None), None)
+        if not _is_number(present):
+            return name, {'last': values}
+        values = [int(value) if isinstance(value, bool) else value if _is_number(value) else None
+                  for value in values]
+        sources = {'min': values, 'max': values, 'sum': values,
+                   'count': [None if value is None else 1 for value in values]}
+    if name in sketch_fields:
+        sources['sketch'] = values
+    return name, sources
+
+
+def _as_list(values, count):
+    """Return a column as a list (None for every row when it is missing)"""
+    if values is None:
+        return [None] * count
+    return values if isinstance(values, list) else values.tolist()
+
+
+def _sketch(target, buckets, values, raw, compression):
+    """Add raw values (or merge stored sketches) into the digests of their buckets"""
+    if not isinstance(buckets, list):
+        buckets = buckets.tolist()
+    if not isinstance(values, list):
+        values = values.tolist()
+    for bucket, value in zip(buckets, values):
+        if value is None:
+            continue
+        digest = target.get(bucket)
+        if digest is None:
+            digest = target[bucket] = TDigest(compression)
+        if raw:
+            digest.add(value)
+        else:
+            digest.merge(TDigest.from_list(value, compression))
+
+
+def _group(buckets, values, stat):
+    """Return (bucket, stat of its values) pairs over values grouped by bucket"""
+    if np is not None and isinstance(values, np.ndarray) and isinstance(buckets, np.ndarray) \
+            and stat in _NP_REDUCERS:
+        # Timestamps are sorted, so each bucket is one run of the block
+        starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+        reduced = getattr(np, _NP_REDUCERS[stat]).reduceat(values, starts)
+        return zip(buckets[starts].tolist(), reduced.tolist())
+    if np is not None and not isinstance(values, list):
+        values = values.tolist()
+    if not isinstance(buckets, list):
+        buckets = buckets.tolist()
+    combine = _COMBINE[stat]
+    result = {}
+    for bucket, value in zip(buckets, values):
+        if value is None:
+            continue
+        current = result.get(bucket)
+        result[bucket] = value if current is None else combine(current, value)
+    return result.items()
+
+
+def aggregate(blocks, start_us, width_us, raw=True, sketch_fields=(), compression=DEFAULT_COMPRESSION):
+    """Aggregate (timestamps, columns) blocks into buckets of width_us from start_us
+
+    blocks are raw samples (raw=True) or rollup rows. The raw fields in
+    sketch_fields (and the field@sketch columns of rollups) are summarized
+    by t-digests. Returns (bucket start timestamps, {column: values}) ready
+    for columnar.encode_block.
+    """
+    totals = {}  # column -> {bucket index: value}
+    for timestamps, columns in blocks:
+        if not len(timestamps):
+            continue
+        if np is not None and isinstance(timestamps, np.ndarray):
+            buckets = (timestamps - start_us) // width_us
+        else:
+            buckets = [(timestamp - start_us) // width_us for timestamp in timestamps]
+        for name, values in columns.items():
+            field, sources = _sources(name, values, raw, sketch_fields)
+            for stat, source in sources.items():
+                target = totals.setdefault(f"{field}@{stat}", {})
+                if stat == 'sketch':
+                    _sketch(target, buckets, source, raw, compression)
+                    continue
+                combine = _COMBINE[stat]
+                for bucket, value in _group(buckets, source, stat):
+                    current = target.get(bucket)
+                    target[bucket] = value if current is None else combine(current, value)
+    for name, values in totals.items():
+        if name.endswith('@sum'):
+            # Round off the float noise of long sums, which would defeat the fixed-point encoding
+            for index, value in values.items():
+                if isinstance(value, float):
+                    values[index] = round(value, columnar.MAX_DECIMALS)
+        elif name.endswith('@sketch'):
+            for index, digest in values.items():
+                values[index] = digest.to_list(columnar.MAX_DECIMALS)
+    indices = sorted(set().union(*totals.values())) if totals else []
+    timestamps = [start_us + index * width_us for index in indices]
+    return timestamps, {name: [values.get(index) for index in indices] for name, values in sorted(totals.items())}
+
+
+# ----------------------------------------------------------------------
+# Compaction
+# ----------------------------------------------------------------------
+class Compactor:
+    """Apply tiered retention to a telemetry store in steps of bounded work
+
+    Args:
+        store (TelemetryStore): The raw tier
+        tiers (list): (name, bucket seconds, kept days) as from parse_tiers
+        interval (float): Seconds between compaction cycles
+        budget (float): Seconds of work per cycle, after which the rest waits
+        sketch_fields (list): Fields whose rollups carry a t-digest
+        compression (int): Compression of the t-digests
+    """
+
+    def __init__(self, store, tiers, interval=300, budget=2.0, sketch_fields=(), compression=DEFAULT_COMPRESSION):
+        self.store = store
+        self.tiers = tiers
+        self.interval = interval
+        self.budget = budget
+        self.sketch_fields = list(sketch_fields)
+        self.compression = compression
+        self.stores = [store] + [TelemetryStore(os.path.join(store.directory, name), store.block_samples,
+                                                store.writer) for name, _, _ in tiers[1:]]
+        self.cycles = 0
+        self.steps = {'rollup': 0, 'merge': 0, 'expire': 0}
+        self.bytes_reclaimed = 0
+        self.backlog = False
+        self.last_cycle = None
+        self.last_cycle_seconds = None
+        self.last_error = None
+        self._checked = set()  # (tier, day) whose blocks are known to be merged
+        self._tier_status = None  # (monotonic, tiers, projected bytes) of the last measurement
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def tier(self, name):
+        """Return the TelemetryStore of the tier called name (KeyError if there is none)"""
+        for (tier_name, _, _), store in zip(self.tiers, self.stores):
+            if tier_name == name:
+                return store
+        raise KeyError(name)
+
+    def start(self):
+        """Start the compaction thread"""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='p18-compact', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the compaction thread (a running step is finished first)"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(30)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.run_cycle()
+
+    # ------------------------------------------------------------------
+    # Steps
+    # ------------------------------------------------------------------
+    def pending_steps(self, today=None):
+        """Yield (kind, tier index, day) of the work to do, in the order it is done"""
+        today = today or date.today()
+        days = [set(store.days()) for store in self.stores]
+        # A day is safe to delete from a tier once any later tier has it
+        later = [set().union(*days[index + 1:]) for index in range(len(days))]
+        # Merged days decode much faster, then roll them up before anything is deleted
+        for index, store in enumerate(self.stores):
+            for day in sorted(days[index]):
+                if day < today and (index, day) not in self._checked:
+                    yield 'merge', index, day
+        for index in range(1, len(self.stores)):
+            for day in sorted(days[index - 1] - days[index] - later[index]):
+                if day < today:
+                    yield 'rollup', index, day
+        for index, (_, _, keep_days) in enumerate(self.tiers):
+            if keep_days is None:
+                continue
+            cutoff = today - timedelta(days=keep_days)
+            for day in sorted(days[index]):
+                if day >= cutoff:
+                    break
+                if index + 1 < len(self.stores) and day not in later[index]:
+                    continue  # not rolled up yet
+                yield 'expire', index, day
+
+    def run_cycle(self, today=None):
+        """Do pending steps until the budget is spent; return the number done"""
+        started = time.monotonic()
+        # Samples of a day that just ended may still be buffered
+        self.store.flush()
+        deadline = started + self.budget
+        done = 0
+        self.backlog = False
+        for kind, index, day in self.pending_steps(today):
+            if done and time.monotonic() >= deadline:
+                self.backlog = True
+                break
+            if self._stop_event.is_set():
+                break
+            try:
+                finished = getattr(self, f"_{kind}")(index, day, deadline)
+            except (OSError, columnar.BlockError) as e:
+                self.last_error = f"{kind.capitalize()} of {self.tiers[index][0]} {day} failed: {e}"
+                self._checked.add((index, day))
+                finished = True
+            done += 1
+            if not finished:
+                # Out of budget in the middle of a merge: it resumes next cycle
+                self.backlog = True
+                break
+            self.steps[kind] += 1
+        self.cycles += 1
+        self.last_cycle = datetime.now().isoformat()
+        self.last_cycle_seconds = round(time.monotonic() - started, 3)
+        self._tier_status = None
+        return done
+
+    def _rollup(self, index, day, deadline=None):
+        source, target = self.stores[index - 1], self.stores[index]
+        width_us = self.tiers[index][1] * 1000000
+        start = datetime.combine(day, dt_time.min)
+        end = start + timedelta(days=1)
+        if index == 1 and os.path.exists(source._path(day, LEGACY_SUFFIX)):
+            blocks = self._legacy_blocks(source, start, end)
+        else:
+            blocks = source.columns(start, end)
+        timestamps, columns = aggregate(blocks, to_micros(start), width_us, raw=index == 1,
+                                        sketch_fields=self.sketch_fields, compression=self.compression)
+        data = b''.join(columnar.encode_block(timestamps[offset:offset + target.block_samples],
+                                              {name: values[offset:offset + target.block_samples]
+                                               for name, values in columns.items()})
+                        for offset in range(0, len(timestamps), target.block_samples))
+        # An empty day still gets its (empty) file, so it counts as rolled up
+        target.writer.replace(target._path(day), data, 'telemetry')
+        target.writer.commit()
+        self._checked.add((index, day))
+        return True
+
+    def _legacy_blocks(self, source, start, end, size=4096):
+        """Yield the samples of an NDJSON day as (timestamps, columns) blocks"""
+        rows = []
+        for row in source.scan(start, end):
+            rows.append(row)
+            if len(rows) >= size:
+                yield self._as_block(rows)
+                rows = []
+        if rows:
+            yield self._as_block(rows)
+
+    @staticmethod
+    def _as_block(rows):
+        names = {}
+        for _, values in rows:
+            names.update(dict.fromkeys(values))
+        return ([to_micros(timestamp) for timestamp, _ in rows],
+                {name: [values.get(name) for _, values in rows] for name in names})
+
+    def _merge(self, index, day, deadline=None):
+        if self.stores[index].merge_day(day, deadline) is None:
+            return False
+        self._checked.add((index, day))
+        return True
+
+    def _expire(self, index, day, deadline=None):
+        self.bytes_reclaimed += self.stores[index].delete_day(day)
+        self._checked.discard((index, day))
+        return True
+
+    # ------------------------------------------------------------------
+    # Queries
+    # ------------------------------------------------------------------
+    def plan(self, start, end):
+        """Return (tier index, start, end) pieces covering [start, end) with the coarsest data
+
+        Whole buckets come from the coarsest tier holding their day, the
+        ragged edges from finer ones. Where no finer tier holds the day any
+        more, the edges are rounded out to the coarse buckets.
+        """
+        days = [set(store.days()) for store in self.stores]
+        pieces = []
+        day = start.date()
+        while datetime.combine(day, dt_time.min) < end:
+            day_start = datetime.combine(day, dt_time.min)
+            self._plan_day(pieces, days, day, max(start, day_start),
+                           min(end, day_start + timedelta(days=1)), len(self.stores) - 1)
+            day += timedelta(days=1)
+        return pieces
+
+    def _plan_day(self, pieces, days, day, start, end, index):
+        while index > 0 and day not in days[index]:
+            index -= 1
+        if index == 0:
+            pieces.append((0, start, end))
+            return
+        width = timedelta(seconds=self.tiers[index][1])
+        day_start = datetime.combine(day, dt_time.min)
+        first = day_start - (day_start - start) // width * width  # start rounded up to a bucket
+        last = day_start + (end - day_start) // width * width       # end rounded down
+        finer = any(day in days[finer_index] for finer_index in range(index))
+        if not finer:
+            pieces.append((index, day_start + (start - day_start) // width * width, end))
+            return
+        if first >= last:
+            self._plan_day(pieces, days, day, start, end, index - 1)
+            return
+        if start < first:
+            self._plan_day(pieces, days, day, start, first, index - 1)
+        pieces.append((index, first, last))
+        if last < end:
+            self._plan_day(pieces, days, day, last, end, index - 1)
+
+    def distribution(self, start, end, fields):
+        """Summarize fields over [start, end) from the rollups and raw samples
+
+        Returns ({field: {"count", "min", "max", "sum", "digest"}}, {tier name:
+        pieces read}). Percentiles come from the t-digests, so they are only
+        available for SKETCH_FIELDS beyond the raw tier: digest is None when
+        a rollup bucket in the range has values of the field but no sketch.
+        """
+        start = parse_time(start)
+        end = parse_time(end, end=True)
+        summaries = {field: {"count": 0, "min": None, "max": None, "sum": 0,
+                             "digest": TDigest(self.compression)} for field in fields}
+        used = {}
+        for index, piece_start, piece_end in self.plan(start, end):
+            name = self.tiers[index][0]
+            used[name] = used.get(name, 0) + 1
+            if index == 0:
+                for _, columns in self.store.columns(piece_start, piece_end, fields):
+                    for field, values in columns.items():
+                        values = values.tolist() if not isinstance(values, list) else values
+                        values = [value for value in values if _is_number(value)]
+                        if values:
+                            summary = summaries[field]
+                            self._add(summary, len(values), min(values), max(values), sum(values))
+                            if summary['digest'] is not None:
+                                summary['digest'].update(values)
+                continue
+            columns_wanted = [f"{field}@{stat}" for field in fields for stat in STATS + ('sketch',)]
+            for _, columns in self.stores[index].columns(piece_start, piece_end, columns_wanted):
+                for field in fields:
+                    counts = columns.get(f"{field}@count")
+                    if counts is None:
+                        continue
+                    rows = zip(*(_as_list(columns.get(f"{field}@{stat}"), len(counts))
+                                 for stat in STATS + ('sketch',)))
+                    summary = summaries[field]
+                    for minimum, maximum, total, count, sketch in rows:
+                        if count:
+                            self._add(summary, count, minimum, maximum, total)
+                            if not sketch:
+                                # The digest would only hold the raw edges of the range
+                                summary['digest'] = None
+                        if sketch and summary['digest'] is not None:
+                            summary['digest'].merge(TDigest.from_list(sketch, self.compression))
+        return summaries, used
+
+    @staticmethod
+    def _add(summary, count, minimum, maximum, total):
+        summary['count'] += count
+        summary['sum'] += total
+        summary['min'] = minimum if summary['min'] is None else min(summary['min'], minimum)
+        summary['max'] = maximum if summary['max'] is None else max(summary['max'], maximum)
+
+    # ------------------------------------------------------------------
+    # Status
+    # ------------------------------------------------------------------
+    def status(self):
+        """Return the tiers, their sizes and the projected disk usage as a dict
+
+        The tier sizes take a stat() of every day file, so they are measured
+        once per cycle (or interval) and served from memory in between.
+        """
+        cached = self._tier_status
+        if cached is None or time.monotonic() - cached[0] >= self.interval:
+            cached = self._tier_status = (time.monotonic(),) + self._measure_tiers()
+        _, tiers, projected = cached
+        return {
+            "tiers": tiers,
+            "projected_bytes": projected,
+            "cycles": self.cycles,
+            "steps": dict(self.steps),
+            "bytes_reclaimed": self.bytes_reclaimed,
+            "backlog": self.backlog,
+            "last_cycle": self.last_cycle,
+            "last_cycle_seconds": self.last_cycle_seconds,
+            "last_error": self.last_error
+        }
+
+    def _measure_tiers(self):
+        """Return (tiers, projected bytes) from the day files on disk"""
+        tiers = []
+        projected = 0
+        for (name, width, keep_days), store in zip(self.tiers, self.stores):
+            days = store.days()
+            sizes = [store.day_size(day) for day in days]
+            # Today is still growing: project from finished days when there are any
+            finished = [size for day, size in zip(days, sizes) if day < date.today()] or sizes
+            per_day = sum(finished) / len(finished) if finished else 0
+            tiers.append({
+                "name": name,
+                "bucket_seconds": width,
+                "keep_days": keep_days,
+                "days": len(days),
+                "first_day": days[0].isoformat() if days else None,
+                "size_bytes": sum(sizes),
+                "bytes_per_day": round(per_day)
+            })
+            projected = None if projected is None or keep_days is None else projected + round(per_day * keep_days)
+        return tiers, projected
+
+
+def create_compactor(store, config, start=True):
+    """Build the compactor of a telemetry store from the configuration, or return None
+
+    start=False builds it for reading the rollup tiers only (shared-mode web
+    workers, where the acquisition process compacts).
+    """
+    if store is None:
+        return None
+    compactor = Compactor(store, parse_tiers(config['RETENTION_TIERS']),
+                          interval=config['RETENTION_INTERVAL'], budget=config['RETENTION_BUDGET'],
+                          sketch_fields=[name for name in config['SKETCH_FIELDS'].split(',') if name],
+                          compression=config['SKETCH_COMPRESSION'])
+    if start:
+        compactor.start()
+    return compactor
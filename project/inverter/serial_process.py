@@ -0,0 +1,153 @@
+# inverter/serial_process.py
+""" Serial I/O in a dedicated process
+
+The P18 read loop reads the port a byte at a time, and every byte needs the
+GIL back. When web threads are busy building large responses the loop waits
+for the interpreter instead of the wire, replies arrive late or not at all and
+the connection gets torn down for nothing. SerialProcessTransport moves the
+whole serial engine (frame building, reading, CRC and retries) into a child
+process with its own interpreter; the web process only exchanges small
+(command) / (reply) tuples over a multiprocessing pipe.
+"""
+import multiprocessing
+import signal
+import threading
+import time
+
+
+def serial_worker(port, port_lock_file, connection, hotplug=False):
+    """Child process main loop: run serial transactions sent over the pipe"""
+    # Ctrl-C is handled by the parent, which shuts the worker down cleanly
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from .monitor import P18InverterMonitor
+    from .utils.port_detector import InverterPortDetector, start_hotplug_watcher
+
+    # Replies are cached by the monitor in the web process
+    monitor = P18InverterMonitor(port=port, port_lock_file=port_lock_file, cache_replies=False)
+    if hotplug:
+        start_hotplug_watcher(monitor, InverterPortDetector())
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        kind, payload = message
+        started = time.perf_counter()
+        try:
+            if kind == 'command':
+                result = monitor.send_p18_command(payload)
+            elif kind == 'raw':
+                result = monitor.send_raw_frame(payload)
+            elif kind == 'connect':
+                result = monitor.connect()
+            else:
+                result = monitor.connection_status()
+        except Exception as e:
+            result = (None, f"Serial process error: {str(e)}")
+        connection.send((result, monitor.connected, time.perf_counter() - started))
+    monitor.disconnect()
+
+
+class SerialProcessTransport:
+    """Monitor transport that runs serial transactions in a child process
+
+    The serial port is used by one transaction at a time anyway, so requests
+    go over a plain pipe with a single request in flight: the caller's thread
+    sends it and blocks in recv() without the GIL, with no feeder or
+    dispatcher threads to wake up. The child is started with the "spawn"
+    method so it never inherits the web server's threads or sockets, and it
+    is restarted on the next request if it dies or stops answering.
+    """
+
+    def __init__(self, port, port_lock_file=None, timeout=30, hotplug=False):
+        self.port = port
+        self.port_lock_file = port_lock_file
+        self.hotplug = hotplug
+        self.timeout = timeout
+        self.restarts = 0
+        self.device_connected = False
+        # Time the last transaction took inside the serial process
+        self.last_transaction_time = None
+        self._context = multiprocessing.get_context('spawn')
+        self._process = None
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        if self._process is not None:
+            self.restarts += 1
+        if self._connection is not None:
+            self._connection.close()
+        self._connection, child_connection = self._context.Pipe()
+        self._process = self._context.Process(
+            target=serial_worker,
+            args=(self.port, self.port_lock_file, child_connection, self.hotplug),
+            name='p18-serial', daemon=True)
+        self._process.start()
+        child_connection.close()
+
+    def _stop(self):
+        process = self._process
+        if process is None:
+            return
+        if process.is_alive():
+            try:
+                self._connection.send(None)
+            except OSError:
+                pass
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        self._connection.close()
+        self._connection = None
+
+    def _call(self, kind, payload=None):
+        with self._lock:
+            if self._process is None or not self._process.is_alive():
+                self._start()
+            try:
+                self._connection.send((kind, payload))
+                if not self._connection.poll(self.timeout):
+                    # A late reply would answer the next request, start over
+                    self._process.terminate()
+                    return None, "Serial process timeout"
+                result, connected, elapsed = self._connection.recv()
+            except (EOFError, OSError) as e:
+                return None, f"Serial process exited: {str(e) or self._process.exitcode}"
+        self.device_connected = connected
+        self.last_transaction_time = elapsed
+        return result, None
+
+    def send(self, command):
+        result, error = self._call('command', command)
+        return result if error is None else (None, error)
+
+    def send_raw(self, frame):
+        result, error = self._call('raw', frame)
+        return result if error is None else (None, error)
+
+    def connect(self):
+        result, error = self._call('connect')
+        return bool(result) and error is None
+
+    def is_connected(self):
+        return self.device_connected and self._process is not None and self._process.is_alive()
+
+    def status(self):
+        result, error = self._call('status')
+        status = result if error is None else {"state": "disconnected", "connected": False, "last_error": error}
+        status['process'] = {
+            "pid": self._process.pid if self._process else None,
+            "alive": bool(self._process and self._process.is_alive()),
+            "restarts": self.restarts
+        }
+        return status
+
+    def close(self):
+        """Stop the serial process"""
+        with self._lock:
+            self._stop()
+            self._process = None
+            self.device_connected = False
@@ -0,0 +1,207 @@
+# inverter/shared_state.py
+""" Shared-memory publication of acquisition snapshots across processes
+
+One acquisition process owns the serial port and writes the latest snapshot
+into a memory-mapped file. Any number of web workers map the same file and
+read it without taking a lock: the writer bumps a generation counter to an
+odd value before it touches the payload and to the next even value after it
+(a seqlock), and a reader retries whenever the generation was odd or changed
+while it copied the payload.
+"""
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from .acquisition import AcquisitionEngine
+from .utils.serialization import dumps
+
+MAGIC = b'P18S'
+VERSION = 1
+# magic, version, generation, payload length
+HEADER = struct.Struct('<4sIQI')
+GENERATION_OFFSET = 8
+LENGTH_OFFSET = 16
+DATA_OFFSET = 32
+DEFAULT_CAPACITY = 256 * 1024
+
+
+def default_shared_state_path():
+    """Return the default segment path, in /dev/shm when it is available"""
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'p18-monitor.state')
+
+
+class SharedSnapshotWriter:
+    """Single writer of the shared snapshot segment"""
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self.capacity = capacity
+        size = DATA_OFFSET + capacity
+        # Reuse an existing file so readers that already mapped it stay valid
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self._mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        magic, version, generation, _ = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            generation = 0
+            HEADER.pack_into(self._mm, 0, MAGIC, VERSION, generation, 0)
+        # Never start on an odd (half-written) generation left by a crashed writer
+        self.generation = generation + (generation & 1)
+
+    def write(self, document):
+        """Serialize document and publish it to all readers"""
+        payload = dumps(document)
+        if len(payload) > self.capacity:
+            raise ValueError(f"Shared state payload too large: {len(payload)} > {self.capacity} bytes")
+        mm = self._mm
+        struct.pack_into('<Q', mm, GENERATION_OFFSET, self.generation + 1)
+        mm[DATA_OFFSET:DATA_OFFSET + len(payload)] = payload
+        struct.pack_into('<I', mm, LENGTH_OFFSET, len(payload))
+        self.generation += 2
+        struct.pack_into('<Q', mm, GENERATION_OFFSET, self.generation)
+        return self.generation
+
+    def close(self):
+        """Unmap the segment (the file is kept for readers)"""
+        self._mm.close()
+
+
+class SharedSnapshotReader:
+    """Lock-free reader of the shared snapshot segment"""
+
+    def __init__(self, path, retries=100):
+        self.path = path
+        self.retries = retries
+        self.last_generation = None
+        self._mm = None
+
+    def _map(self):
+        if self._mm is not None:
+            return True
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            return False
+        try:
+            size = os.fstat(fd).st_size
+            if size < DATA_OFFSET:
+                return False
+            self._mm = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        return True
+
+    def generation(self):
+        """Return the current generation, or None if the segment does not exist yet"""
+        if not self._map():
+            return None
+        return struct.unpack_from('<Q', self._mm, GENERATION_OFFSET)[0]
+
+    def read(self):
+        """Return (generation, document) from a consistent copy, or None"""
+        if not self._map():
+            return None
+        mm = self._mm
+        for _ in range(self.retries):
+            magic, version, first, length = HEADER.unpack_from(mm, 0)
+            if magic != MAGIC or version != VERSION or first == 0:
+                return None
+            if first & 1:
+                time.sleep(0)
+                continue
+            payload = mm[DATA_OFFSET:DATA_OFFSET + length]
+            if struct.unpack_from('<Q', mm, GENERATION_OFFSET)[0] == first:
+                self.last_generation = first
+                return first, json.loads(payload)
+        return None
+
+    def read_if_changed(self):
+        """Return the document if it changed since the last read, else None"""
+        generation = self.generation()
+        if generation is None or generation == self.last_generation:
+            return None
+        result = self.read()
+        return result[1] if result else None
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+
+class SharedAcquisitionView(AcquisitionEngine):
+    """Acquisition engine mirror fed from the shared segment instead of the port
+
+    Queries first check the generation counter (one 8-byte read) and only
+    decode the payload when the acquisition process published something new.
+    The background thread keeps long-polling clients woken up promptly.
+
+    Args:
+        path (str): Shared segment published by the acquisition process
+        section (str): Mirror document[section] (e.g. 'parallel') instead of
+            the main snapshot and counters
+    """
+
+    def __init__(self, path, history_size=360, refresh_interval=0.2, section=None):
+        super().__init__(None, interval=refresh_interval, history_size=history_size)
+        self.reader = SharedSnapshotReader(path)
+        self.section = section
+        self.remote_stats = {}
+        self.epoch = None
+        # Request threads and the mirror thread poll concurrently
+        self._poll_lock = threading.Lock()
+
+    def poll_once(self):
+        """Import the latest snapshot from the shared segment if it changed"""
+        with self._poll_lock:
+            document = self.reader.read_if_changed()
+            if document is None:
+                return None
+            epoch = document.get('epoch')
+            if self.section is not None:
+                document = document.get(self.section) or {}
+            self.remote_stats = document.get('stats') or {}
+            if epoch != self.epoch:
+                # The acquisition process restarted and its sequence started over
+                self.epoch = epoch
+                self.reset()
+            snapshot = document.get('snapshot')
+            if snapshot and snapshot['seq'] > self.seq:
+                return self.ingest(snapshot)
+            return None
+
+    def latest(self):
+        self.poll_once()
+        return super().latest()
+
+    def history(self, since=0, limit=None):
+        self.poll_once()
+        return super().history(since, limit)
+
+    def changes_since(self, since):
+        self.poll_once()
+        return super().changes_since(since)
+
+    def stats(self):
+        """Return the counters of the acquisition process plus local mirror state"""
+        self.poll_once()
+        stats = dict(self.remote_stats)
+        stats.update({
+            "mode": "shared",
+            "shared_state": self.reader.path,
+            "generation": self.reader.last_generation,
+            "mirror_running": self.is_running()
+        })
+        if self.configuration_watcher is not None:
+            # This worker's own settings cache, refreshed from the mirrored snapshots
+            stats["settings"] = self.configuration_watcher.status()
+        return stats
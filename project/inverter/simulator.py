@@ -0,0 +1,183 @@
+# inverter/simulator.py
+""" Simulated P18 inverter on a pseudo-terminal
+
+Serves canned P18 replies on a pty so the monitor, the broker and the
+benchmarks can run without hardware (Linux/macOS only):
+
+    python -m project.inverter.simulator --link /tmp/ttyP18SIM
+
+then start the application with INVERTER_PORT=/tmp/ttyP18SIM.
+"""
+import argparse
+import os
+import signal
+import threading
+import time
+
+try:
+    import pty
+    import tty
+except ImportError:  # no pseudo-terminals on Windows
+    pty = None
+    tty = None
+
+DEFAULT_LINK = '/tmp/ttyP18SIM'
+
+# Payloads of the ^D replies, keyed by query command
+SIMULATED_RESPONSES = {
+    'PI': '18',
+    'ID': '1496132212101297000000',
+    'VFW': '00001,00002,00003',
+    'GMN': '02',
+    'MOD': '05',
+    'GS': '2300,500,2300,500,1200,1050,018,482,000,000,022,000,085,038,035,000,'
+          '0000,0000,0000,0000,0,1,1,1,2,2,0,0',
+    'FWS': '00,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0',
+    'PIRI': '2300,217,2300,500,217,5000,5000,480,460,470,440,564,540,2,030,060,'
+            '0,1,2,9,1,0,0,0,1,00',
+    'ACCT': '000023591',
+    'ACLT': '000023591',
+    'ET': '00123456',
+}
+
+
+def crc16_modbus(data):
+    """Calculate CRC-16/MODBUS"""
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            if crc & 0x0001:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+    return crc
+
+
+def build_reply(payload):
+    """Build a ^D reply frame for payload
+
+    CRC bytes that would read as a frame delimiter are bumped by one, the same
+    way the inverter firmware does it.
+    """
+    body = f"^D{len(payload) + 3:03d}{payload}".encode('ascii')
+    crc = crc16_modbus(body)
+    crc_bytes = bytes(b + 1 if b in (0x28, 0x0D, 0x0A) else b for b in ((crc >> 8) & 0xFF, crc & 0xFF))
+    return body + crc_bytes + b'\r'
+
+
+class SimulatedInverter:
+    """Answer P18 queries on a pty, optionally at a real serial line rate
+
+    Args:
+        link (str): Symlink created to the pty slave, used as INVERTER_PORT
+        baudrate (int): Pace replies like a serial line at this rate; None sends at once
+        response_delay (float): Seconds the "firmware" takes before it replies
+        responses (dict): Overrides for SIMULATED_RESPONSES
+    """
+
+    def __init__(self, link=DEFAULT_LINK, baudrate=None, response_delay=0.0, responses=None):
+        if pty is None:
+            raise RuntimeError("The inverter simulator needs pseudo-terminal support")
+        self.link = link
+        self.baudrate = baudrate
+        self.response_delay = response_delay
+        self.responses = dict(SIMULATED_RESPONSES, **(responses or {}))
+        self.commands = 0
+        self._master = None
+        self._slave = None
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Create the pty and serve requests in a background thread"""
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        if os.path.lexists(self.link):
+            os.unlink(self.link)
+        os.symlink(os.ttyname(self._slave), self.link)
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, name='p18-simulator', daemon=True)
+        self._thread.start()
+        return self.link
+
+    def stop(self):
+        """Stop serving and remove the pty"""
+        self._running = False
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._master = self._slave = None
+        if os.path.lexists(self.link):
+            os.unlink(self.link)
+
+    def reply_for(self, frame):
+        """Return the reply bytes for one request frame (without the CR)"""
+        start = frame.find(b'^')
+        if start < 0 or len(frame) < start + 7:
+            return None
+        kind = frame[start + 1:start + 2]
+        command = frame[start + 5:-2].decode('ascii', errors='ignore')
+        self.commands += 1
+        if kind == b'S':
+            # Set commands are acknowledged
+            return b'^1' + bytes(2) + b'\r'
+        payload = self.responses.get(command)
+        if payload is None:
+            return b'^0' + bytes(2) + b'\r'
+        return build_reply(payload)
+
+    def _serve(self):
+        buffer = b''
+        while self._running:
+            try:
+                data = os.read(self._master, 256)
+            except OSError:
+                return
+            buffer += data
+            while b'\r' in buffer:
+                frame, buffer = buffer.split(b'\r', 1)
+                reply = self.reply_for(frame)
+                if reply is None:
+                    continue
+                if self.response_delay:
+                    time.sleep(self.response_delay)
+                try:
+                    self._write(reply)
+                except OSError:
+                    return
+
+    def _write(self, reply):
+        if not self.baudrate:
+            os.write(self._master, reply)
+            return
+        # 10 bits per byte on an 8N1 line, sent in small chunks
+        byte_time = 10.0 / self.baudrate
+        for offset in range(0, len(reply), 8):
+            chunk = reply[offset:offset + 8]
+            os.write(self._master, chunk)
+            time.sleep(byte_time * len(chunk))
+
+
+def main():
+    """Run the simulator in the foreground until SIGTERM/SIGINT"""
+    parser = argparse.ArgumentParser(description="Simulated P18 inverter on a pseudo-terminal")
+    parser.add_argument('--link', default=DEFAULT_LINK, help="Path of the port to create")
+    parser.add_argument('--baudrate', type=int, default=None, help="Pace replies at this line rate")
+    parser.add_argument('--delay', type=float, default=0.0, help="Reply delay in seconds")
+    args = parser.parse_args()
+
+    simulator = SimulatedInverter(args.link, baudrate=args.baudrate, response_delay=args.delay)
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    print(f"Simulated inverter on {simulator.start()}")
+    stop_event.wait()
+    simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
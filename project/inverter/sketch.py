@@ -0,0 +1,170 @@
+# inverter/sketch.py
+""" Mergeable quantile sketches (t-digest) for percentile queries over history
+
+A t-digest (Dunning, "Computing extremely accurate quantiles using
+t-digests") summarizes any number of samples as a few dozen centroids
+(mean, weight), small near the tails and larger in the middle, so p5 and
+p95 stay accurate while the sketch stays bounded by its compression.
+Two digests merge into a digest of the union, which is what lets rollups
+of a minute be combined into hours and any range be answered from a
+handful of stored sketches instead of every sample.
+
+This is the merging variant: values are buffered, sorted together with
+the centroids and folded greedily under the k1 scale function whenever
+the buffer fills. A digest serializes to a flat list
+[min, max, mean1, weight1, mean2, weight2, ...] of JSON numbers.
+"""
+import math
+
+DEFAULT_COMPRESSION = 50
+
+
+def _k(q, compression):
+    return compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+
+def _k_inverse(k, compression):
+    return (math.sin(min(max(k * 2 * math.pi / compression, -math.pi / 2), math.pi / 2)) + 1) / 2
+
+
+class TDigest:
+    """Mergeable quantile sketch
+
+    Args:
+        compression (int): Bound on the centroids kept (about compression / 2
+            after folding); higher is more accurate and larger
+    """
+
+    def __init__(self, compression=DEFAULT_COMPRESSION):
+        self.compression = compression
+        self.centroids = []  # [mean, weight], sorted by mean
+        self.min = None
+        self.max = None
+        self._buffer = []
+
+    @property
+    def count(self):
+        return sum(weight for _, weight in self.centroids) + sum(weight for _, weight in self._buffer)
+
+    def add(self, value, weight=1):
+        """Add one value (weight times)"""
+        value = float(value)
+        if math.isnan(value):
+            return
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self._buffer.append([value, weight])
+        if len(self._buffer) >= self.compression * 5:
+            self._fold()
+
+    def update(self, values):
+        """Add every value of an iterable"""
+        for value in values:
+            if value is not None:
+                self.add(value)
+
+    def merge(self, other):
+        """Fold the values summarized by other into this digest"""
+        if other.min is None:
+            return self
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self._buffer.extend([mean, weight] for mean, weight in other.centroids + other._buffer)
+        if len(self._buffer) >= self.compression * 5:
+            self._fold()
+        return self
+
+    def _fold(self):
+        """Fold the buffer into the centroids under the k1 size bound"""
+        points = sorted(self.centroids + self._buffer, key=lambda centroid: centroid[0])
+        self._buffer = []
+        if not points:
+            return
+        total = sum(weight for _, weight in points)
+        folded = [list(points[0])]
+        done = 0.0  # weight before the current centroid
+        limit = total * _k_inverse(_k(0.0, self.compression) + 1, self.compression)
+        for mean, weight in points[1:]:
+            current = folded[-1]
+            if done + current[1] + weight <= limit or mean == current[0]:
+                current[1] += weight
+                current[0] += (mean - current[0]) * weight / current[1]
+            else:
+                done += current[1]
+                limit = total * _k_inverse(_k(done / total, self.compression) + 1, self.compression)
+                folded.append([mean, weight])
+        self.centroids = folded
+
+    def quantile(self, q):
+        """Return the estimated value at quantile q (0..1), or None when empty"""
+        if self._buffer:
+            self._fold()
+        if not self.centroids:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        total = sum(weight for _, weight in self.centroids)
+        index = q * total
+        # Interpolate between the centers of neighbouring centroids, and
+        # between min/max and the first/last center at the ends
+        previous_mean, previous_center = self.min, 0.0
+        seen = 0.0
+        for mean, weight in self.centroids:
+            center = seen + weight / 2
+            if index < center:
+                if center == previous_center:
+                    return mean
+                fraction = (index - previous_center) / (center - previous_center)
+                return previous_mean + fraction * (mean - previous_mean)
+            previous_mean, previous_center = mean, center
+            seen += weight
+        if total == previous_center:
+            return self.max
+        fraction = (index - previous_center) / (total - previous_center)
+        return previous_mean + fraction * (self.max - previous_mean)
+
+    def cdf(self, value):
+        """Return the estimated fraction of values at or below value"""
+        if self._buffer:
+            self._fold()
+        if not self.centroids:
+            return None
+        if value < self.min:
+            return 0.0
+        if value >= self.max:
+            return 1.0
+        total = sum(weight for _, weight in self.centroids)
+        previous_mean, previous_center = self.min, 0.0
+        seen = 0.0
+        for mean, weight in self.centroids:
+            center = seen + weight / 2
+            if value < mean:
+                fraction = (value - previous_mean) / (mean - previous_mean) if mean > previous_mean else 1.0
+                return (previous_center + fraction * (center - previous_center)) / total
+            previous_mean, previous_center = mean, center
+            seen += weight
+        fraction = (value - previous_mean) / (self.max - previous_mean) if self.max > previous_mean else 1.0
+        return (previous_center + fraction * (total - previous_center)) / total
+
+    def to_list(self, decimals=4):
+        """Serialize as [min, max, mean1, weight1, ...] with means rounded to decimals places"""
+        if self._buffer:
+            self._fold()
+        if self.min is None:
+            return []
+        flat = [self.min, self.max]
+        for mean, weight in self.centroids:
+            flat.append(round(mean, decimals))
+            flat.append(weight)
+        return flat
+
+    @classmethod
+    def from_list(cls, flat, compression=DEFAULT_COMPRESSION):
+        """Rebuild a digest written by to_list"""
+        digest = cls(compression)
+        if flat:
+            digest.min, digest.max = flat[0], flat[1]
+            digest.centroids = [[flat[index], flat[index + 1]] for index in range(2, len(flat), 2)]
+        return digest
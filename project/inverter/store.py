@@ -0,0 +1,397 @@
+# inverter/store.py
+""" Persistent telemetry store: every acquisition snapshot, partitioned by day
+
+The acquisition owner (the app in local mode, the acquisition daemon in
+shared mode) attaches a TelemetryStore to the engine; any process can open
+the same directory to read it. Samples are kept in memory by the snapshot
+listener, so the serial loop never waits for the disk, and are handed to
+the group-commit writer (see utils/group_commit.py) right before each of
+its commits, so the card sees one append per day file per commit interval.
+
+Each day is one file, YYYY-MM-DD.p18c, made of compressed columnar blocks
+(see columnar.py): every commit appends one block with the samples since
+the previous one. Once a day is over its small blocks are merged into
+blocks of up to block_samples samples, which compress far better; the day
+file is rewritten to a temporary file and renamed over the old one, so
+readers never see a half-written file. Merging, downsampling and deleting
+old days are the job of the compactor (see retention.py).
+
+Day files of the earlier NDJSON format (YYYY-MM-DD.ndjson) are still read.
+Reads stream block by block, so a query over months of data runs in
+constant memory, and blocks outside the queried range are skipped from
+their header alone.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from datetime import date, datetime, time as dt_time, timedelta
+
+from . import columnar
+from .utils.group_commit import durable_rename, get_writer
+
+DAY_SUFFIX = '.p18c'
+LEGACY_SUFFIX = '.ndjson'
+MERGE_SUFFIX = '.merging'  # appended to the day file being merged
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def parse_time(value, end=False):
+    """Parse an ISO date or datetime; a bare date means the start of that day (the end with end=True)
+
+    Datetimes with an offset are converted to naive local time, like the stored timestamps.
+    """
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, date):
+        parsed = datetime.combine(value, dt_time.min)
+        return parsed + timedelta(days=1) if end else parsed
+    else:
+        parsed = datetime.fromisoformat(value)
+        if end and len(value) <= 10:
+            parsed += timedelta(days=1)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def to_micros(timestamp):
+    """Convert a (naive, local) datetime into integer microseconds since 1970-01-01"""
+    return (timestamp - EPOCH) // MICROSECOND
+
+
+def from_micros(micros):
+    """Convert integer microseconds since 1970-01-01 back into a datetime"""
+    return EPOCH + timedelta(microseconds=int(micros))
+
+
+class TelemetryStore:
+    """Day-partitioned columnar sample files in one directory
+
+    Args:
+        directory (str): Directory of the day files
+        block_samples (int): Samples per block when a finished day is merged
+        writer (GroupCommitWriter): Writer of the day files (the process's
+            shared writer by default)
+    """
+
+    def __init__(self, directory, block_samples=4096, writer=None):
+        self.directory = directory
+        self.block_samples = block_samples
+        self.writer = writer or get_writer()
+        self.engine = None
+        self.samples_written = 0
+        self.bytes_written = 0
+        self.days_merged = 0
+        self.last_flush = None
+        self.last_error = None
+        self._pending = []
+        self._merges = {}  # day -> state of a merge in progress
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, day, suffix=DAY_SUFFIX):
+        return os.path.join(self.directory, f"{day.isoformat()}{suffix}")
+
+    def days(self):
+        """Return the dates that have a file, oldest first"""
+        days = set()
+        for name in os.listdir(self.directory):
+            stem, suffix = os.path.splitext(name)
+            if suffix in (DAY_SUFFIX, LEGACY_SUFFIX):
+                try:
+                    days.add(date.fromisoformat(stem))
+                except ValueError:
+                    continue
+        return sorted(days)
+
+    def day_size(self, day):
+        """Return the bytes on disk of the files of day"""
+        size = 0
+        for suffix in (DAY_SUFFIX, LEGACY_SUFFIX):
+            try:
+                size += os.path.getsize(self._path(day, suffix))
+            except OSError:
+                continue
+        return size
+
+    def delete_day(self, day):
+        """Delete the files of day; return the bytes freed"""
+        size = 0
+        with self.writer.hold():
+            self._abort_merge(day)
+            for suffix in (DAY_SUFFIX, LEGACY_SUFFIX):
+                path = self._path(day, suffix)
+                try:
+                    file_size = os.path.getsize(path)
+                    os.remove(path)
+                except OSError:
+                    continue
+                size += file_size
+        return size
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+    def attach(self, engine):
+        """Store every snapshot engine publishes"""
+        self.engine = engine
+        engine.add_listener(self.on_snapshot)
+        self.writer.add_source(self.flush)
+        return self
+
+    def on_snapshot(self, snapshot):
+        """Buffer one snapshot (runs in the acquisition thread, never touches the disk)"""
+        if snapshot.get('stale'):
+            return
+        with self._lock:
+            self._pending.append((snapshot['timestamp'], snapshot['flat']))
+
+    @staticmethod
+    def _encode(samples):
+        """Encode (datetime, {field: value}) samples as one block"""
+        names = {}
+        for _, values in samples:
+            names.update(dict.fromkeys(values))
+        timestamps = [to_micros(timestamp) for timestamp, _ in samples]
+        columns = {name: [values.get(name) for _, values in samples] for name in names}
+        return columnar.encode_block(timestamps, columns)
+
+    def flush(self):
+        """Hand the buffered samples to the writer, one block per day
+
+        Called by the writer right before each commit.
+        """
+        with self._lock:
+            samples, self._pending = self._pending, []
+        if not samples:
+            return
+        by_day = {}
+        for timestamp, values in samples:
+            timestamp = datetime.fromisoformat(timestamp)
+            by_day.setdefault(timestamp.date(), []).append((timestamp, values))
+        for day, day_samples in by_day.items():
+            day_samples.sort(key=lambda sample: sample[0])
+            block = self._encode(day_samples)
+            self.writer.append(self._path(day), block, 'telemetry')
+            self.bytes_written += len(block)
+        self.samples_written += len(samples)
+        self.last_flush = datetime.now().isoformat()
+
+    def merge_day(self, day, deadline=None):
+        """Rewrite the file of day with its small blocks merged, in slices
+
+        Merged blocks are appended to a side file while the day file stays in
+        place for queries. With a deadline (on the time.monotonic() clock)
+        the merge stops after the block that passes it and resumes there on
+        the next call; commits are only held for the final rename.
+
+        Returns:
+            bool or None: True if the file was rewritten, False if there was
+            nothing to merge, None if the merge is not finished yet
+        """
+        path = self._path(day)
+        state = self._merges.get(day)
+        if state is None:
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except OSError:
+                return False
+            blocks = list(columnar.iter_blocks(data))
+            total = sum(count for _, count, _, _ in blocks)
+            if len(blocks) <= -(-total // self.block_samples):
+                return False  # already as merged as it gets
+            self._abort_merge(day)
+            state = self._merges[day] = {"offset": 0, "timestamps": [], "columns": {}}
+        side = path + MERGE_SUFFIX
+        try:
+            if not self._merge_slice(path, side, state, deadline):
+                self._commit_merged(side)
+                return None
+            # Commit what is buffered for the day first and keep appends out until renamed
+            with self.writer.hold():
+                self._merge_slice(path, side, state, None)
+                if state['timestamps']:
+                    self._append_merged(side, columnar.encode_block(state['timestamps'], state['columns']))
+                self._commit_merged(side)
+                durable_rename(side, path, self.writer.fsync)
+        except Exception:
+            self._abort_merge(day)
+            raise
+        del self._merges[day]
+        self.days_merged += 1
+        return True
+
+    def _merge_slice(self, path, side, state, deadline):
+        """Merge the blocks after state['offset'] until deadline; return True at the end of the file"""
+        with open(path, 'rb') as f:
+            f.seek(state['offset'])
+            data = f.read()
+        size = self.block_samples
+        # Concatenate column by column; a field missing from a block is None there
+        timestamps, columns = state['timestamps'], state['columns']
+        end = 0  # of the last block merged, relative to data
+        for offset, count, _, _ in columnar.iter_blocks(data):
+            block_timestamps, block_columns = columnar.decode_block(data, offset)
+            for name in block_columns:
+                columns.setdefault(name, [None] * len(timestamps))
+            for name, values in columns.items():
+                values.extend(block_columns.get(name, [None] * count))
+            timestamps.extend(block_timestamps)
+            while len(timestamps) >= size:
+                self._append_merged(side, columnar.encode_block(
+                    timestamps[:size], {name: values[:size] for name, values in columns.items()}))
+                del timestamps[:size]
+                for values in columns.values():
+                    del values[:size]
+            end = offset + columnar.HEADER.size + columnar.read_header(data, offset)[3]
+            if deadline is not None and time.monotonic() >= deadline:
+                state['offset'] += end
+                return False
+        state['offset'] += end
+        return True
+
+    def _append_merged(self, side, block):
+        self.writer.append(side, block, 'telemetry')
+        self.bytes_written += len(block)
+
+    def _commit_merged(self, side):
+        self.writer.commit()
+        if self.writer.pending(side):
+            raise OSError(self.writer.last_error)
+
+    def _abort_merge(self, day):
+        """Forget a merge in progress and remove its side file"""
+        self._merges.pop(day, None)
+        try:
+            os.remove(self._path(day) + MERGE_SUFFIX)
+        except OSError:
+            pass
+
+    def stop(self):
+        """Stop recording and commit what is still buffered"""
+        if self.engine is not None:
+            self.engine.remove_listener(self.on_snapshot)
+        self.writer.remove_source(self.flush)
+        self.flush()
+        self.writer.commit()
+
+    # ------------------------------------------------------------------
+    # Reading
+    # ------------------------------------------------------------------
+    def _day_range(self, start, end):
+        for day in self.days():
+            if start is not None and day < start.date():
+                continue
+            if end is not None and datetime.combine(day, dt_time.min) >= end:
+                break
+            yield day
+
+    def _blocks(self, day, start_us, end_us, fields, vectorized):
+        """Yield (timestamps, columns) of the blocks of day overlapping [start_us, end_us)"""
+        # Includes the blocks this process has not committed yet
+        data = self.writer.read(self._path(day))
+        if data is None:
+            return
+        for offset, _, first, last in columnar.iter_blocks(data):
+            if (start_us is not None and last < start_us) or (end_us is not None and first >= end_us):
+                continue
+            try:
+                yield columnar.decode_block(data, offset, fields, vectorized)
+            except columnar.BlockError as e:
+                self.last_error = f"Unreadable block in {day}: {e}"
+
+    def _scan_legacy(self, day, start, end, fields):
+        try:
+            f = open(self._path(day, LEGACY_SUFFIX), 'rb')
+        except OSError:
+            return
+        with f:
+            for line in f:
+                try:
+                    sample = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by a crash
+                timestamp = datetime.fromisoformat(sample['timestamp'])
+                if (start is not None and timestamp < start) or (end is not None and timestamp >= end):
+                    continue
+                values = sample['fields']
+                if fields is not None:
+                    values = {name: values.get(name) for name in fields}
+                yield timestamp, values
+
+    def scan(self, start=None, end=None, fields=None):
+        """Yield (timestamp, {field: value}) of the samples in [start, end), oldest first
+
+        start and end are datetimes (or ISO strings); fields limits the fields returned.
+        """
+        start = parse_time(start) if start is not None else None
+        end = parse_time(end, end=True) if end is not None else None
+        start_us = to_micros(start) if start is not None else None
+        end_us = to_micros(end) if end is not None else None
+        for day in self._day_range(start, end):
+            yield from self._scan_legacy(day, start, end, fields)
+            for timestamps, columns in self._blocks(day, start_us, end_us, fields, vectorized=False):
+                names = list(fields) if fields is not None else list(columns)
+                missing = [None] * len(timestamps)
+                values = [columns.get(name, missing) for name in names]
+                for index, timestamp in enumerate(timestamps):
+                    if (start_us is not None and timestamp < start_us) or \
+                            (end_us is not None and timestamp >= end_us):
+                        continue
+                    yield from_micros(timestamp), {name: column[index] for name, column in zip(names, values)}
+
+    def columns(self, start=None, end=None, fields=None):
+        """Yield (timestamps, {field: values}) per block in [start, end), decoded vectorized
+
+        With numpy, timestamps (integer microseconds) and the numeric columns
+        without gaps are ndarrays; other columns are lists. Blocks are trimmed
+        to the range, legacy NDJSON days are not included.
+        """
+        start = parse_time(start) if start is not None else None
+        end = parse_time(end, end=True) if end is not None else None
+        start_us = to_micros(start) if start is not None else None
+        end_us = to_micros(end) if end is not None else None
+        for day in self._day_range(start, end):
+            for timestamps, columns in self._blocks(day, start_us, end_us, fields, vectorized=True):
+                # Timestamps are sorted within a block
+                first = bisect_left(timestamps, start_us) if start_us is not None else 0
+                last = bisect_left(timestamps, end_us) if end_us is not None else len(timestamps)
+                if (first, last) != (0, len(timestamps)):
+                    timestamps = timestamps[first:last]
+                    columns = {name: values[first:last] for name, values in columns.items()}
+                yield timestamps, columns
+
+    def status(self):
+        """Return the store counters as a dict"""
+        days = self.days()
+        return {
+            "directory": self.directory,
+            "days": len(days),
+            "first_day": days[0].isoformat() if days else None,
+            "last_day": days[-1].isoformat() if days else None,
+            "size_bytes": sum(self.day_size(day) for day in days),
+            "buffered_samples": len(self._pending),
+            "samples_written": self.samples_written,
+            "bytes_written": self.bytes_written,
+            "days_merged": self.days_merged,
+            "last_flush": self.last_flush,
+            "last_error": self.last_error
+        }
+
+
+def create_telemetry_store(engine, config):
+    """Open the telemetry store of the configuration, or return None
+
+    With an engine the store records its snapshots; without one (shared-mode
+    web workers) it is only read.
+    """
+    if not config['TELEMETRY_STORE']:
+        return None
+    store = TelemetryStore(config['TELEMETRY_STORE'])
+    if engine is not None:
+        store.attach(engine)
+    return store
@@ -0,0 +1,389 @@
+# inverter/uplink.py
+""" Store-and-forward uplink of telemetry to a central HTTP collector
+
+Sites sit behind links that drop for minutes or days, so nothing is sent
+straight from the acquisition loop. The snapshot listener only appends the
+sample (and a fault event when the working mode or a fault flag changed) to
+an in-memory list. A worker thread periodically hands that list to the
+durable outbox on disk, which reaches the disk with the next group commit
+(see utils/group_commit.py), and ships the outbox in batches:
+
+- the outbox is a directory of append-only NDJSON segment files; a cursor
+  file (segment, byte offset) records what the collector has acknowledged,
+  so after a restart sending resumes where it stopped
+- each batch is one gzip-compressed POST over a pooled keep-alive session
+- failures are retried with exponential backoff (and Retry-After); a batch
+  whose payload the collector rejects (400, 413, 415, 422) is skipped so it
+  cannot block the rest
+- when the outbox exceeds its size limit the oldest segments are dropped
+
+Batches carry their cursor in X-Batch-Cursor, so a collector can discard a
+batch it already stored when an acknowledgement was lost.
+"""
+import gzip
+import json
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+from .utils import serialization
+from .utils.group_commit import get_writer
+
+SEGMENT_SUFFIX = '.ndjson'
+# Answers that reject the batch itself; anything else (401, 403, 404, 5xx, ...)
+# is a problem of the collector or the credentials and is retried
+REJECTED_STATUSES = (400, 413, 415, 422)
+CURSOR_FILE = 'cursor.json'
+
+
+class Outbox:
+    """Durable queue of NDJSON records in segment files with a persisted send cursor
+
+    Args:
+        directory (str): Directory of the segment and cursor files
+        segment_bytes (int): Size after which a new segment is started
+        max_bytes (int): Unsent data kept at most; older segments are dropped
+        writer (GroupCommitWriter): Writer of the segments and the cursor
+            (the process's shared writer by default)
+    """
+
+    def __init__(self, directory, segment_bytes=1024 * 1024, max_bytes=64 * 1024 * 1024, writer=None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.writer = writer or get_writer()
+        self.dropped_segments = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.cursor = self._load_cursor()
+        self._repair_tail()
+        if self.cursor[0] not in self.segments():
+            # The cursor segment is gone: resume at the start of the next one
+            later = [number for number in self.segments() if number > self.cursor[0]]
+            self.cursor = (later[0] if later else self.cursor[0], 0)
+
+    def _path(self, segment):
+        return os.path.join(self.directory, f"{segment:010d}{SEGMENT_SUFFIX}")
+
+    def segments(self):
+        """Return the numbers of the segment files on disk, oldest first"""
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit():
+                numbers.append(int(name[:-len(SEGMENT_SUFFIX)]))
+        return sorted(numbers)
+
+    def _load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, CURSOR_FILE), 'r') as f:
+                cursor = json.load(f)
+            return int(cursor['segment']), int(cursor['offset'])
+        except (OSError, ValueError, KeyError, TypeError):
+            segments = self.segments()
+            return (segments[0] if segments else 0), 0
+
+    def _save_cursor(self):
+        # Losing the last cursor in a crash only resends batches the collector discards
+        self.writer.replace(os.path.join(self.directory, CURSOR_FILE),
+                            json.dumps({"segment": self.cursor[0], "offset": self.cursor[1]}), 'events')
+
+    def _repair_tail(self):
+        # A crash in the middle of an append leaves a partial last line: cut it off
+        segments = self.segments()
+        if not segments:
+            return
+        path = self._path(segments[-1])
+        with open(path, 'rb+') as f:
+            data = f.read()
+            if data and not data.endswith(b'\n'):
+                f.truncate(data.rfind(b'\n') + 1)
+
+    def append(self, records):
+        """Append records (dicts) to the current segment with the next group commit"""
+        if not records:
+            return
+        data = b''.join(serialization.dumps(record) + b'\n' for record in records)
+        with self._lock:
+            segments = self.segments()
+            segment = segments[-1] if segments else self.cursor[0]
+            path = self._path(segment)
+            if os.path.exists(path) and os.path.getsize(path) >= self.segment_bytes:
+                segment += 1
+                path = self._path(segment)
+            self.writer.append(path, data, 'events')
+            self._enforce_limit()
+
+    def _enforce_limit(self):
+        while self.pending_bytes() > self.max_bytes:
+            segments = [number for number in self.segments() if number >= self.cursor[0]]
+            if len(segments) < 2:
+                return
+            # Never drop the segment being written; skip the oldest unsent one
+            os.remove(self._path(segments[0]))
+            self.cursor = (segments[1], 0)
+            self._save_cursor()
+            self.dropped_segments += 1
+
+    def pending_bytes(self):
+        """Return the size of the data not yet acknowledged"""
+        total = 0
+        for number in self.segments():
+            if number < self.cursor[0]:
+                continue
+            size = os.path.getsize(self._path(number))
+            total += size - self.cursor[1] if number == self.cursor[0] else size
+        return max(0, total)
+
+    def read_batch(self, max_records=500, max_bytes=512 * 1024):
+        """Return (lines, cursor after them) of the oldest unsent records
+
+        lines is a list of NDJSON lines (bytes); it is empty when everything was sent.
+        """
+        with self._lock:
+            segment, offset = self.cursor
+            lines = []
+            size = 0
+            for number in self.segments():
+                if number < segment:
+                    continue
+                if number > segment:
+                    segment, offset = number, 0
+                with open(self._path(number), 'rb') as f:
+                    f.seek(offset)
+                    for line in f:
+                        if not line.endswith(b'\n'):
+                            break
+                        if lines and (len(lines) >= max_records or size + len(line) > max_bytes):
+                            return lines, (segment, offset)
+                        lines.append(line)
+                        size += len(line)
+                        offset += len(line)
+            return lines, (segment, offset)
+
+    def commit(self, cursor):
+        """Record everything before cursor as sent and delete the segments it covers"""
+        with self._lock:
+            self.cursor = cursor
+            self._save_cursor()
+            for number in self.segments():
+                if number < cursor[0]:
+                    os.remove(self._path(number))
+
+    def status(self):
+        """Return the outbox state as a dict"""
+        return {
+            "directory": self.directory,
+            "segments": len(self.segments()),
+            "pending_bytes": self.pending_bytes(),
+            "cursor": f"{self.cursor[0]}:{self.cursor[1]}",
+            "dropped_segments": self.dropped_segments
+        }
+
+
+def snapshot_records(snapshot, site):
+    """Return the outbox records of one snapshot: the sample and, if any, a fault event"""
+    flat = snapshot['flat']
+    records = [{
+        "type": "sample",
+        "site": site,
+        "seq": snapshot['seq'],
+        "timestamp": snapshot['timestamp'],
+        "fields": flat
+    }]
+    changed = [name for name in snapshot.get('changed', ())
+               if name == 'working_mode' or name.startswith('faults.')]
+    if changed:
+        records.append({
+            "type": "event",
+            "site": site,
+            "seq": snapshot['seq'],
+            "timestamp": snapshot['timestamp'],
+            "changes": {name: flat.get(name) for name in changed}
+        })
+    return records
+
+
+class UplinkSender:
+    """Ship acquisition snapshots to an HTTP collector through a durable outbox
+
+    Args:
+        url (str): Collector endpoint receiving the POSTed batches
+        outbox (Outbox): Durable outbox
+        site (str): Site identifier sent with every record
+        interval (float): Seconds between outbox flushes and send attempts
+        batch_size (int): Records per POST at most
+        timeout (float): HTTP timeout per request, in seconds
+        token (str): Bearer token for the collector, if it needs one
+        max_backoff (float): Longest wait between retries, in seconds
+    """
+
+    def __init__(self, url, outbox, site=None, interval=30, batch_size=500, timeout=10, token=None,
+                 max_backoff=600):
+        self.url = url
+        self.outbox = outbox
+        self.site = site or socket.gethostname()
+        self.interval = interval
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.engine = None
+        self.sent_batches = 0
+        self.sent_records = 0
+        self.sent_bytes = 0
+        self.rejected_batches = 0
+        self.failures = 0
+        self.last_success = None
+        self.last_error = None
+        self._pending = []
+        self._attempt = 0
+        self._next_attempt = 0.0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        # One session: the connection to the collector is kept alive between batches
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Content-Type": "application/x-ndjson",
+            "Content-Encoding": "gzip",
+            "X-Site-Id": self.site
+        })
+        if token:
+            self.session.headers['Authorization'] = f"Bearer {token}"
+
+    def attach(self, engine):
+        """Queue every snapshot engine publishes"""
+        self.engine = engine
+        engine.add_listener(self.on_snapshot)
+        return self
+
+    def on_snapshot(self, snapshot):
+        """Keep the records of a snapshot for the next flush (never blocks on I/O)"""
+        if snapshot.get('stale'):
+            return
+        records = snapshot_records(snapshot, self.site)
+        with self._lock:
+            self._pending.extend(records)
+
+    def start(self):
+        """Flush and send in a background thread"""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='p18-uplink', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sending; pending records are written to the outbox first"""
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(self.timeout + 5)
+            self._thread = None
+        if self.engine is not None:
+            self.engine.remove_listener(self.on_snapshot)
+        self.flush()
+        self.session.close()
+
+    def flush(self):
+        """Write the records received since the last flush to the outbox"""
+        with self._lock:
+            records, self._pending = self._pending, []
+        try:
+            self.outbox.append(records)
+        except OSError as e:
+            self.last_error = f"Outbox write failed: {e}"
+            with self._lock:
+                self._pending[:0] = records
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self.flush()
+            if time.monotonic() >= self._next_attempt:
+                self.send_pending()
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def send_pending(self):
+        """Send batches until the outbox is empty or a request fails; return True if all went out"""
+        while not self._stop_event.is_set():
+            lines, cursor = self.outbox.read_batch(self.batch_size)
+            if not lines:
+                return True
+            if not self._post(lines, cursor):
+                return False
+        return False
+
+    def _post(self, lines, cursor):
+        body = gzip.compress(b''.join(lines), compresslevel=6)
+        headers = {"X-Batch-Cursor": f"{cursor[0]}:{cursor[1]}"}
+        retry_after = None
+        try:
+            response = self.session.post(self.url, data=body, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            self.last_error = f"Upload failed: {e}"
+        else:
+            if 200 <= response.status_code < 300:
+                self.outbox.commit(cursor)
+                self.sent_batches += 1
+                self.sent_records += len(lines)
+                self.sent_bytes += len(body)
+                self.last_success = datetime.now().isoformat()
+                self._attempt = 0
+                return True
+            self.last_error = f"Collector answered HTTP {response.status_code}"
+            if response.status_code in REJECTED_STATUSES:
+                # The collector will never take this batch: skip it instead of blocking the outbox
+                self.outbox.commit(cursor)
+                self.rejected_batches += 1
+                return True
+            try:
+                retry_after = float(response.headers.get('Retry-After', ''))
+            except ValueError:
+                retry_after = None
+        self.failures += 1
+        self._attempt += 1
+        backoff = min(self.max_backoff, self.interval * 2 ** (self._attempt - 1))
+        # Jitter keeps a fleet of sites from retrying in lockstep after an outage
+        delay = retry_after if retry_after is not None else backoff * random.uniform(0.5, 1.0)
+        self._next_attempt = time.monotonic() + delay
+        return False
+
+    def status(self):
+        """Return the uplink counters as a dict"""
+        retry_in = self._next_attempt - time.monotonic()
+        return {
+            "url": self.url,
+            "site": self.site,
+            "outbox": self.outbox.status(),
+            "unflushed_records": len(self._pending),
+            "sent_batches": self.sent_batches,
+            "sent_records": self.sent_records,
+            "sent_bytes": self.sent_bytes,
+            "rejected_batches": self.rejected_batches,
+            "failures": self.failures,
+            "retry_in": round(retry_in, 1) if retry_in > 0 else 0,
+            "last_success": self.last_success,
+            "last_error": self.last_error
+        }
+
+
+def create_uplink(engine, config):
+    """Build, attach and start an UplinkSender from the application configuration, or return None"""
+    if not config['UPLINK_URL']:
+        return None
+    outbox = Outbox(config['UPLINK_DIR'], max_bytes=config['UPLINK_MAX_BYTES'])
+    sender = UplinkSender(
+        config['UPLINK_URL'],
+        outbox,
+        site=config['UPLINK_SITE'],
+        interval=config['UPLINK_INTERVAL'],
+        batch_size=config['UPLINK_BATCH_SIZE'],
+        timeout=config['UPLINK_TIMEOUT'],
+        token=config['UPLINK_TOKEN']
+    )
+    sender.attach(engine).start()
+    return sender
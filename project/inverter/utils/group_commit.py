@@ -0,0 +1,301 @@
+# inverter/utils/group_commit.py
+""" Group-commit write path for flash storage (SD cards)
+
+SD cards wear out by erase block, and every small write or fsync costs a
+read-modify-write of a whole block. Instead of writing each sample, event
+or setting as it comes, writers hand their data to a GroupCommitWriter:
+
+- append(path, data) buffers data to be appended to path
+- replace(path, data) buffers the new content of path; a later replace of
+  the same path supersedes it, and content equal to the file's is dropped
+- sources registered with add_source() are called right before each
+  commit to hand over what they buffered themselves
+
+Everything buffered is committed together every interval seconds, or as
+soon as max_bytes are buffered: appends are written and fsynced once per
+file, replaced files are written to a temporary file, fsynced and renamed
+over the old one, so a crash leaves either the old or the new content.
+The bytes written per category and per hour are tracked for diagnostics.
+
+Each process uses one writer, set up with configure() and returned by
+get_writer(); it is committed once more at exit.
+"""
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+HOUR = 3600.0
+
+
+class GroupCommitWriter:
+    """Buffer appends and file replacements and commit them together
+
+    Args:
+        interval (float): Seconds between commits
+        max_bytes (int): Buffered bytes that trigger an early commit
+        fsync (bool): fsync files (and directories after renames) on commit
+    """
+
+    def __init__(self, interval=30.0, max_bytes=256 * 1024, fsync=True):
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.commits = 0
+        self.files_written = 0
+        self.replaces_skipped = 0
+        self.last_commit = None
+        self.last_commit_time = None
+        self.last_error = None
+        self.started_at = time.monotonic()
+        self._appends = {}    # path -> [chunks]
+        self._replaces = {}   # path -> (data, category)
+        self._categories = {}  # path -> category of its appends
+        self._pending_bytes = 0
+        self._sources = []
+        self._written = {}  # category -> total bytes
+        self._history = deque()  # (monotonic, bytes) of the commits of the last hour
+        self._buffer_lock = threading.Lock()
+        self._commit_lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    # ------------------------------------------------------------------
+    # Buffering
+    # ------------------------------------------------------------------
+    def add_source(self, callback):
+        """Call callback() before every commit so it can hand over its own buffer"""
+        if callback not in self._sources:
+            self._sources.append(callback)
+
+    def remove_source(self, callback):
+        if callback in self._sources:
+            self._sources.remove(callback)
+
+    def append(self, path, data, category='data'):
+        """Buffer data to be appended to path"""
+        if not data:
+            return
+        with self._buffer_lock:
+            self._appends.setdefault(path, []).append(data)
+            self._categories[path] = category
+            self._pending_bytes += len(data)
+            full = self._pending_bytes >= self.max_bytes
+        self._ensure_started()
+        if full:
+            self._wakeup.set()
+
+    def replace(self, path, data, category='config'):
+        """Buffer the new content of path (bytes or str), superseding any earlier one"""
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with self._buffer_lock:
+            previous = self._replaces.get(path)
+            self._pending_bytes += len(data) - (len(previous[0]) if previous else 0)
+            self._replaces[path] = (data, category)
+        self._ensure_started()
+
+    def read(self, path):
+        """Return the content of path including buffered changes, or None if it does not exist"""
+        with self._buffer_lock:
+            if path in self._replaces:
+                return self._replaces[path][0]
+            pending = b''.join(self._appends.get(path, ()))
+        try:
+            with open(path, 'rb') as f:
+                return f.read() + pending
+        except OSError:
+            return pending or None
+
+    def pending(self, path=None):
+        """Return the number of bytes buffered (for path, or in total)"""
+        with self._buffer_lock:
+            if path is None:
+                return self._pending_bytes
+            replace = self._replaces.get(path)
+            return sum(len(chunk) for chunk in self._appends.get(path, ())) + (len(replace[0]) if replace else 0)
+
+    # ------------------------------------------------------------------
+    # Committing
+    # ------------------------------------------------------------------
+    def commit(self):
+        """Write everything buffered now; return the number of bytes written"""
+        with self._commit_lock:
+            for source in list(self._sources):
+                try:
+                    source()
+                except Exception as e:
+                    self.last_error = f"Source failed: {e}"
+            with self._buffer_lock:
+                appends, self._appends = self._appends, {}
+                replaces, self._replaces = self._replaces, {}
+                categories = self._categories
+                self._categories = {}
+                self._pending_bytes = 0
+            if not appends and not replaces:
+                return 0
+            written = 0
+            failed_appends, failed_replaces = {}, {}
+            for path, chunks in appends.items():
+                data = b''.join(chunks)
+                try:
+                    with open(path, 'ab') as f:
+                        f.write(data)
+                        if self.fsync:
+                            f.flush()
+                            os.fsync(f.fileno())
+                except OSError as e:
+                    self.last_error = f"Append to {path} failed: {e}"
+                    failed_appends[path] = chunks
+                    continue
+                written += self._account(categories.get(path, 'data'), len(data))
+            for path, (data, category) in replaces.items():
+                try:
+                    if self._unchanged(path, data):
+                        self.replaces_skipped += 1
+                        continue
+                    atomic_write(path, data, fsync=self.fsync)
+                except OSError as e:
+                    self.last_error = f"Replace of {path} failed: {e}"
+                    failed_replaces[path] = (data, category)
+                    continue
+                written += self._account(category, len(data))
+            if failed_appends or failed_replaces:
+                # Keep what failed for the next commit, in front of what came since
+                with self._buffer_lock:
+                    for path, chunks in failed_appends.items():
+                        self._appends[path] = chunks + self._appends.get(path, [])
+                        self._categories[path] = categories.get(path, 'data')
+                    for path, entry in failed_replaces.items():
+                        self._replaces.setdefault(path, entry)
+                    self._pending_bytes = sum(len(chunk) for chunks in self._appends.values() for chunk in chunks) + \
+                        sum(len(data) for data, _ in self._replaces.values())
+            now = time.monotonic()
+            self._history.append((now, written))
+            while self._history and self._history[0][0] < now - HOUR:
+                self._history.popleft()
+            self.commits += 1
+            self.last_commit = datetime.now().isoformat()
+            self.last_commit_time = now
+            return written
+
+    @contextmanager
+    def hold(self):
+        """Commit, then keep commits out while the caller rewrites files itself"""
+        with self._commit_lock:
+            self.commit()
+            yield
+
+    def _unchanged(self, path, data):
+        try:
+            if os.path.getsize(path) != len(data):
+                return False
+            with open(path, 'rb') as f:
+                return f.read() == data
+        except OSError:
+            return False
+
+    def _account(self, category, size):
+        self._written[category] = self._written.get(category, 0) + size
+        self.files_written += 1
+        return size
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._buffer_lock:
+                if self._thread is None:
+                    self._stop_event.clear()
+                    self._thread = threading.Thread(target=self._run, name='p18-commit', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        next_commit = time.monotonic() + self.interval
+        while not self._stop_event.is_set():
+            self._wakeup.wait(max(0.0, next_commit - time.monotonic()))
+            self._wakeup.clear()
+            if self._stop_event.is_set():
+                break
+            if time.monotonic() >= next_commit or self.pending() >= self.max_bytes:
+                self.commit()
+                next_commit = time.monotonic() + self.interval
+
+    def stop(self):
+        """Stop the commit thread and commit what is left"""
+        self._stop_event.set()
+        self._wakeup.set()
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(5)
+        self.commit()
+
+    def stats(self):
+        """Return the commit counters and bytes written as a dict"""
+        now = time.monotonic()
+        with self._buffer_lock:
+            last_hour = sum(size for when, size in self._history if when >= now - HOUR)
+            total = sum(self._written.values())
+            uptime = now - self.started_at
+            return {
+                "interval": self.interval,
+                "max_bytes": self.max_bytes,
+                "commits": self.commits,
+                "files_written": self.files_written,
+                "replaces_skipped": self.replaces_skipped,
+                "pending_bytes": self._pending_bytes,
+                "bytes_written": dict(self._written),
+                "bytes_written_last_hour": last_hour,
+                "bytes_per_hour": round(total / uptime * HOUR) if uptime >= 60 else None,
+                "last_commit": self.last_commit,
+                "last_error": self.last_error
+            }
+
+
+def atomic_write(path, data, fsync=True):
+    """Write data to path through a temporary file and a rename"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    durable_rename(temp_path, path, fsync)
+
+
+def durable_rename(source, path, fsync=True):
+    """Rename source (already written and synced) over path"""
+    os.replace(source, path)
+    if fsync and hasattr(os, 'O_DIRECTORY'):
+        # Make the rename itself durable
+        directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+
+_writer = GroupCommitWriter()
+atexit.register(lambda: _writer.commit())
+
+
+def configure(interval=None, max_bytes=None, fsync=None):
+    """Set the commit interval, byte threshold and fsync policy of this process's writer"""
+    if interval is not None:
+        _writer.interval = interval
+    if max_bytes is not None:
+        _writer.max_bytes = max_bytes
+    if fsync is not None:
+        _writer.fsync = fsync
+    _writer._wakeup.set()
+    return _writer
+
+
+def get_writer():
+    """Return this process's GroupCommitWriter"""
+    return _writer
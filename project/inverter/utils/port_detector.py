@@ -1,6 +1,15 @@
 # inverter/utils/port_detector.py
-"""Utility to detect and map inverters to serial ports"""
+"""Utility to detect and map inverters to serial ports
+
+Mappings are keyed by the stable identity of the USB adapter (vendor/product
+ID plus its serial number or USB bus location, as listed by
+serial.tools.list_ports), not by the /dev/ttyUSB* path that changes between
+reboots and replugs. The identity is resolved to the current device path
+from sysfs, without sending anything over the serial line.
+"""
 import serial
+import serial.tools.list_ports
+import threading
 import time
 import re
 import os
@@ -8,6 +17,10 @@ import glob
 import json
 from datetime import datetime
 
+from .group_commit import get_writer
+
+BY_ID_DIR = '/dev/serial/by-id'
+
 class InverterPortDetector:
     """Class to detect and manage inverter-to-port mappings"""
     
@@ -35,20 +48,94 @@ class InverterPortDetector:
         return {}
     
     def save_mapping(self, port, inverter_info):
-        """Save port to inverter mapping"""
-        self.port_mappings[port] = inverter_info
+        """Save port to inverter mapping, keyed by the port's stable identity"""
+        identity = self.port_identity(port)
+        info = dict(inverter_info)
+        info['port'] = port
+        port_info = self._port_info(port)
+        if port_info is not None and port_info.hwid != 'n/a':
+            info['hwid'] = port_info.hwid
+        # Drop older entries for the same inverter (e.g. keyed by a raw path)
+        serial_number = info.get('serial_number')
+        for key in [k for k, v in self.port_mappings.items()
+                    if k != identity and serial_number and v.get('serial_number') == serial_number]:
+            del self.port_mappings[key]
+        self.port_mappings[identity] = info
+        # Committed right away (atomically) so a failed write is reported to the caller
+        writer = get_writer()
         try:
-            with open(self.config_file, 'w') as f:
-                json.dump(self.port_mappings, f, indent=4)
-            return True
+            writer.replace(self.config_file, json.dumps(self.port_mappings, indent=4), 'config')
+            writer.commit()
         except Exception:
             return False
+        return not writer.pending(self.config_file)
     
-    def get_port_for_serial(self, serial_number):
-        """Get the saved port for a specific inverter serial number"""
-        for port, info in self.port_mappings.items():
+    def get_identity_for_serial(self, serial_number):
+        """Get the saved port identity for a specific inverter serial number"""
+        for identity, info in self.port_mappings.items():
             if info.get('serial_number') == serial_number:
-                return port
+                return identity
+        return None
+    
+    def get_port_for_serial(self, serial_number):
+        """Get the current device path of a specific inverter serial number"""
+        identity = self.get_identity_for_serial(serial_number)
+        if identity is None:
+            return None
+        return self.resolve_identity(identity)
+    
+    def _port_info(self, port):
+        """Return the list_ports entry for port (following symlinks), or None"""
+        device = os.path.realpath(port) if os.name != 'nt' else port
+        for info in serial.tools.list_ports.comports():
+            if info.device in (port, device):
+                return info
+        return None
+    
+    @staticmethod
+    def identity_of(port_info):
+        """Return the hardware identity of a list_ports entry, or None if it is not USB"""
+        if port_info.vid is None:
+            return None
+        identity = f"usb:{port_info.vid:04x}:{port_info.pid:04x}"
+        if port_info.serial_number:
+            return f"{identity}:sn={port_info.serial_number}"
+        if port_info.location:
+            # Adapters without a serial number (CH340, ...) are identified by their USB socket
+            return f"{identity}:loc={port_info.location}"
+        return identity
+    
+    def port_identity(self, port):
+        """Return a stable identity for port
+        
+        USB adapters are identified by vendor/product ID plus serial number or
+        bus location, other ports by their /dev/serial/by-id link if there is
+        one, and by the path itself otherwise.
+        """
+        port_info = self._port_info(port)
+        if port_info is not None:
+            identity = self.identity_of(port_info)
+            if identity:
+                return identity
+        if os.path.isdir(BY_ID_DIR):
+            device = os.path.realpath(port)
+            for link in sorted(glob.glob(os.path.join(BY_ID_DIR, '*'))):
+                if os.path.realpath(link) == device:
+                    return link
+        return port
+    
+    def resolve_identity(self, identity):
+        """Return the current device path for a port identity, or None if it is absent"""
+        if identity.startswith('usb:'):
+            for port_info in serial.tools.list_ports.comports():
+                if self.identity_of(port_info) == identity:
+                    return port_info.device
+            return None
+        if os.name == 'nt':
+            # COM ports have no stable identity of their own
+            return identity
+        if os.path.exists(identity):
+            return os.path.realpath(identity) if identity.startswith(BY_ID_DIR) else identity
         return None
     
     def scan_available_ports(self):
@@ -86,7 +173,9 @@ class InverterPortDetector:
         frame_start = f"^P{total_length:03d}{command}"
         frame_bytes = frame_start.encode('ascii')
         crc = self.calculate_crc16_modbus(frame_bytes)
-        complete_frame = frame_bytes + bytes([(crc >> 8) & 0xFF, crc & 0xFF, 0x0D])
+        # CRC bytes that would read as '(', CR or LF are sent incremented by one
+        crc_bytes = bytes(b + 1 if b in (0x28, 0x0D, 0x0A) else b for b in ((crc >> 8) & 0xFF, crc & 0xFF))
+        complete_frame = frame_bytes + crc_bytes + b'\r'
         return complete_frame
     
     def test_port_connection(self, port):
@@ -248,13 +337,18 @@ class InverterPortDetector:
         Otherwise, returns the first available port with an inverter.
         """
         # First check if we have a saved mapping for this serial number
-        if serial_number and serial_number in self.port_mappings:
-            saved_port = self.get_port_for_serial(serial_number)
-            if saved_port:
-                # Verify the inverter is still connected to this port
-                result = self.test_port_connection(saved_port)
-                if result.get("connected") and result.get("serial_number") == serial_number:
+        if serial_number:
+            identity = self.get_identity_for_serial(serial_number)
+            if identity:
+                saved_port = self.resolve_identity(identity)
+                if saved_port and identity != saved_port:
+                    # A hardware identity that is present is trusted without re-probing
                     return saved_port
+                if saved_port:
+                    # A plain path may now belong to another device, verify it
+                    result = self.test_port_connection(saved_port)
+                    if result.get("connected") and result.get("serial_number") == serial_number:
+                        return saved_port
         
         # If no saved mapping or the saved port is no longer valid,
         # scan for available inverters
@@ -273,4 +367,83 @@ class InverterPortDetector:
             self.save_mapping(port, inverters[port])
             return port
         
-        return None
\ No newline at end of file
+        return None
+
+
+class HotplugWatcher:
+    """Watch for an adapter (by identity) disappearing and reappearing
+    
+    The device list is read from sysfs every interval seconds; no serial
+    traffic is involved, so watching is cheap and an adapter that comes back,
+    under any /dev path, is reported within about one interval.
+    """
+    
+    def __init__(self, detector, identity, on_attach, on_detach=None, interval=0.25):
+        self.detector = detector
+        self.identity = identity
+        self.on_attach = on_attach
+        self.on_detach = on_detach
+        self.interval = interval
+        self.current = detector.resolve_identity(identity)
+        self.attaches = 0
+        self.detaches = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        """Start watching in a background thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='p18-hotplug', daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Stop watching"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(1)
+            self._thread = None
+    
+    def check(self):
+        """Compare the current device path with the last one and fire callbacks"""
+        port = self.detector.resolve_identity(self.identity)
+        if port == self.current:
+            return
+        previous, self.current = self.current, port
+        if port is None:
+            self.detaches += 1
+            if self.on_detach:
+                self.on_detach(previous)
+        else:
+            self.attaches += 1
+            self.on_attach(port)
+    
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception:
+                # A transient sysfs read error must not stop the watcher
+                pass
+    
+    def status(self):
+        """Return the watcher state as a dict"""
+        return {
+            "identity": self.identity,
+            "port": self.current,
+            "attaches": self.attaches,
+            "detaches": self.detaches
+        }
+
+
+def start_hotplug_watcher(monitor, detector, interval=0.25):
+    """Re-attach monitor whenever the adapter of its current port reappears"""
+    def on_detach(port):
+        # Fail fast right away instead of on the next I/O error
+        monitor.supervisor.report_fault(f"Adapter removed from {port}")
+    
+    watcher = HotplugWatcher(detector, detector.port_identity(monitor.port),
+                             on_attach=monitor.reattach, on_detach=on_detach, interval=interval)
+    watcher.start()
+    return watcher
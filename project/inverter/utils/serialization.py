@@ -0,0 +1,230 @@
+# inverter/utils/serialization.py
+"""Fast serialization for hot API responses
+
+Handlers that are polled constantly build their payload once and hand it to
+json_response(), which serializes with orjson when it is installed and falls
+back to the standard library otherwise. encoded_response() additionally
+negotiates a compact binary wire format (MessagePack or CBOR) from the Accept
+header. Payloads derived from a raw inverter frame can be kept pre-serialized
+in a SerializedResponseCache, so an unchanged frame is answered without
+parsing or encoding anything.
+"""
+import json
+import threading
+from flask import Response, request
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # cbor2 is optional
+    cbor2 = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+CBOR_MIMETYPE = 'application/cbor'
+
+# Alternative names clients send for the same wire formats
+MIMETYPE_ALIASES = {
+    'application/x-msgpack': MSGPACK_MIMETYPE,
+    'application/vnd.msgpack': MSGPACK_MIMETYPE,
+}
+
+_backend = 'orjson' if orjson is not None else 'stdlib'
+
+
+def _stdlib_dumps(obj):
+    """Serialize with the standard library using compact separators"""
+    return json.dumps(obj, separators=(',', ':'), default=str).encode('utf-8')
+
+
+def _orjson_dumps(obj):
+    """Serialize with orjson (non-string keys are allowed like in stdlib json)"""
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS, default=str)
+
+
+def configure(backend='auto'):
+    """Select the JSON backend: 'auto', 'orjson' or 'stdlib'
+
+    Returns the name of the backend that is actually in use. Asking for orjson
+    when it is not installed falls back to the standard library.
+    """
+    global _backend
+    if backend in ('auto', 'orjson') and orjson is not None:
+        _backend = 'orjson'
+    else:
+        _backend = 'stdlib'
+    return _backend
+
+
+def get_backend():
+    """Return the name of the active JSON backend"""
+    return _backend
+
+
+def dumps(obj):
+    """Serialize obj to compact JSON bytes using the active backend"""
+    if _backend == 'orjson':
+        return _orjson_dumps(obj)
+    return _stdlib_dumps(obj)
+
+
+def get_encoders():
+    """Return {mimetype: encoder} for every wire format available here"""
+    encoders = {JSON_MIMETYPE: dumps}
+    if msgpack is not None:
+        encoders[MSGPACK_MIMETYPE] = lambda obj: msgpack.packb(obj, use_bin_type=True, default=str)
+    if cbor2 is not None:
+        encoders[CBOR_MIMETYPE] = lambda obj: cbor2.dumps(obj, default=lambda encoder, value: encoder.encode(str(value)))
+    return encoders
+
+
+def encode(payload, mimetype=JSON_MIMETYPE):
+    """Serialize payload into the given wire format"""
+    return get_encoders()[mimetype](payload)
+
+
+def negotiate_mimetype():
+    """Pick the response wire format from the Accept header of the current request
+
+    A binary format is only used when the client names it explicitly and does
+    not rank JSON higher; wildcards such as "*/*" keep answering in JSON.
+    """
+    encoders = get_encoders()
+    explicit = {}
+    for value, quality in request.accept_mimetypes:
+        value = MIMETYPE_ALIASES.get(value, value)
+        explicit[value] = max(quality, explicit.get(value, 0))
+
+    json_quality = request.accept_mimetypes.quality(JSON_MIMETYPE)
+    best, best_quality = JSON_MIMETYPE, 0
+    for mimetype, quality in explicit.items():
+        if mimetype != JSON_MIMETYPE and mimetype in encoders and quality > best_quality:
+            best, best_quality = mimetype, quality
+    if best_quality > json_quality or (best_quality and best_quality == json_quality
+                                       and JSON_MIMETYPE not in explicit):
+        return best
+    return JSON_MIMETYPE
+
+
+def bytes_response(body, status=200, mimetype=JSON_MIMETYPE):
+    """Wrap an already serialized body in a Flask response"""
+    response = Response(body, status=status, mimetype=mimetype)
+    response.vary.add('Accept')
+    return response
+
+
+def json_response(payload, status=200):
+    """Serialize payload with the fast path and return a Flask response"""
+    return bytes_response(dumps(payload), status=status)
+
+
+def encoded_response(payload, status=200):
+    """Serialize payload in the wire format negotiated with the client"""
+    mimetype = negotiate_mimetype()
+    return bytes_response(encode(payload, mimetype), status=status, mimetype=mimetype)
+
+
+def flatten(record, prefix=''):
+    """Flatten nested dicts into a single level with dotted keys"""
+    flat = {}
+    for key, value in record.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        else:
+            flat[name] = value
+    return flat
+
+
+def unflatten(flat):
+    """Rebuild nested dicts from dotted keys produced by flatten()"""
+    record = {}
+    for name, value in flat.items():
+        target = record
+        parts = name.split('.')
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return record
+
+
+def to_columnar(records, fields=None):
+    """Convert a list of (nested) records into one array per field
+
+    Long key names appear once instead of once per record, which is what makes
+    the "compact" history format several times smaller than an array of
+    objects. Records missing a field contribute None to that column.
+    """
+    rows = [flatten(record) for record in records]
+    if fields is None:
+        fields = []
+        seen = set()
+        for row in rows:
+            for name in row:
+                if name not in seen:
+                    seen.add(name)
+                    fields.append(name)
+    return {
+        "count": len(rows),
+        "fields": list(fields),
+        "columns": {name: [row.get(name) for row in rows] for name in fields}
+    }
+
+
+class SerializedResponseCache:
+    """Last serialized body per endpoint, keyed by a fingerprint of its source
+
+    The fingerprint is normally the raw inverter frame the payload was parsed
+    from: as long as the inverter keeps returning the same frame, the cached
+    bytes are served as-is.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, fingerprint, mimetype=JSON_MIMETYPE):
+        """Return cached bytes for key if they were built from fingerprint"""
+        with self._lock:
+            entry = self._entries.get((key, mimetype))
+            if entry is not None and entry[0] == fingerprint:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, key, fingerprint, payload, mimetype=JSON_MIMETYPE):
+        """Serialize payload, remember it under key and return the bytes"""
+        body = encode(payload, mimetype)
+        with self._lock:
+            self._entries[(key, mimetype)] = (fingerprint, body)
+        return body
+
+    def invalidate(self, key=None):
+        """Drop the cached entries of one key, or all of them when key is None"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                for entry_key in [k for k in self._entries if k[0] == key]:
+                    del self._entries[entry_key]
+
+    def stats(self):
+        """Return cache hit/miss counters"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -0,0 +1,198 @@
+# inverter/warm_start.py
+""" Warm-start persistence of device identity, ratings and the last snapshot
+
+At 2400 baud it takes several seconds after a restart before PI, ID, VFW,
+GMN, PIRI and a first GS have all been answered. The last good replies and
+the last acquisition snapshot are therefore kept on disk, keyed by inverter
+serial number. At startup they are served immediately, flagged as stale, and
+a background thread revalidates them one by one against the device.
+"""
+import json
+import threading
+from datetime import datetime
+
+from .utils.group_commit import get_writer
+
+# Persisted replies, in revalidation order: identity first (to detect a swapped
+# inverter), then what the dashboard shows, then the rest
+WARM_COMMANDS = ('ID', 'GS', 'MOD', 'PI', 'VFW', 'GMN', 'PIRI')
+
+
+class WarmStartStore:
+    """JSON file with the persisted state of every inverter seen, by serial number"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Return the whole document ({} if missing or unreadable)"""
+        try:
+            data = get_writer().read(self.path)
+            return json.loads(data) if data else {}
+        except ValueError:
+            return {}
+
+    def entry(self, serial_number=None):
+        """Return the saved state of serial_number (default: the last inverter seen)"""
+        document = self.load()
+        serial_number = serial_number or document.get('last_serial')
+        return document.get('devices', {}).get(serial_number) if serial_number else None
+
+    def save(self, serial_number, responses, snapshot=None):
+        """Persist the state of one inverter atomically; raise OSError if it could not be written"""
+        with self._lock:
+            document = self.load()
+            devices = document.setdefault('devices', {})
+            entry = {
+                "saved": datetime.now().isoformat(),
+                "responses": responses
+            }
+            if snapshot is None and serial_number in devices:
+                # Keep the previous snapshot rather than losing it
+                snapshot = devices[serial_number].get('snapshot')
+            if snapshot is not None:
+                entry['snapshot'] = snapshot
+            devices[serial_number] = entry
+            document['last_serial'] = serial_number
+            # Committed right away so a failed write is reported to the caller
+            writer = get_writer()
+            writer.replace(self.path, json.dumps(document), 'config')
+            writer.commit()
+            if writer.pending(self.path):
+                raise OSError(writer.last_error or f"{self.path} was not written")
+
+
+class WarmStart:
+    """Restore persisted state into a monitor (and engine), revalidate and keep saving it
+
+    Args:
+        monitor: P18InverterMonitor whose replies are restored and persisted
+        engine: AcquisitionEngine to restore the last snapshot into, or None
+        store (WarmStartStore): Where the state lives
+        serial_number (str): Inverter to restore; default the last one seen
+        save_interval (float): Seconds between saves of the latest snapshot
+        persist (bool): False to restore and revalidate without ever writing
+    """
+
+    def __init__(self, monitor, engine, store, serial_number=None, save_interval=300, persist=True):
+        self.monitor = monitor
+        self.engine = engine
+        self.store = store
+        self.serial_number = serial_number
+        self.save_interval = save_interval
+        self.persist = persist
+        self.restored = False
+        self.revalidated = None
+        self.last_saved = None
+        self.last_error = None
+        self._saved_seq = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def restore(self):
+        """Load the persisted state into the monitor and engine; return True if there was any"""
+        entry = self.store.entry(self.serial_number)
+        if not entry:
+            return False
+        self.monitor.load_warm_responses(entry.get('responses') or {})
+        snapshot = entry.get('snapshot')
+        if snapshot and self.engine is not None and not self.engine.latest():
+            self.engine.ingest(dict(snapshot, stale=True))
+        self.restored = True
+        return True
+
+    def revalidate(self):
+        """Query every persisted command live, dropping the old state if the inverter changed"""
+        restored_serial = self._current_serial()
+        for command in WARM_COMMANDS:
+            if self._stop_event.is_set():
+                return
+            self.monitor.send_p18_command(command, fresh=True)
+            if command == 'ID':
+                serial_number = self._current_serial(live=True)
+                if serial_number and restored_serial and serial_number != restored_serial:
+                    # Another inverter is attached: none of the restored data applies
+                    self.monitor.discard_stale_responses()
+                    latest = self.engine.latest() if self.engine is not None else None
+                    if latest and latest['stale']:
+                        self.engine.reset()
+        self.revalidated = datetime.now().isoformat()
+
+    def _current_serial(self, live=False):
+        responses = self.monitor.last_responses if live else self.monitor.cached_responses
+        response = responses.get('ID')
+        if not response:
+            return None
+        serial_data = self.monitor.parse_serial_number(response)
+        return serial_data.get('serial_number') if serial_data else None
+
+    def save(self):
+        """Persist the live replies and the latest live snapshot of the current inverter"""
+        if not self.persist:
+            return False
+        serial_number = self._current_serial(live=True)
+        if not serial_number:
+            return False
+        responses = {command: self.monitor.last_responses[command]
+                     for command in WARM_COMMANDS if command in self.monitor.last_responses}
+        snapshot = None
+        latest = self.engine.latest() if self.engine is not None else None
+        if latest and not latest['stale']:
+            snapshot = {"seq": latest['seq'], "timestamp": latest['timestamp'], "data": latest['data']}
+        try:
+            self.store.save(serial_number, responses, snapshot)
+        except (OSError, TypeError, ValueError) as e:
+            self.last_error = f"Warm-start save error: {str(e)}"
+            return False
+        self.last_saved = datetime.now().isoformat()
+        self._saved_seq = latest['seq'] if latest else None
+        return True
+
+    def start(self):
+        """Restore now, then revalidate and save periodically in the background"""
+        self.restore()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='p18-warm-start', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread and save one last time"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(5)
+            self._thread = None
+        self.save()
+
+    def _run(self):
+        try:
+            self.revalidate()
+            self.save()
+        except Exception as e:
+            self.last_error = f"Warm-start revalidation error: {str(e)}"
+        while not self._stop_event.wait(self.save_interval):
+            latest = self.engine.latest() if self.engine is not None else None
+            if latest and latest['seq'] != self._saved_seq:
+                self.save()
+
+    def status(self):
+        """Return the warm-start state as a dict"""
+        return {
+            "restored": self.restored,
+            "revalidated": self.revalidated,
+            "stale_commands": sorted(self.monitor.stale_commands),
+            "last_saved": self.last_saved,
+            "last_error": self.last_error
+        }
+
+
+def create_warm_start(monitor, engine, config, persist=True):
+    """Build and start a WarmStart from the application configuration, or return None"""
+    if not config['WARM_START_FILE']:
+        return None
+    warm_start = WarmStart(monitor, engine, WarmStartStore(config['WARM_START_FILE']),
+                           serial_number=config['INVERTER_SERIAL'],
+                           save_interval=config['WARM_START_SAVE_INTERVAL'],
+                           persist=persist)
+    warm_start.start()
+    return warm_start
@@ -0,0 +1,18 @@
+# tests/test_adaptive.py
+""" Adaptive polling: the duty-cycle budget """
+import pytest
+
+from project.inverter.adaptive import AdaptivePollScheduler
+
+
+@pytest.mark.parametrize('bus_time', [0.2, 1.0, 3.0])
+def test_slow_polls_stay_within_the_duty_cycle(bus_time):
+    scheduler = AdaptivePollScheduler(base_interval=2, min_interval=1, max_interval=2, duty_cycle=0.25)
+    now = 0.0
+    for _ in range(50):
+        # Polls start delay apart (FixedRateClock), each busy for bus_time
+        delay = scheduler.observe({'working_mode': 'Line'}, bus_time, now=now)
+        now += delay
+    assert scheduler.measured_duty_cycle(now=now) <= scheduler.duty_cycle + 1e-9
+    assert scheduler.delay >= bus_time / scheduler.duty_cycle - 1e-9
+    assert (scheduler.budget_limited > 0) == (bus_time / 0.25 > 2)
@@ -0,0 +1,48 @@
+# tests/test_broker.py
+""" Serial broker scheduling: timeouts and command priority """
+import threading
+
+from project.inverter.broker import PRIORITY_HIGH, PRIORITY_LOW, BrokerTransport, CommandScheduler
+
+
+class BlockingMonitor:
+    """Monitor whose transactions wait until released"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.sent = []
+
+    def send_p18_command(self, command):
+        self.release.wait(5)
+        self.sent.append(command)
+        return f"^D005{command}", None
+
+    def take_bus_window(self):
+        return None
+
+
+def test_timed_out_job_never_reaches_the_bus():
+    monitor = BlockingMonitor()
+    scheduler = CommandScheduler(monitor)
+    scheduler.start()
+    try:
+        busy = threading.Thread(target=scheduler.submit, args=('GS',))
+        busy.start()
+        # Queued behind GS, given up on before the bus is free
+        assert scheduler.submit('MCHGV0552,0540', timeout=0.2) == (None, "Serial broker timeout")
+        monitor.release.set()
+        busy.join(5)
+        assert scheduler.submit('PI') == ("^D005PI", None)
+        assert monitor.sent == ['GS', 'PI']
+        assert scheduler._pending == {}
+    finally:
+        scheduler.stop()
+
+
+def test_set_commands_are_sent_at_high_priority():
+    transport = BrokerTransport('/nonexistent.sock', priority=PRIORITY_LOW)
+    requests = []
+    transport._request = lambda message: requests.append(message) or {'response': '^1'}
+    transport.send('GS')
+    transport.send('MCHGV0552,0540')
+    assert [message['priority'] for message in requests] == [PRIORITY_LOW, PRIORITY_HIGH]
@@ -0,0 +1,78 @@
+# tests/test_columnar.py
+""" Round trips of the columnar block encoding (run with python -m pytest project/tests) """
+import math
+
+import pytest
+
+from project.inverter import columnar
+
+TIMESTAMPS = [1_700_000_000_000_000 + index * 1_000_000 + (index % 3) * 17 for index in range(40)]
+COLUMNS = {
+    'battery.voltage': [52.1 + (index % 5) / 10 for index in range(40)],
+    'output.active_power': [1000 + index * 3 for index in range(40)],
+    'pv.pv1_power': [None if index % 7 == 0 else index * 11 for index in range(40)],
+    'status.load_on': [index % 2 == 0 for index in range(40)],
+    'status.fault': [None if index < 10 else bool(index % 3) for index in range(40)],
+    'temperature.heatsink': [float('nan') if index == 5 else 40.0 + index / 3 for index in range(40)],
+    'energy.total_wh': [2 ** 62 + index for index in range(40)],
+    'mode': ['Battery' if index < 20 else 'Line' for index in range(40)],
+    'missing': [None] * 40,
+}
+
+
+def same(a, b):
+    if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return True
+    return a == b and type(a) is type(b)
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def backend(request, monkeypatch):
+    if request.param == 'python':
+        monkeypatch.setattr(columnar, 'np', None)
+    elif columnar.np is None:
+        pytest.skip("numpy is not installed")
+    return request.param
+
+
+def test_block_round_trip(backend):
+    block = columnar.encode_block(TIMESTAMPS, COLUMNS)
+    timestamps, columns = columnar.decode_block(block)
+    assert list(timestamps) == TIMESTAMPS
+    assert set(columns) == set(COLUMNS)
+    for name, values in COLUMNS.items():
+        decoded = list(columns[name])
+        assert len(decoded) == len(values)
+        assert all(same(a, b) for a, b in zip(decoded, values)), name
+
+
+def test_selected_fields_skip_the_others(backend):
+    block = columnar.encode_block(TIMESTAMPS, COLUMNS)
+    _, columns = columnar.decode_block(block, fields=['mode', 'pv.pv1_power', 'unknown'])
+    assert columns == {'mode': COLUMNS['mode'], 'pv.pv1_power': COLUMNS['pv.pv1_power']}
+
+
+def test_skip_column_matches_decode():
+    for values in COLUMNS.values():
+        encoded = columnar.encode_column(values)
+        _, end = columnar.decode_column(encoded, 0, len(values))
+        assert columnar.skip_column(encoded, 0, len(values)) == end == len(encoded)
+
+
+def test_vectorized_gapless_numbers():
+    if columnar.np is None:
+        pytest.skip("numpy is not installed")
+    block = columnar.encode_block(TIMESTAMPS, COLUMNS)
+    _, columns = columnar.decode_block(block, vectorized=True)
+    assert isinstance(columns['output.active_power'], columnar.np.ndarray)
+    assert isinstance(columns['pv.pv1_power'], list)
+
+
+def test_header_and_corruption():
+    block = columnar.encode_block(TIMESTAMPS, COLUMNS)
+    assert columnar.read_header(block)[:3] == (40, TIMESTAMPS[0], TIMESTAMPS[-1])
+    assert [entry[1] for entry in columnar.iter_blocks(block + block[:-3])] == [40]
+    damaged = bytearray(block)
+    damaged[-1] ^= 0xFF
+    with pytest.raises(columnar.BlockError):
+        columnar.decode_block(bytes(damaged))
@@ -0,0 +1,114 @@
+# tests/test_fleet.py
+""" Hub mode: bounded summaries over slow and unreachable nodes """
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from project.inverter.fleet import NODE_ENDPOINTS, FleetHub
+
+PATHS = {path: endpoint for endpoint, (path, _) in NODE_ENDPOINTS.items()}
+
+
+class _NodeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        node = self.server.node
+        endpoint = PATHS.get(self.path)
+        with node.lock:
+            node.requests[endpoint] = node.requests.get(endpoint, 0) + 1
+            node.in_flight[endpoint] = node.in_flight.get(endpoint, 0) + 1
+            node.max_in_flight[endpoint] = max(node.max_in_flight.get(endpoint, 0), node.in_flight[endpoint])
+        try:
+            time.sleep(node.delay)
+            body = json.dumps(node.replies[endpoint]).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with node.lock:
+                node.in_flight[endpoint] -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubNode:
+    """Monitor node answering the hub's endpoints with canned replies after delay seconds"""
+
+    def __init__(self, pv1, pv2, load):
+        self.delay = 0.0
+        self.replies = {
+            'status': {'pv': {'pv1_power': pv1, 'pv2_power': pv2}, 'output': {'active_power': load},
+                       'battery': {'capacity_percent': 80}},
+            'mode': {'mode': 'Line'},
+            'faults': {'fault_code': 0},
+            'energy': {'total_energy_wh': 1000},
+        }
+        self.requests = {}
+        self.in_flight = {}
+        self.max_in_flight = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _NodeHandler)
+        self.server.daemon_threads = True
+        self.server.node = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def closed_port_url():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+@pytest.fixture
+def nodes():
+    nodes = {'a': StubNode(100, 50, 300), 'b': StubNode(200, 0, 400), 'slow': StubNode(10, 20, 500)}
+    yield nodes
+    for node in nodes.values():
+        node.stop()
+
+
+def test_summary_is_bounded_by_the_timeout(nodes):
+    urls = {name: node.url for name, node in nodes.items()}
+    urls['down'] = closed_port_url()
+    hub = FleetHub(urls, timeout=0.5, cache_ttl=0.1)
+    try:
+        first = hub.summary()
+        assert first['online'] == 3 and first['stale'] == 1
+        assert first['total_pv_power'] == 150 + 200 + 30
+        assert first['total_load_power'] == 300 + 400 + 500
+
+        nodes['slow'].delay = 3.0
+        time.sleep(0.2)
+        for _ in range(3):
+            started = time.monotonic()
+            summary = hub.summary()
+            assert time.monotonic() - started < 0.5 + 0.3
+        by_name = {node['name']: node for node in summary['node_status']}
+        # Reported from its cached reply while its request is still running
+        assert by_name['slow']['stale'] and by_name['slow']['pv_power'] == 30
+        assert not by_name['a']['stale'] and not by_name['b']['stale']
+        assert by_name['down']['stale'] and not by_name['down']['online']
+        assert summary['total_pv_power'] == 380 and summary['total_load_power'] == 1200
+
+        slow = nodes['slow']
+        assert slow.requests['status'] == 2
+        assert all(count == 1 for count in slow.max_in_flight.values())
+        assert all(count == 1 for node in nodes.values() for count in node.max_in_flight.values())
+    finally:
+        hub.close()
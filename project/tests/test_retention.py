@@ -0,0 +1,113 @@
+# tests/test_retention.py
+""" Retention tiers, rollup arithmetic and query planning """
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from project.inverter.retention import Compactor, aggregate, parse_tiers
+from project.inverter.store import TelemetryStore, to_micros
+from project.inverter.utils.group_commit import GroupCommitWriter
+
+DAY = date(2026, 1, 10)
+MIDNIGHT = datetime(2026, 1, 10)
+
+
+def test_parse_tiers():
+    assert parse_tiers('raw=7d,1m=90d,1h=5y') == [('raw', None, 7), ('1m', 60, 90), ('1h', 3600, 1825)]
+    assert parse_tiers('raw=36h,1h=forever') == [('raw', None, 2), ('1h', 3600, None)]
+    assert parse_tiers('') == [('raw', None, None)]
+    for text in ('1m=90d', 'raw=7d,7m=90d', 'raw=7d,1h=90d,1m=1y', 'raw=7d,1m=90d,1m=1y', 'raw=7x'):
+        with pytest.raises(ValueError):
+            parse_tiers(text)
+
+
+def test_aggregate_raw_samples():
+    start = to_micros(MIDNIGHT)
+    timestamps = [start + second * 1000000 for second in range(0, 180, 30)]
+    columns = {
+        'power': [100, 200, None, 400, 500, 600],
+        'load_on': [True, False, True, True, None, False],
+        'mode': ['Line', 'Line', 'Battery', None, 'Line', 'Battery'],
+    }
+    buckets, rows = aggregate([(timestamps, columns)], start, 60 * 1000000, sketch_fields=['power'])
+    assert buckets == [start, start + 60000000, start + 120000000]
+    assert rows['power@min'] == [100, 400, 500]
+    assert rows['power@max'] == [200, 400, 600]
+    assert rows['power@sum'] == [300, 400, 1100]
+    assert rows['power@count'] == [2, 1, 2]
+    assert rows['load_on@sum'] == [1, 2, 0] and rows['load_on@count'] == [2, 2, 1]
+    assert rows['mode@last'] == ['Line', 'Battery', 'Battery']
+    assert [sketch[:2] for sketch in rows['power@sketch']] == [[100, 200], [400, 400], [500, 600]]
+
+
+def test_aggregate_rollups_of_rollups_match_the_samples():
+    start = to_micros(MIDNIGHT)
+    timestamps = [start + second * 1000000 for second in range(0, 7200, 10)]
+    values = [(second % 97) / 10 for second in range(0, 7200, 10)]
+    block = (timestamps, {'v': values})
+    minute_buckets, minutes = aggregate([block], start, 60 * 1000000)
+    hours_from_minutes = aggregate([(minute_buckets, minutes)], start, 3600 * 1000000, raw=False)
+    hours_from_samples = aggregate([block], start, 3600 * 1000000)
+    assert hours_from_minutes == hours_from_samples
+    assert hours_from_samples[1]['v@count'] == [360, 360]
+
+
+@pytest.fixture
+def compactor(tmp_path):
+    writer = GroupCommitWriter(fsync=False)
+    store = TelemetryStore(str(tmp_path), writer=writer)
+    return Compactor(store, parse_tiers('raw=7d,1m=90d,1h=5y'), sketch_fields=['a'])
+
+
+def touch(store, day):
+    with open(store._path(day), 'wb'):
+        pass
+
+
+def test_plan(compactor):
+    raw, minutes, hours = compactor.stores
+    for day in (DAY,):
+        touch(raw, day)
+    for day in (DAY, DAY - timedelta(days=1)):
+        touch(minutes, day)
+    for day in (DAY, DAY - timedelta(days=1), DAY - timedelta(days=2)):
+        touch(hours, day)
+    before = MIDNIGHT - timedelta(days=1)
+    oldest = MIDNIGHT - timedelta(days=2)
+
+    # Only hourly rollups left: the edges are rounded out to whole hours
+    assert compactor.plan(oldest + timedelta(minutes=30), oldest + timedelta(hours=5)) == [
+        (2, oldest, oldest + timedelta(hours=5))]
+    # Hours where whole, minutes for the ragged start
+    assert compactor.plan(before + timedelta(hours=10, minutes=30, seconds=30), before + timedelta(hours=12)) == [
+        (1, before + timedelta(hours=10, minutes=30), before + timedelta(hours=11)),
+        (2, before + timedelta(hours=11), before + timedelta(hours=12))]
+    # Less than an hour: minutes, and raw samples for the partial minute
+    assert compactor.plan(MIDNIGHT + timedelta(hours=10, seconds=10), MIDNIGHT + timedelta(hours=10, minutes=5)) == [
+        (0, MIDNIGHT + timedelta(hours=10, seconds=10), MIDNIGHT + timedelta(hours=10, minutes=1)),
+        (1, MIDNIGHT + timedelta(hours=10, minutes=1), MIDNIGHT + timedelta(hours=10, minutes=5))]
+    # Spanning days
+    assert [piece[0] for piece in compactor.plan(oldest, MIDNIGHT + timedelta(days=1))] == [2, 2, 2]
+
+
+def test_distribution_needs_sketches_for_percentiles(compactor):
+    store = compactor.store
+    for second in range(0, 6 * 3600, 10):
+        timestamp = (MIDNIGHT + timedelta(seconds=second)).isoformat()
+        store.on_snapshot({'timestamp': timestamp, 'flat': {'a': second % 1000, 'b': second % 7}})
+    store.flush()
+    store.writer.commit()
+    while compactor.run_cycle(today=DAY + timedelta(days=2)):
+        pass
+    assert compactor.tier('1h').days() == [DAY]
+
+    start = MIDNIGHT + timedelta(seconds=35)
+    end = MIDNIGHT + timedelta(hours=5)
+    summaries, tiers = compactor.distribution(start, end, ['a', 'b'])
+    assert tiers == {'raw': 1, '1m': 1, '1h': 1}
+    expected = [second for second in range(0, 5 * 3600, 10) if second >= 35]
+    for field in ('a', 'b'):
+        assert summaries[field]['count'] == len(expected)
+    assert summaries['a']['digest'].count == len(expected)
+    # b has no sketches: the raw edges alone must not pass for its percentiles
+    assert summaries['b']['digest'] is None
@@ -0,0 +1,59 @@
+# tests/test_sketch.py
+""" Accuracy of the t-digest quantile sketch """
+import random
+
+import pytest
+
+from project.inverter.sketch import TDigest
+
+
+def rank_error(values, estimate, q):
+    """Return how far (as a fraction of the samples) estimate is from quantile q"""
+    below = sum(1 for value in values if value < estimate)
+    return abs(below / len(values) - q)
+
+
+@pytest.fixture
+def values():
+    generator = random.Random(50)
+    # Bimodal, like a load that is either idle or running
+    return [generator.gauss(300, 40) if index % 3 else generator.gauss(2500, 300) for index in range(20000)]
+
+
+def test_quantiles_within_a_percent_of_rank(values):
+    digest = TDigest()
+    digest.update(values)
+    assert digest.count == len(values)
+    assert digest.quantile(0) == min(values) and digest.quantile(1) == max(values)
+    for q in (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99):
+        assert rank_error(values, digest.quantile(q), q) < 0.01, q
+
+
+def test_merged_digests_match_one_digest(values):
+    parts = [TDigest() for _ in range(24)]
+    for index, value in enumerate(values):
+        parts[index % 24].add(value)
+    merged = TDigest()
+    for part in parts:
+        # Rollups store and reload their sketches between merges
+        merged.merge(TDigest.from_list(part.to_list()))
+    assert merged.count == len(values)
+    for q in (0.05, 0.5, 0.95):
+        assert rank_error(values, merged.quantile(q), q) < 0.01, q
+
+
+def test_cdf_and_bounded_size(values):
+    digest = TDigest(compression=50)
+    digest.update(values)
+    assert len(digest.to_list()) <= 2 + 2 * 50
+    for threshold in (250, 300, 350, 2200, 2500):
+        share = sum(1 for value in values if value <= threshold) / len(values)
+        assert abs(digest.cdf(threshold) - share) < 0.01, threshold
+    assert digest.cdf(min(values) - 1) == 0.0 and digest.cdf(max(values)) == 1.0
+
+
+def test_empty_digest():
+    digest = TDigest()
+    digest.update([None, float('nan')])
+    assert digest.quantile(0.5) is None and digest.cdf(1) is None and digest.to_list() == []
+    assert TDigest.from_list([]).merge(digest).count == 0
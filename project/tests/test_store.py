@@ -0,0 +1,21 @@
+# tests/test_store.py
+""" Time bounds of telemetry store queries """
+from datetime import date, datetime, timedelta, timezone
+
+from project.inverter.store import parse_time
+
+
+def test_parse_time_dates_and_naive_datetimes():
+    assert parse_time('2025-01-01') == datetime(2025, 1, 1)
+    assert parse_time('2025-01-01', end=True) == datetime(2025, 1, 2)
+    assert parse_time(date(2025, 1, 1), end=True) == datetime(2025, 1, 2)
+    assert parse_time('2025-01-01T06:30:00', end=True) == datetime(2025, 1, 1, 6, 30)
+
+
+def test_parse_time_converts_offsets_to_local_time():
+    expected = datetime(2025, 1, 1, tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+    assert parse_time('2025-01-01T00:00:00+00:00') == expected
+    assert parse_time('2025-01-01T02:00:00+02:00') == expected
+    assert parse_time(datetime(2025, 1, 1, 1, tzinfo=timezone(timedelta(hours=1)))) == expected
+    # Naive, so it compares with the stored timestamps
+    assert parse_time('2025-01-01T00:00:00+00:00').tzinfo is None
@@ -0,0 +1,114 @@
+# tests/test_uplink.py
+""" Store-and-forward uplink against the stand-in collector """
+import json
+import time
+
+import pytest
+
+from project.inverter.collector import StandInCollector
+from project.inverter.uplink import Outbox, UplinkSender
+from project.inverter.utils.group_commit import GroupCommitWriter
+
+
+def record(index):
+    return {"type": "sample", "site": "test", "seq": index, "fields": {"output.active_power": index}}
+
+
+@pytest.fixture
+def writer():
+    return GroupCommitWriter(fsync=False)
+
+
+@pytest.fixture
+def collector():
+    collector = StandInCollector(port=0)
+    collector.start()
+    yield collector
+    collector.stop()
+
+
+def make_sender(collector, outbox, **options):
+    return UplinkSender(collector.url, outbox, site='test', interval=10, **options)
+
+
+def fill(outbox, count, start=0):
+    outbox.append([record(index) for index in range(start, start + count)])
+    outbox.writer.commit()
+
+
+def test_resume_from_the_persisted_cursor(tmp_path, writer, collector):
+    outbox = Outbox(str(tmp_path), writer=writer)
+    fill(outbox, 5)
+    sender = make_sender(collector, outbox, batch_size=2)
+    lines, cursor = outbox.read_batch(sender.batch_size)
+    assert sender._post(lines, cursor)
+    writer.commit()
+    sender.session.close()
+
+    reopened = Outbox(str(tmp_path), writer=writer)
+    assert reopened.cursor == cursor
+    sender = make_sender(collector, reopened, batch_size=2)
+    assert sender.send_pending()
+    writer.commit()
+    assert [item['seq'] for item in collector.records] == [0, 1, 2, 3, 4]
+    assert reopened.pending_bytes() == 0 and sender.sent_batches == 2
+    sender.session.close()
+
+
+@pytest.mark.parametrize('status', [503, 401])
+def test_failures_back_off_and_keep_the_batch(tmp_path, writer, collector, status):
+    outbox = Outbox(str(tmp_path), writer=writer)
+    fill(outbox, 3)
+    sender = make_sender(collector, outbox)
+    collector.fail_with = status
+    assert not sender.send_pending()
+    first = sender._next_attempt - time.monotonic()
+    assert not sender.send_pending()
+    second = sender._next_attempt - time.monotonic()
+    # interval * 2 ** (attempt - 1), jittered down to half at most
+    assert 4 <= first <= 10 and 9 <= second <= 20
+    assert sender.failures == 2 and sender.rejected_batches == 0
+    assert outbox.cursor == (0, 0) and collector.records == []
+
+    collector.fail_with = None
+    assert sender.send_pending()
+    assert [item['seq'] for item in collector.records] == [0, 1, 2]
+    sender.session.close()
+
+
+def test_rejected_batch_is_skipped(tmp_path, writer, collector):
+    outbox = Outbox(str(tmp_path), writer=writer)
+    fill(outbox, 2)
+    sender = make_sender(collector, outbox, batch_size=1)
+    collector.fail_with = 400
+    lines, cursor = outbox.read_batch(1)
+    assert sender._post(lines, cursor)
+    assert outbox.cursor == cursor and sender.rejected_batches == 1
+    collector.fail_with = None
+    assert sender.send_pending()
+    assert [item['seq'] for item in collector.records] == [1]
+    sender.session.close()
+
+
+def test_duplicate_batch_cursor_is_ignored(tmp_path, writer, collector):
+    outbox = Outbox(str(tmp_path), writer=writer)
+    fill(outbox, 3)
+    sender = make_sender(collector, outbox)
+    lines, cursor = outbox.read_batch()
+    # The acknowledgement was lost: the same batch goes out again
+    assert sender._post(lines, cursor) and sender._post(lines, cursor)
+    assert collector.duplicates == 1 and len(collector.records) == 3
+    sender.session.close()
+
+
+def test_size_limit_drops_the_oldest_segment(tmp_path, writer):
+    outbox = Outbox(str(tmp_path), segment_bytes=200, max_bytes=500, writer=writer)
+    for start in range(0, 40, 4):
+        fill(outbox, 4, start)
+    assert outbox.dropped_segments > 0
+    segments = outbox.segments()
+    assert outbox.cursor == (segments[0], 0)
+    assert segments[0] > 0 and outbox.pending_bytes() <= 500 + 200
+    # The oldest records are gone; what is left is the newest, in order
+    seqs = [json.loads(line)['seq'] for line in outbox.read_batch()[0]]
+    assert seqs[0] > 0 and seqs == list(range(seqs[0], 40))